@@ -0,0 +1,137 @@
+###################################################
+# Compiled codelist cache shared by the dataset and
+# measure definitions.
+#
+# Each codelist CSV is compiled once into a sorted
+# integer array of SNOMED CT codes (plus a category
+# index, e.g. Label_6) and stored on disk under
+# codelists/.cache/. The cache key is the sha256
+# of the CSV's bytes (with its pinned sha in
+# codelists/codelists.json, if any), so any change
+# to the file on disk, or a new pinned version,
+# invalidates it automatically. Reloading hashes
+# the CSV and reads one small binary file.
+###################################################
+
+import csv
+import hashlib
+import json
+import struct
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+
+CODELISTS_DIR = Path("codelists")
+CACHE_DIR = CODELISTS_DIR / ".cache"
+
+# magic, format version, number of codes, number of categories
+HEADER = struct.Struct("<4sHII")
+MAGIC = b"CLST"
+FORMAT_VERSION = 1
+
+
+class CompiledCodelist:
+    def __init__(self, codes, category_index=None, categories=None):
+        # codes: sorted array('Q'); category_index: array('H') aligned with codes
+        self.codes_array = codes
+        self.category_index = category_index
+        self.categories = categories or []
+
+    def __len__(self):
+        return len(self.codes_array)
+
+    def __contains__(self, code):
+        code = int(code)
+        i = bisect_left(self.codes_array, code)
+        return i < len(self.codes_array) and self.codes_array[i] == code
+
+    @property
+    def codes(self):
+        """Codes as strings, for `is_in()`."""
+        return [str(code) for code in self.codes_array]
+
+    def category_map(self):
+        """Code to category mapping, for `to_category()`."""
+        if self.category_index is None:
+            raise ValueError("Codelist was compiled without a category column")
+        return {
+            str(code): self.categories[index]
+            for code, index in zip(self.codes_array, self.category_index)
+        }
+
+    def to_bytes(self):
+        categories = json.dumps(self.categories).encode()
+        index = self.category_index if self.category_index is not None else array("H")
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, len(self.codes_array), len(index))
+        return header + self.codes_array.tobytes() + index.tobytes() + categories
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, n_codes, n_index = HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Not a compiled codelist")
+        offset = HEADER.size
+        codes = array("Q")
+        codes.frombytes(data[offset : offset + n_codes * codes.itemsize])
+        offset += n_codes * codes.itemsize
+        index = array("H")
+        index.frombytes(data[offset : offset + n_index * index.itemsize])
+        offset += n_index * index.itemsize
+        categories = json.loads(data[offset:])
+        return cls(codes, index if n_index else None, categories)
+
+
+def compile_codelist(path, column="code", category_column=None):
+    with open(path, newline="") as f:
+        rows = {
+            int(row[column]): row[category_column] if category_column else None
+            for row in csv.DictReader(f)
+            if row[column]
+        }
+    codes = array("Q", sorted(rows))
+    if category_column is None:
+        return CompiledCodelist(codes)
+    categories = sorted(set(rows.values()))
+    lookup = {category: i for i, category in enumerate(categories)}
+    index = array("H", (lookup[rows[code]] for code in codes))
+    return CompiledCodelist(codes, index, categories)
+
+
+def pinned_sha(path):
+    """The codelist's sha in codelists.json ("" if not pinned)."""
+    try:
+        pins = json.loads((CODELISTS_DIR / "codelists.json").read_text())["files"]
+    except (OSError, KeyError, ValueError):
+        return ""
+    return pins.get(Path(path).name, {}).get("sha", "")
+
+
+def cache_key(path, column, category_column):
+    # The pin alone can disagree with the file (local edits, stale pins)
+    content_hash = hashlib.sha256(Path(path).read_bytes()).hexdigest()
+    key = f"{content_hash}:{pinned_sha(path)}:{column}:{category_column}:{FORMAT_VERSION}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def load_codelist(path, column="code", category_column=None):
+    """Load a codelist CSV via the compiled cache, compiling it on a miss."""
+    cache_path = CACHE_DIR / f"{Path(path).stem}-{cache_key(path, column, category_column)}.bin"
+    try:
+        return CompiledCodelist.from_bytes(cache_path.read_bytes())
+    except (OSError, ValueError, struct.error):
+        pass
+
+    codelist = compile_codelist(path, column, category_column)
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(".tmp")
+        tmp_path.write_bytes(codelist.to_bytes())
+        tmp_path.replace(cache_path)
+        # Drop compiled versions of this codelist that no longer match
+        for stale in CACHE_DIR.glob(f"{Path(path).stem}-*.bin"):
+            if stale != cache_path:
+                stale.unlink()
+    except OSError:
+        # Read-only checkout: use the compiled codelist without caching it
+        pass
+    return codelist
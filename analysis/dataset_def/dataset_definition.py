@@ -9,86 +9,95 @@
 #   University of Oxford, 2025
 ###################################################
 
-from ehrql import create_dataset, case, when, codelist_from_csv
-from ehrql.tables.tpp import (
-    patients,
-    ons_deaths,
-    clinical_events,
-    practice_registrations,
-    addresses,
+from argparse import ArgumentParser
+from datetime import date, timedelta
+
+from ehrql import create_dataset
+from ehrql.tables.tpp import patients, ons_deaths
+
+from variables import tpp_coded_death_date, ethnicity
+from deaths import (
+    has_ons_death_date,
+    has_tpp_death_date,
+    ref_death_date,
+    at_death,
+    age_at_death,
+    last_registration,
+    death_population,
+    flag_any_date_death,
+    cat_ons_death_date,
+    cat_tpp_death_date,
+    flag_any_date_death_implausible,
+    death_source,
+    death_date_ref,
+    death_minus_reg_start,
+    reg_end_minus_death,
+    registration_status,
+    flag_is_registered,
+    is_registered_within_grace,
+    reg_start_timing_group,
+    reg_end_timing_group,
+    tpp_date_or_coded,
+    death_source_tpp_date_or_coded,
+    diff_dod,
+    dod_diff_groups,
+    age_band,
+    imd_quintile,
+    rural_urban,
+    region,
 )
 
-dataset = create_dataset()
-
-
 # -----------------------------------------------------------------------------
-# Population
+# Parameters
 # -----------------------------------------------------------------------------
+# Passed after `--`, e.g.
+#   generate-dataset analysis/dataset_def/dataset_definition.py --output ... -- --since 2026-04-01
+parser = ArgumentParser()
 
-# Death definitions ------------------
-
-# ONS death date recorded
-has_ons_death_date = ons_deaths.date.is_not_null()
-
-# TPP structured death date recorded
-has_tpp_death_date = patients.date_of_death.is_not_null()
-
-# TPP coded death recorded
-tpp_coded_death_codes = codelist_from_csv(
-    "codelists/nhsd-primary-care-domain-refsets-death_cod.csv",
-    column="code",
-)
-
-tpp_coded_death_event = (
-    clinical_events
-    .where(clinical_events.snomedct_code.is_in(tpp_coded_death_codes))
-    .sort_by(clinical_events.date)
-    .first_for_patient()
-)
+# Incremental extraction: only extract patients whose death, coded-death or
+# registration data changed on or after this date (the stored watermark).
+# analysis/merge_incremental_extract.py (local only) merges the result with a
+# stored extract into a new file.
+parser.add_argument("--since", default=None)
 
-has_tpp_coded_death = tpp_coded_death_event.date.is_not_null()
+# Late-registered deaths and back-dated registration changes can carry dates
+# before the watermark; look back this many days before it.
+parser.add_argument("--lookback-days", type=int, default=90)
 
-# Death recorded in any source
-has_any_death = (
-    has_ons_death_date
-    | has_tpp_death_date
-    | has_tpp_coded_death
-)
+# Year partition: only extract patients whose death_date_ref_year is this year,
+# so a single partition written by analysis/partition_extract.py can be recomputed.
+parser.add_argument("--ref-death-year", type=int, default=None)
 
-# Reference death date:
-# 1) ONS death date
-# 2) TPP structured death date
-# 3) TPP coded death date
+args = parser.parse_args()
 
-ref_death_date = case(
-    when(has_ons_death_date).then(ons_deaths.date),
-    when(has_tpp_death_date).then(patients.date_of_death),
-    when(has_tpp_coded_death).then(tpp_coded_death_event.date),
-)
+dataset = create_dataset()
 
 
-# Age at reference death date ---------------
-age_at_death = patients.age_on(ref_death_date)
+# -----------------------------------------------------------------------------
+# Population
+# -----------------------------------------------------------------------------
 
-# Keep plausible ages only.
-# Also retain infants aged <1 year, whose integer age may be recorded as 0.
-has_possible_age = (
-    ((age_at_death >= 0) & (age_at_death < 110))
-    | (patients.date_of_birth.year == ref_death_date.year)
-)
+# Deceased population: death recorded in any source, plausible age,
+# male/female sex (see deaths.py)
+population = death_population
+
+# Incremental extraction: death or registration data changed since the watermark
+if args.since is not None:
+    changed_from = date.fromisoformat(args.since) - timedelta(days=args.lookback_days)
+    has_changed = (
+        ons_deaths.date.is_on_or_after(changed_from)
+        | patients.date_of_death.is_on_or_after(changed_from)
+        | tpp_coded_death_date.is_on_or_after(changed_from)
+        | last_registration.start_date.is_on_or_after(changed_from)
+        | last_registration.end_date.is_on_or_after(changed_from)
+    )
+    population = population & has_changed
 
-# Restrict to male/female categories for disclosure control -----------------------
-has_non_disclosive_sex = (
-    (patients.sex == "male")
-    | (patients.sex == "female")
-)
+# Single reference death year partition
+if args.ref_death_year is not None:
+    population = population & (death_date_ref.year == args.ref_death_year)
 
-# Define population
-dataset.define_population(
-    has_any_death
-    & has_possible_age
-    & has_non_disclosive_sex
-)
+dataset.define_population(population)
 
 # -----------------------------------------------------------------------------
 # Variables
@@ -97,59 +106,74 @@ dataset.define_population(
 # Death ------
 dataset.ons_death_date = ons_deaths.date
 dataset.tpp_death_date = patients.date_of_death
-dataset.tpp_coded_death_date = tpp_coded_death_event.date
+dataset.tpp_coded_death_date = tpp_coded_death_date
 # dataset.ref_death_date = ref_death_date
 
-
-## Last registration -----
-last_registration = (
-    practice_registrations
-    .sort_by(
-        practice_registrations.start_date,
-        practice_registrations.end_date,
-    )
-    .last_for_patient()
-)
-
 dataset.last_registration_start_date = last_registration.start_date
 dataset.last_registration_end_date = last_registration.end_date
 
 # Demographic --------
 
-### Age at ref date of death 
+### Age at ref date of death
 dataset.date_of_birth = patients.date_of_birth
-dataset.age = patients.age_on(ref_death_date)
+dataset.age = age_at_death
 
 # Sex
 dataset.sex = patients.sex
 
-#Ethnicity
-ethnicity5 = codelist_from_csv(
-  "codelists/opensafely-ethnicity-snomed-0removed.csv",
-  column="code",
-  category_column="Label_6", # it's 6 because there is an additional "6 - Not stated" but this is not represented in SNOMED, instead corresponding to no ethnicity code
-)
-
-dataset.ethnicity = (
-    clinical_events
-    .where(clinical_events.snomedct_code.is_in(ethnicity5))
-    .sort_by(clinical_events.date)
-    .last_for_patient()
-    .snomedct_code
-    .to_category(ethnicity5)
-)
+#Ethnicity (latest ethnicity category, see variables.py)
+dataset.ethnicity = ethnicity
 
 #IMD
-dataset.imd = addresses.for_patient_on(ref_death_date).imd_rounded
+dataset.imd = at_death.address.imd_rounded
 
-# Rurality 
-dataset.rural_urban = addresses.for_patient_on(ref_death_date).rural_urban_classification
+# Rurality
+dataset.rural_urban = rural_urban
 
 # Practice region
-dataset.region = practice_registrations.for_patient_on(ref_death_date).practice_nuts1_region_name
+dataset.region = region
 
 ### Practice (anonymous)
-dataset.practice = practice_registrations.for_patient_on(ref_death_date).practice_pseudo_id
+dataset.practice = at_death.registration.practice_pseudo_id
+
+# Derived (see deaths.py) --------
+
+# ONS or TPP death date
+dataset.has_ons_date_death = has_ons_death_date
+dataset.has_tpp_death_date = has_tpp_death_date
+dataset.flag_any_date_death = flag_any_date_death
+
+# Plausibility of death dates
+dataset.cat_ons_death_date = cat_ons_death_date
+dataset.cat_tpp_death_date = cat_tpp_death_date
+dataset.flag_any_date_death_implausible = flag_any_date_death_implausible
+
+# Death source
+dataset.death_source = death_source
+dataset.death_date_ref = death_date_ref
+dataset.death_date_ref_year = death_date_ref.year
+
+# Registration timing
+dataset.death_minus_reg_start = death_minus_reg_start
+dataset.reg_end_minus_death = reg_end_minus_death
+dataset.registration_status = registration_status
+dataset.flag_is_registered = flag_is_registered
+dataset.is_registered_within_grace = is_registered_within_grace
+dataset.reg_start_timing_group = reg_start_timing_group
+dataset.reg_end_timing_group = reg_end_timing_group
+
+# TPP dated or coded death (reference year: ONS, then TPP, then TPP coded)
+dataset.death_date_ref_year_w_tpp_codes = ref_death_date.year
+dataset.tpp_date_or_coded = tpp_date_or_coded
+dataset.death_source_tpp_date_or_coded = death_source_tpp_date_or_coded
+
+# TPP - ONS death date difference
+dataset.diff_dod = diff_dod
+dataset.dod_diff_groups = dod_diff_groups
+
+# Demographic groups
+dataset.age_band = age_band
+dataset.imd_quintile = imd_quintile
 
 # -----------------------------------------------------------------------------
 # Dummy data
@@ -159,17 +183,17 @@ dataset.configure_dummy_data(
     population_size=10000,
     timeout=180,
     additional_population_constraint=(
-        (dataset.tpp_death_date.is_on_or_between("2008-01-01", "2026-05-01")
-            | dataset.tpp_death_date.is_null()
+        (patients.date_of_death.is_on_or_between("2008-01-01", "2026-05-01")
+            | patients.date_of_death.is_null()
         ) &
-        (dataset.tpp_coded_death_date.is_on_or_between("2008-01-01", "2026-05-01")
-            | dataset.tpp_coded_death_date.is_null()
+        (tpp_coded_death_date.is_on_or_between("2008-01-01", "2026-05-01")
+            | tpp_coded_death_date.is_null()
         ) &
-        (dataset.ons_death_date.is_on_or_between("2015-01-01", "2026-05-01")
-            | dataset.ons_death_date.is_null()
+        (ons_deaths.date.is_on_or_between("2015-01-01", "2026-05-01")
+            | ons_deaths.date.is_null()
         ) &
-        (dataset.last_registration_start_date.is_on_or_between("2008-01-01", "2026-05-01")
-            | dataset.last_registration_start_date.is_null()
+        (last_registration.start_date.is_on_or_between("2008-01-01", "2026-05-01")
+            | last_registration.start_date.is_null()
         )
     ),
 )
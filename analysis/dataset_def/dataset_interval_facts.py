@@ -0,0 +1,83 @@
+###################################################
+# This script extracts, once per patient, the facts
+# that every INTERVAL-dependent expression in the
+# measure definitions depends on: death dates, date
+# of birth, sex, last deregistration date and all
+# registration spans.
+#
+# analysis/interval_counts.py bins these facts into
+# any interval grid (yearly, monthly, weekly) without
+# re-evaluating the population once per interval.
+#
+# Local only (dummy tables or tools/local_backend.py),
+# not a project.yaml action: the released measures
+# come from the measure definitions.
+###################################################
+
+from ehrql import create_dataset
+from ehrql.tables.tpp import (
+    patients,
+    ons_deaths,
+    practice_registrations,
+)
+
+dataset = create_dataset()
+
+# Earliest interval start the facts are used for
+facts_start_date = "2009-01-01"
+
+# -----------------------------------------------------------------------------
+# Population
+# -----------------------------------------------------------------------------
+
+## Registered with a TPP practice at any point on or after the earliest interval start
+has_registration = (
+    practice_registrations
+    .where(
+        practice_registrations.end_date.is_on_or_after(facts_start_date)
+        | practice_registrations.end_date.is_null()
+    )
+    .exists_for_patient()
+)
+
+## Exclude people with non-male or female sex due to disclosure risk
+non_disclosive_sex = (patients.sex == "male") | (patients.sex == "female")
+
+dataset.define_population(has_registration & non_disclosive_sex)
+
+# -----------------------------------------------------------------------------
+# Patient-level facts
+# -----------------------------------------------------------------------------
+
+dataset.date_of_birth = patients.date_of_birth
+dataset.sex = patients.sex
+dataset.tpp_death_date = patients.date_of_death
+dataset.ons_death_date = ons_deaths.date
+
+# Last deregistration date (same ordering as the measure definitions)
+dataset.last_registration_end_date = (
+    practice_registrations
+    .sort_by(
+        practice_registrations.start_date,
+        practice_registrations.end_date,
+    )
+    .last_for_patient()
+    .end_date
+)
+
+# -----------------------------------------------------------------------------
+# Registration spans (one row per registration)
+# -----------------------------------------------------------------------------
+
+dataset.add_event_table(
+    "registrations",
+    start_date=practice_registrations.start_date,
+    end_date=practice_registrations.end_date,
+    practice_pseudo_id=practice_registrations.practice_pseudo_id,
+)
+
+# -----------------------------------------------------------------------------
+# Dummy data
+# -----------------------------------------------------------------------------
+
+dataset.configure_dummy_data(population_size=10000)
@@ -0,0 +1,167 @@
+###################################################
+# Death definitions shared by the death dataset
+# (dataset_definition.py) and the death source
+# measures (measure_death_source.py): reference
+# death dates, population criteria and the derived
+# classifications (see variables.py).
+###################################################
+
+from ehrql import case, when
+from ehrql.tables.tpp import patients, ons_deaths, practice_registrations
+
+from variables import (
+    tpp_coded_death_date,
+    snapshot_on,
+    cat_implausible_death_date,
+    cat_death_source,
+    cat_registration_status,
+    cat_last_reg_start_to_death,
+    cat_last_reg_end_minus_death,
+    cat_tpp_date_or_coded,
+    cat_days_difference,
+    cat_age_band,
+    cat_imd_quintile,
+    rural_urban_labels,
+    GRACE_DAYS,
+)
+
+# -----------------------------------------------------------------------------
+# Population
+# -----------------------------------------------------------------------------
+
+# Death definitions ------------------
+
+# ONS death date recorded
+has_ons_death_date = ons_deaths.date.is_not_null()
+
+# TPP structured death date recorded
+has_tpp_death_date = patients.date_of_death.is_not_null()
+
+# TPP coded death recorded (earliest coded death date, see variables.py)
+has_tpp_coded_death = tpp_coded_death_date.is_not_null()
+
+# Death recorded in any source
+has_any_death = (
+    has_ons_death_date
+    | has_tpp_death_date
+    | has_tpp_coded_death
+)
+
+# Reference death date:
+# 1) ONS death date
+# 2) TPP structured death date
+# 3) TPP coded death date
+
+ref_death_date = case(
+    when(has_ons_death_date).then(ons_deaths.date),
+    when(has_tpp_death_date).then(patients.date_of_death),
+    when(has_tpp_coded_death).then(tpp_coded_death_date),
+)
+
+
+# Address, registration and age at reference death date (see variables.py) ---
+at_death = snapshot_on(ref_death_date)
+
+# Age at reference death date ---------------
+age_at_death = at_death.age
+
+# Keep plausible ages only.
+# Also retain infants aged <1 year, whose integer age may be recorded as 0.
+has_possible_age = (
+    ((age_at_death >= 0) & (age_at_death < 110))
+    | (patients.date_of_birth.year == ref_death_date.year)
+)
+
+# Restrict to male/female categories for disclosure control -----------------------
+has_non_disclosive_sex = (
+    (patients.sex == "male")
+    | (patients.sex == "female")
+)
+
+## Last registration -----
+last_registration = (
+    practice_registrations
+    .sort_by(
+        practice_registrations.start_date,
+        practice_registrations.end_date,
+    )
+    .last_for_patient()
+)
+
+# Deceased population
+death_population = (
+    has_any_death
+    & has_possible_age
+    & has_non_disclosive_sex
+)
+
+# -----------------------------------------------------------------------------
+# Derived classifications
+# -----------------------------------------------------------------------------
+
+# ONS or TPP death date
+flag_any_date_death = has_ons_death_date | has_tpp_death_date
+
+# Plausibility of death dates
+cat_ons_death_date = cat_implausible_death_date(ons_deaths.date, patients.date_of_birth)
+cat_tpp_death_date = cat_implausible_death_date(patients.date_of_death, patients.date_of_birth)
+flag_any_date_death_implausible = (
+    ~cat_ons_death_date.is_in(["ok", "missing"])
+    | ~cat_tpp_death_date.is_in(["ok", "missing"])
+)
+
+# Death source
+death_source = cat_death_source(ons_deaths.date, patients.date_of_death)
+
+# Reference death date for the main analysis: ONS death date, otherwise TPP
+death_date_ref = ons_deaths.date.when_null_then(patients.date_of_death)
+
+# Registration timing
+death_minus_reg_start = (death_date_ref - last_registration.start_date).days
+reg_end_minus_death = (last_registration.end_date - death_date_ref).days
+
+registration_status = cat_registration_status(
+    death_date=death_date_ref,
+    reg_start=last_registration.start_date,
+    reg_end=last_registration.end_date,
+    grace_days=GRACE_DAYS,
+)
+
+# Registered flags
+flag_is_registered = registration_status.is_in([
+    "death_during_registration",
+    "death_during_registration_open_end",
+])
+is_registered_within_grace = registration_status.is_in([
+    "death_during_registration",
+    "death_during_registration_open_end",
+    "death_after_deregistration_within_grace",
+])
+
+# Timing groups
+reg_start_timing_group = cat_last_reg_start_to_death(death_minus_reg_start)
+reg_end_timing_group = cat_last_reg_end_minus_death(reg_end_minus_death)
+
+# TPP dated or coded death
+tpp_date_or_coded = cat_tpp_date_or_coded(patients.date_of_death, tpp_coded_death_date)
+death_source_tpp_date_or_coded = cat_death_source(
+    ons_deaths.date,
+    patients.date_of_death.when_null_then(tpp_coded_death_date),
+)
+
+# Difference between TPP and ONS death dates (days)
+diff_dod = (patients.date_of_death - ons_deaths.date).days
+dod_diff_groups = cat_days_difference(diff_dod)
+
+# Demographic groups at reference death date
+age_band = cat_age_band(age_at_death)
+imd_quintile = cat_imd_quintile(at_death.address.imd_rounded)
+rural_urban = at_death.address.rural_urban_classification.map_values(rural_urban_labels)
+region = at_death.registration.practice_nuts1_region_name
+
+# Main analysis population: dated death, no implausible date, registered at death
+is_main_analysis = (
+    flag_any_date_death
+    & ~flag_any_date_death_implausible
+    & flag_is_registered
+)
@@ -0,0 +1,14 @@
+###################################################
+# Grace periods after deregistration, shared by the
+# definitions (via variables.py) and by the
+# python:v2 scripts in analysis/, so this module
+# must not import ehrQL. The R reports read it too
+# (read_grace_periods() in 0_utility_functions.R),
+# so keep each constant a one-line integer literal.
+###################################################
+
+# Grace period after deregistration (days): main analysis
+GRACE_DAYS = 30
+
+# Grace periods for the sensitivity analysis (days)
+GRACE_PERIODS = [0, 30, 60, 90]
@@ -0,0 +1,169 @@
+###################################################
+# This script creates counts of deaths by death
+# source (ONS only / TPP only / Both) and by
+# ONS - TPP death date difference, by reference
+# death year, overall and by subgroup.
+#
+# Aggregate-only versions of the tables in
+# 4_death_source_comparison.R and
+# 5_sources_date_agreement.R. These are counts:
+# the numerator is the count, the denominator is
+# the same count and the ratio is always 1.
+# (ehrQL groups the denominator by the same
+# columns, so a share of the year's deaths cannot
+# be a measure ratio; as the R tables' perc, it is
+# computed from the numerators of a year.)
+# Definitions are shared with the death dataset
+# (see deaths.py).
+#
+# Only the subgroup families are named
+# {name}_overall / {name}_{subgroup}, so
+# sdc_measures.py applies secondary suppression to
+# them and not to the single tables.
+###################################################
+
+from datetime import date
+
+from ehrql import INTERVAL, create_measures, months, years
+from ehrql.tables.tpp import patients
+
+from variables import ethnicity
+from deaths import (
+    death_population,
+    is_main_analysis,
+    has_ons_death_date,
+    has_tpp_death_date,
+    flag_any_date_death_implausible,
+    flag_is_registered,
+    ref_death_date,
+    death_date_ref,
+    death_source,
+    death_source_tpp_date_or_coded,
+    tpp_date_or_coded,
+    dod_diff_groups,
+    age_band,
+    imd_quintile,
+    rural_urban,
+    region,
+)
+
+# Reference death years (ONS death date, otherwise TPP); the main analysis
+# population excludes dates outside the study period (2009-2026)
+intervals = years(18).starting_on("2009-01-01")
+
+# Every reference death year, for the tables that are not restricted to the
+# study period: one interval, grouped by year
+all_years = [(date(1900, 1, 1), date(2099, 12, 31))]
+
+# Months from 2025 to the end of the study period
+intervals_25_26 = months(15).starting_on("2025-01-01")
+
+## Subgroups (None = overall)
+subgroups = {
+    "overall": None,
+    "age_band": age_band,
+    "sex": patients.sex,
+    "ethnicity": ethnicity,
+    "imd_quintile": imd_quintile,
+    "rural_urban": rural_urban,
+    "region": region,
+}
+
+# Deaths in the interval ------------------------------------------------
+
+# Main analysis population, by reference death date (ONS, then TPP)
+main_analysis_death = (
+    death_population
+    & is_main_analysis
+    & death_date_ref.is_during(INTERVAL)
+)
+
+# Death recorded in both sources, no implausible date, registered at death
+both_sources_death = (
+    death_population
+    & has_ons_death_date
+    & has_tpp_death_date
+    & ~flag_any_date_death_implausible
+    & flag_is_registered
+    & death_date_ref.is_during(INTERVAL)
+)
+
+# Any death, by reference death date including TPP coded deaths
+any_death_w_tpp_codes = death_population & ref_death_date.is_during(INTERVAL)
+
+# Main analysis population, by reference death date including TPP coded deaths
+main_analysis_death_w_tpp_codes = (
+    death_population
+    & is_main_analysis
+    & ref_death_date.is_during(INTERVAL)
+)
+
+
+# Create meassures
+measures = create_measures()
+
+measures.configure_dummy_data(population_size=10000)
+
+# Disclosure control is applied once, by sdc_measures.py: ehrQL's own rounding
+# would round the counts twice, and cells it suppressed would reach the
+# secondary suppression as zeros rather than as suppressed.
+measures.configure_disclosure_control(enabled=False)
+
+measures.define_defaults(intervals=intervals)
+
+
+def define_count_measures(name, deaths, group_by):
+    for sub_population, group in subgroups.items():
+        measures.define_measure(
+            f"{name}_{sub_population}",
+            numerator=deaths,
+            denominator=deaths,
+            group_by=(
+                {**group_by, sub_population: group} if group is not None else group_by
+            ),
+        )
+
+
+# Death source by year (4_death_source_comparison.R) -------------------
+define_count_measures(
+    "death_source", main_analysis_death, {"death_source": death_source}
+)
+
+# Death source by month, 2025-2026
+measures.define_measure(
+    "monthly_death_source_25_26",
+    numerator=main_analysis_death,
+    denominator=main_analysis_death,
+    intervals=intervals_25_26,
+    group_by={"death_source": death_source},
+)
+
+# TPP dated or coded deaths, every year (tpp_death_code_or_date.csv)
+measures.define_measure(
+    "tpp_death_code_or_date",
+    numerator=any_death_w_tpp_codes,
+    denominator=any_death_w_tpp_codes,
+    intervals=all_years,
+    group_by={
+        "ref_death_year": ref_death_date.year,
+        "tpp_date_or_coded": tpp_date_or_coded,
+    },
+)
+
+# Death source including TPP coded deaths, every year
+# (table_death_source_overall_any_tpp.csv)
+measures.define_measure(
+    "any_tpp_death_source",
+    numerator=main_analysis_death_w_tpp_codes,
+    denominator=main_analysis_death_w_tpp_codes,
+    intervals=all_years,
+    group_by={
+        "ref_death_year": ref_death_date.year,
+        "death_source_tpp_date_or_coded": death_source_tpp_date_or_coded,
+    },
+)
+
+# Date difference by year (5_sources_date_agreement.R) -----------------
+define_count_measures(
+    "dod_diff", both_sources_death, {"dod_diff_groups": dod_diff_groups}
+)
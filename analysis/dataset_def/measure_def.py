@@ -6,8 +6,30 @@
 #   Bennett Institute for Applied Data Science
 #   University of Oxford, 2025
 ###################################################
-from ehrql import INTERVAL, create_measures, years, case, when, codelist_from_csv, days
-from ehrql.tables.tpp import patients, practice_registrations, ons_deaths, addresses, clinical_events
+from argparse import ArgumentParser
+from datetime import date
+
+from ehrql import INTERVAL, create_measures, years, case, when, days, minimum_of
+from ehrql.tables.tpp import patients, practice_registrations, ons_deaths
+
+from variables import (
+    ethnicity,
+    snapshot_on,
+    GRACE_DAYS,
+    days_after_deregistration,
+    cat_grace_band,
+    source_bits,
+)
+from rollup import ROLLUP_MEASURE, ROLLUP_SUBGROUPS
+
+# Parameters, passed after `--`, e.g.
+#   generate-measures analysis/dataset_def/measure_def.py --output ... -- --intervals-from 2024-01-01
+# --check-sources adds the overall measures defined directly per source
+# (tools/check_source_measures.py)
+parser = ArgumentParser()
+parser.add_argument("--intervals-from", default=None)
+parser.add_argument("--check-sources", action="store_true")
+args = parser.parse_args()
 
 ##########
 #Numerator: dead during the period and registred on ONS/GP date
@@ -25,7 +47,7 @@ last_registration_end = (
 GP_death_in_interval = (
     patients.date_of_death.is_during(INTERVAL) &
     (
-        patients.date_of_death.is_on_or_before(last_registration_end   + days(30)) |
+        patients.date_of_death.is_on_or_before(last_registration_end   + days(GRACE_DAYS)) |
         last_registration_end.is_null()
     )
 )
@@ -33,12 +55,36 @@ GP_death_in_interval = (
 ONS_death_in_interval = (
     ons_deaths.date.is_during(INTERVAL) &
     (
-        ons_deaths.date.is_on_or_before(last_registration_end   + days(30)) |
+        ons_deaths.date.is_on_or_before(last_registration_end   + days(GRACE_DAYS)) |
         last_registration_end.is_null()
     )
 )
 
-global_death_in_interval = GP_death_in_interval | ONS_death_in_interval
+## Grace period sensitivity: deaths in the interval at any grace period, by
+## days from deregistration to death in bands between GRACE_PERIODS (see
+## variables.py). Counts for each grace period are the cumulative sums over
+## bands (analysis/grace_period_measures.py).
+GP_days_after_deregistration = days_after_deregistration(
+    patients.date_of_death, last_registration_end
+)
+ONS_days_after_deregistration = days_after_deregistration(
+    ons_deaths.date, last_registration_end
+)
+
+GP_death_in_interval_any_grace = patients.date_of_death.is_during(INTERVAL)
+ONS_death_in_interval_any_grace = ons_deaths.date.is_during(INTERVAL)
+global_death_in_interval_any_grace = (
+    GP_death_in_interval_any_grace | ONS_death_in_interval_any_grace
+)
+
+# Global: the source (dated in the interval) closest to registration
+global_days_after_deregistration = minimum_of(
+    case(when(GP_death_in_interval_any_grace).then(GP_days_after_deregistration)),
+    case(when(ONS_death_in_interval_any_grace).then(ONS_days_after_deregistration)),
+)
+
+# Address, registration and age at interval start (see variables.py)
+at_start = snapshot_on(INTERVAL.start_date)
 
 #Denominator: inclusion criteria
 ## Include people alive
@@ -46,38 +92,45 @@ was_alive_GP = patients.date_of_death.is_on_or_after(INTERVAL.start_date) | pati
 was_alive_ONS = ons_deaths.date.is_on_or_after(INTERVAL.start_date) | ons_deaths.date.is_null() 
 
 ## Include people registered with a TPP practice
-has_registration = practice_registrations.for_patient_on(INTERVAL.start_date).exists_for_patient()
+has_registration = at_start.registration.exists_for_patient()
 
 ## Exclude people >110 years due to risk of incorrectly recorded age
-has_possible_age= ((patients.age_on(INTERVAL.start_date) < 110) & (patients.age_on(INTERVAL.start_date) > 0)) | (patients.date_of_birth.year == INTERVAL.start_date.year)
+has_possible_age= ((at_start.age < 110) & (at_start.age > 0)) | (patients.date_of_birth.year == INTERVAL.start_date.year)
 
 ## Exclude people with non-male or female sex due to disclosure risk
 non_disclosive_sex= (patients.sex == "male") | (patients.sex == "female")
 
 
 # define denominator
-GP_denominator =  (was_alive_GP
-                   & has_registration 
-                   & has_possible_age 
-                   & non_disclosive_sex)
+## Criteria shared by every source; each source adds its own was_alive term
+is_eligible = has_registration & has_possible_age & non_disclosive_sex
 
-ONS_denominator =  (was_alive_ONS
-                   & has_registration 
-                   & has_possible_age 
-                   & non_disclosive_sex)
+GP_denominator = was_alive_GP & is_eligible
+ONS_denominator = was_alive_ONS & is_eligible
+global_denominator = (was_alive_ONS | was_alive_GP) & is_eligible
 
-global_denominator =  ( (was_alive_ONS | was_alive_GP)
-                       & has_registration 
-                       & has_possible_age 
-                       & non_disclosive_sex) 
+## Source eligibility bitmask (see variables.py): alive at interval start and
+## death in the interval for each source, evaluated once per patient-interval.
+## Patients in the global denominator are counted by bitmask, and the GP, ONS
+## and global measures are unpacked from the counts
+## (analysis/unpack_source_measures.py).
+mortality_source_bits = source_bits(
+    was_alive_GP, was_alive_ONS, GP_death_in_interval, ONS_death_in_interval
+)
 
 #Specify intervals
 intervals = years(16).starting_on("2009-01-01")
 
+# Incremental measures: only intervals starting on or after this date, so
+# tools/incremental_measures.py can merge them with cached closed intervals
+if args.intervals_from is not None:
+    intervals_from = date.fromisoformat(args.intervals_from)
+    intervals = [interval for interval in intervals if interval[0] >= intervals_from]
+
 
 #Subgroups
 ## Age 
-age = patients.age_on(INTERVAL.start_date)
+age = at_start.age
 age_band = case(
     when((age < 45)).then("0-44"),
     when((age >= 45) & (age < 65)).then("45-64"),
@@ -89,12 +142,12 @@ age_band = case(
 ## Place of death
 death_place = ons_deaths.place
 ## Practice region
-region = practice_registrations.for_patient_on(INTERVAL.start_date).practice_nuts1_region_name
+region = at_start.registration.practice_nuts1_region_name
 ## Rurality
-rural_urban = addresses.for_patient_on(INTERVAL.start_date).rural_urban_classification
+rural_urban = at_start.address.rural_urban_classification
 
 #IMD
-imd = addresses.for_patient_on(INTERVAL.start_date).imd_rounded
+imd = at_start.address.imd_rounded
 
 IMD_q10 = case(
         when((imd >= 0) & (imd < int(32844 * 1 / 10))).then("1 (most deprived)"),
@@ -112,19 +165,7 @@ IMD_q10 = case(
 
 
 #Ethnicity
-# Ethnicity
-
-ethnicity5 = codelist_from_csv(
-  "codelists/opensafely-ethnicity-snomed-0removed.csv",
-  column="code",
-  category_column="Label_6", # it's 6 because there is an additional "6 - Not stated" but this is not represented in SNOMED, instead corresponding to no ethnicity code
-)
-
-ethnicity = clinical_events.where(
-        clinical_events.snomedct_code.is_in(ethnicity5)
-    ).sort_by(
-        clinical_events.date
-    ).last_for_patient().snomedct_code.to_category(ethnicity5)
+# Latest ethnicity category (shared with dataset_definition.py, see variables.py)
 
 # Sex
 sex = patients.sex
@@ -134,272 +175,81 @@ measures = create_measures()
 
 measures.configure_dummy_data(population_size=100000)
 
+# These are intermediate, highly sensitive counts: the source bitmask groups
+# are summed by unpack_source_measures.py and the grace bands by
+# grace_period_measures.py, so they must not be suppressed or rounded first.
+# Disclosure control is applied once, to the summed measures (sdc_measures.py).
+measures.configure_disclosure_control(enabled=False)
+
+# All measures share the same intervals
+measures.define_defaults(intervals=intervals)
+
+## Denominator by source (grace period sensitivity)
+sources = {
+    "GP": GP_denominator,
+    "ONS": ONS_denominator,
+    "global": global_denominator,
+}
+
+## Subgroups of the rollup cube (see rollup.py)
+subgroups = {
+    "age_band": age_band,
+    "sex": sex,
+    "death_place": death_place,
+    "region": region,
+    "rural_urban": rural_urban,
+    "IMD_q10": IMD_q10,
+    "ethnicity": ethnicity,
+}
+
+## Grace period sensitivity numerator and grace band by source
+grace_sources = {
+    "GP": (GP_death_in_interval_any_grace, GP_days_after_deregistration),
+    "ONS": (ONS_death_in_interval_any_grace, ONS_days_after_deregistration),
+    "global": (global_death_in_interval_any_grace, global_days_after_deregistration),
+}
+
+# Mortality by source ---------------------------------------------------
+# One rollup measure, grouped by source bitmask and every subgroup: each
+# patient-interval is evaluated and counted once. The overall and
+# single-subgroup measures are sums over its groups, derived when it is
+# unpacked into {GP,ONS,global}_mortality_{overall,subgroup}
+# (ONS_mortality_region is not reported, see project.yaml).
+measures.define_measure(
+    ROLLUP_MEASURE,
+    numerator=global_denominator,
+    denominator=global_denominator,
+    group_by={
+        "source_bits": mortality_source_bits,
+        **{name: subgroups[name] for name in ROLLUP_SUBGROUPS},
+    },
+)
+
+
+# Grace period sensitivity ---------------------------------------------
+# One run covers every grace period in GRACE_PERIODS: the deregistration
+# gap is computed once per patient and used as a group.
+for source, (numerator, days_after) in grace_sources.items():
+    measures.define_measure(
+        f"{source}_mortality_grace_band",
+        numerator=numerator,
+        denominator=sources[source],
+        group_by={"grace_band": cat_grace_band(days_after)},
+    )
 
-#GP date of death ------------------------------------------------------
-
-measures.define_measure(
-    "GP_mortality_overall",
-    numerator= GP_death_in_interval,
-    denominator= GP_denominator,
-    intervals=intervals,
-)
-
-## Age band
-measures.define_measure(
-    "GP_mortality_age_band",
-    numerator= GP_death_in_interval,
-    denominator= GP_denominator,
-    intervals=intervals,
-    group_by={
-        "age_band": age_band,
-    },
-)
-
-# Sex
-measures.define_measure(
-    "GP_mortality_sex",
-    numerator= GP_death_in_interval,
-    denominator= GP_denominator,
-    intervals=intervals,
-    group_by={
-        "sex": sex,
-    },
-)
-
-## Place of death
-measures.define_measure(
-    "GP_mortality_death_place",
-    numerator= GP_death_in_interval,
-    denominator= GP_denominator,
-    intervals=intervals,
-    group_by={
-        "death_place": death_place,
-    },
-)
-## Practice region
-measures.define_measure(
-    "GP_mortality_region",
-    numerator= GP_death_in_interval,
-    denominator= GP_denominator,
-    intervals=intervals,
-    group_by={
-        "region": region,
-    },
-)
-## Rurality 
-measures.define_measure(
-    "GP_mortality_rural_urban",
-    numerator= GP_death_in_interval,
-    denominator= GP_denominator,
-    intervals=intervals,
-    group_by={
-        "rural_urban": rural_urban,
-    },
-)
-
-## IMD_q10
-measures.define_measure(
-    "GP_mortality_IMD_q10",
-    numerator= GP_death_in_interval,
-    denominator= GP_denominator,
-    intervals=intervals,
-    group_by={
-        "IMD_q10": IMD_q10,
-    },
-)
-## Ethnicity
-measures.define_measure(
-    "GP_mortality_ethnicity",
-    numerator= GP_death_in_interval,
-    denominator= GP_denominator,
-    intervals=intervals,
-    group_by={
-        "ethnicity": ethnicity,
-    },
-)
-
-
-# ONS date of death --------------------------------------------------
-
-##Overall
-measures.define_measure(
-    "ONS_mortality_overall",
-    numerator= ONS_death_in_interval,
-    denominator= ONS_denominator,
-    intervals=intervals,
-)
-
-## Age band
-measures.define_measure(
-    "ONS_mortality_age_band",
-    numerator= ONS_death_in_interval,
-    denominator= ONS_denominator,
-    intervals=intervals,
-    group_by={
-        "age_band": age_band,
-    },
-)
-
-## Sex
-measures.define_measure(
-    "ONS_mortality_sex",
-    numerator= ONS_death_in_interval,
-    denominator= ONS_denominator,
-    intervals=intervals,
-    group_by={
-        "sex": sex,
-    },
-)
-
-## Place of death
-measures.define_measure(
-    "ONS_mortality_death_place",
-    numerator= ONS_death_in_interval,
-    denominator= ONS_denominator,
-    intervals=intervals,
-    group_by={
-        "death_place": death_place,
-    },
-)
-
-## Rurality 
-measures.define_measure(
-    "ONS_mortality_rural_urban",
-    numerator= ONS_death_in_interval,
-    denominator= ONS_denominator,
-    intervals=intervals,
-    group_by={
-        "rural_urban": rural_urban,
-    },
-)
-
-## IMD_q10
-measures.define_measure(
-    "ONS_mortality_IMD_q10",
-    numerator= ONS_death_in_interval,
-    denominator= ONS_denominator,
-    intervals=intervals,
-    group_by={
-        "IMD_q10": IMD_q10,
-    },
-)
-## Ethnicity
-measures.define_measure(
-    "ONS_mortality_ethnicity",
-    numerator= ONS_death_in_interval,
-    denominator= ONS_denominator,
-    intervals=intervals,
-    group_by={
-        "ethnicity": ethnicity,
-    },
-)
-
-# Global date of death -------------------------------------
-
-
-##Overall
-measures.define_measure(
-    "global_mortality_overall",
-    numerator= global_death_in_interval,
-    denominator= global_denominator,
-    intervals=intervals,
-)
-
-## Age band
-measures.define_measure(
-    "global_mortality_age_band",
-    numerator= global_death_in_interval,
-    denominator= global_denominator,
-    intervals=intervals,
-    group_by={
-        "age_band": age_band,
-    },
-)
-
-## Sex
-measures.define_measure(
-    "global_mortality_sex",
-    numerator= global_death_in_interval,
-    denominator= global_denominator,
-    intervals=intervals,
-    group_by={
-        "sex": sex,
-    },
-)
-
-## Place of death
-measures.define_measure(
-    "global_mortality_death_place",
-    numerator= global_death_in_interval,
-    denominator= global_denominator,
-    intervals=intervals,
-    group_by={
-        "death_place": death_place,
-    },
-)
-## Practice region
-measures.define_measure(
-    "global_mortality_region",
-    numerator= global_death_in_interval,
-    denominator= global_denominator,
-    intervals=intervals,
-    group_by={
-        "region": region,
-    },
-)
-## Rurality 
-measures.define_measure(
-    "global_mortality_rural_urban",
-    numerator= global_death_in_interval,
-    denominator= global_denominator,
-    intervals=intervals,
-    group_by={
-        "rural_urban": rural_urban,
-    },
-)
-
-## IMD_q10
-measures.define_measure(
-    "global_mortality_IMD_q10",
-    numerator= global_death_in_interval,
-    denominator= global_denominator,
-    intervals=intervals,
-    group_by={
-        "IMD_q10": IMD_q10,
-    },
-)
-## Ethnicity
-measures.define_measure(
-    "global_mortality_ethnicity",
-    numerator= global_death_in_interval,
-    denominator= global_denominator,
-    intervals=intervals,
-    group_by={
-        "ethnicity": ethnicity,
-    },
-)
-
-
-
-
-# def measure_definition(source, sub_population):
-#    group_by_block = ""
-#    if sub_population != "overall":
-#        group_by_block = f'''
-#    group_by={{
-#        "{sub_population}": {sub_population},
-#    }},'''
-#
-#    measure_code = f'''measures.define_measure(
-#    name="{source}_mortality_{sub_population}",
-#    numerator="{source}_death_in_interval",
-#    denominator="{source}_denominator",
-#    intervals=intervals,
-#    {group_by_block}
-#    )'''
-#    
-#    return measure_code
-
-
-#measure_definition(GP, age_band)
 
+# Check: overall measures by source --------------------------------------
+# Defined directly from each source's numerator and denominator, to compare
+# with the unpacked bitmask counts (unpack_source_measures.py drops them).
+if args.check_sources:
+    direct_sources = {
+        "GP": (GP_death_in_interval, GP_denominator),
+        "ONS": (ONS_death_in_interval, ONS_denominator),
+        "global": (GP_death_in_interval | ONS_death_in_interval, global_denominator),
+    }
+    for source, (numerator, denominator) in direct_sources.items():
+        measures.define_measure(
+            f"check_{source}_mortality_overall",
+            numerator=numerator,
+            denominator=denominator,
+        )
@@ -7,10 +7,20 @@
 #   University of Oxford, 2025
 ###################################################
 
+from argparse import ArgumentParser
+from datetime import date
+
 from ehrql import INTERVAL, create_measures, years, case, when, days
-from ehrql.tables.tpp import patients, practice_registrations, ons_deaths, addresses
+from ehrql.tables.tpp import patients, practice_registrations, ons_deaths
 
+from variables import snapshot_on, source_bits, GRACE_DAYS
  
+# Parameters, passed after `--`, e.g.
+#   generate-measures analysis/dataset_def/measure_practice.py --output ... -- --intervals-from 2024-01-01
+parser = ArgumentParser()
+parser.add_argument("--intervals-from", default=None)
+args = parser.parse_args()
+
 ##########
 #Numerator: dead during the period and registred on ONS/GP date
 
@@ -28,7 +38,7 @@ last_registration_end = (
 GP_death_in_interval = (
     patients.date_of_death.is_during(INTERVAL) &
     (
-        patients.date_of_death.is_on_or_before(last_registration_end  + days(30) )|
+        patients.date_of_death.is_on_or_before(last_registration_end  + days(GRACE_DAYS) )|
         last_registration_end.is_null()
     )
 )
@@ -36,13 +46,14 @@ GP_death_in_interval = (
 ONS_death_in_interval = (
     ons_deaths.date.is_during(INTERVAL) &
     (
-        ons_deaths.date.is_on_or_before(last_registration_end   + days(30)) |
+        ons_deaths.date.is_on_or_before(last_registration_end   + days(GRACE_DAYS)) |
         last_registration_end.is_null()
     )
 )
 
-global_death_in_interval = GP_death_in_interval | ONS_death_in_interval
 
+# Registration and age at interval start (see variables.py)
+at_start = snapshot_on(INTERVAL.start_date)
 
 #Denominator: inclusion criteria
 ## Include people alive
@@ -52,40 +63,42 @@ was_alive_ONS = ons_deaths.date.is_on_or_after(INTERVAL.start_date) | ons_deaths
 ## Include people registered with a TPP practice
 has_registration = (
     # Registered at the beginning of the period
-   ( practice_registrations.for_patient_on(INTERVAL.start_date).exists_for_patient())
+   ( at_start.registration.exists_for_patient())
     |
     # Born in the same calendar year with a valid registration
     ((patients.date_of_birth.is_during(INTERVAL)) & (practice_registrations.where(practice_registrations.start_date.is_during(INTERVAL))).exists_for_patient())
 )
 
 ## Exclude people >110 years due to risk of incorrectly recorded age
-has_possible_age= ((patients.age_on(INTERVAL.start_date) < 110)  & (patients.age_on(INTERVAL.start_date) > 0) | (patients.date_of_birth.is_during(INTERVAL)))
+has_possible_age= ((at_start.age < 110)  & (at_start.age > 0) | (patients.date_of_birth.is_during(INTERVAL)))
 
 ## Exclude people with non-male or female sex due to disclosure risk
 non_disclosive_sex= (patients.sex == "male") | (patients.sex == "female")
 
 
 # define denominator
-GP_denominator =  (was_alive_GP
-                   & has_registration 
-                   & has_possible_age 
-                   & non_disclosive_sex)
+## Criteria shared by every source; each source adds its own was_alive term
+is_eligible = has_registration & has_possible_age & non_disclosive_sex
 
-ONS_denominator =  (was_alive_ONS
-                   & has_registration
-                   & has_possible_age 
-                   & non_disclosive_sex)
+global_denominator = (was_alive_ONS | was_alive_GP) & is_eligible
 
-global_denominator =  ( (was_alive_ONS | was_alive_GP)
-                       & has_registration 
-                       & has_possible_age 
-                       & non_disclosive_sex) 
+## Source eligibility bitmask (see variables.py), unpacked into the GP, ONS
+## and global measures by analysis/unpack_source_measures.py
+mortality_source_bits = source_bits(
+    was_alive_GP, was_alive_ONS, GP_death_in_interval, ONS_death_in_interval
+)
 
 #Specify intervals
 intervals = years(6).starting_on("2019-01-01")
 
+# Incremental measures: only intervals starting on or after this date, so
+# tools/incremental_measures.py can merge them with cached closed intervals
+if args.intervals_from is not None:
+    intervals_from = date.fromisoformat(args.intervals_from)
+    intervals = [interval for interval in intervals if interval[0] >= intervals_from]
+
 ## Practice
-practice_gral = practice_registrations.for_patient_on(INTERVAL.start_date).practice_pseudo_id 
+practice_gral = at_start.registration.practice_pseudo_id
 
 practice_babies = (practice_registrations
                    .where(patients.date_of_birth.is_during(INTERVAL))
@@ -106,35 +119,19 @@ measures = create_measures()
 
 measures.configure_dummy_data(population_size=100000)
 
-## GP
-measures.define_measure(
-    "GP_mortality_practice",
-    numerator= GP_death_in_interval,
-    denominator= GP_denominator,
-    intervals=intervals,
-    group_by={
-        "practice": practice,
-    },
-)
-
-## ONS
-measures.define_measure(
-    "ONS_mortality_practice",
-    numerator= ONS_death_in_interval,
-    denominator= ONS_denominator,
-    intervals=intervals,
-    group_by={
-        "practice": practice,
-    },
-)
+# Intermediate, highly sensitive counts: the source bitmask groups are summed
+# by unpack_source_measures.py, so they must not be suppressed or rounded
+# first. Disclosure control is applied to the summed measures (sdc_measures.py).
+measures.configure_disclosure_control(enabled=False)
 
-## Global
+## GP, ONS and global, by source bitmask
 measures.define_measure(
-    "global_mortality_practice",
-    numerator= global_death_in_interval,
+    "source_bits_mortality_practice",
+    numerator= global_denominator,
     denominator= global_denominator,
     intervals=intervals,
     group_by={
+        "source_bits": mortality_source_bits,
         "practice": practice,
     },
-)
\ No newline at end of file
+)
@@ -0,0 +1,25 @@
+###################################################
+# Mortality rollup cube, shared by measure_def.py
+# and analysis/unpack_source_measures.py, so this
+# module must not import ehrQL.
+#
+# measure_def.py defines one measure grouped by the
+# source bitmask and every subgroup at once; the
+# overall and single-subgroup measures are sums
+# over this cube, derived when it is unpacked.
+###################################################
+
+# Measure grouped by source_bits and all of ROLLUP_SUBGROUPS
+ROLLUP_MEASURE = "source_bits_mortality_rollup"
+
+# Subgroups of the cube; each gives a mortality_{subgroup} measure, and the
+# sum over all of them gives mortality_overall
+ROLLUP_SUBGROUPS = [
+    "age_band",
+    "sex",
+    "death_place",
+    "region",
+    "rural_urban",
+    "IMD_q10",
+    "ethnicity",
+]
@@ -0,0 +1,249 @@
+###################################################
+# Variables shared by the dataset and measure
+# definitions.
+###################################################
+
+import math
+from typing import NamedTuple
+
+from ehrql import case, days, when
+from ehrql.query_language import IntPatientSeries, PatientFrame
+from ehrql.tables.tpp import addresses, clinical_events, patients, practice_registrations
+
+from codelist_cache import load_codelist
+from grace_periods import GRACE_DAYS, GRACE_PERIODS
+
+# -----------------------------------------------------------------------------
+# Codelists
+# -----------------------------------------------------------------------------
+
+# TPP coded death
+tpp_coded_death_codes = load_codelist(
+    "codelists/nhsd-primary-care-domain-refsets-death_cod.csv",
+    column="code",
+)
+
+# Ethnicity
+ethnicity5 = load_codelist(
+  "codelists/opensafely-ethnicity-snomed-0removed.csv",
+  column="code",
+  category_column="Label_6", # it's 6 because there is an additional "6 - Not stated" but this is not represented in SNOMED, instead corresponding to no ethnicity code
+)
+
+# -----------------------------------------------------------------------------
+# Clinical events: coded death and ethnicity
+# -----------------------------------------------------------------------------
+# clinical_events is filtered once, on the union of both codelists, and both
+# variables are derived from that one frame without filtering it again.
+
+death_or_ethnicity_events = clinical_events.where(
+    clinical_events.snomedct_code.is_in(
+        tpp_coded_death_codes.codes + ethnicity5.codes
+    )
+)
+
+is_coded_death_event = death_or_ethnicity_events.snomedct_code.is_in(
+    tpp_coded_death_codes.codes
+)
+is_ethnicity_event = death_or_ethnicity_events.snomedct_code.is_in(ethnicity5.codes)
+
+# Earliest coded death date: a min aggregate over the dates of the death
+# events (other events give null, which the aggregate ignores)
+tpp_coded_death_date = case(
+    when(is_coded_death_event).then(death_or_ethnicity_events.date)
+).minimum_for_patient()
+
+# Latest ethnicity category: ethnicity events sort after death events, so the
+# last event is the latest ethnicity event; a patient with only death events
+# gets a death code, which is not in the category map (null)
+ethnicity = (
+    death_or_ethnicity_events
+    .sort_by(
+        case(when(is_ethnicity_event).then(1), otherwise=0),
+        death_or_ethnicity_events.date,
+    )
+    .last_for_patient()
+    .snomedct_code
+    .to_category(ethnicity5.category_map())
+)
+
+# -----------------------------------------------------------------------------
+# Snapshot at a date
+# -----------------------------------------------------------------------------
+# The address row, practice registration row and age on a date. Each row is
+# one pick per patient (for_patient_on()), which ehrQL evaluates once, with
+# every column used from it; the fields a definition takes from a snapshot
+# (e.g. imd and rural_urban, region and practice) are columns of that one
+# pick, not separate lookups. The dataset definition (through deaths.py) and
+# measure_death_source.py share the snapshot at the reference death date;
+# measure_def.py and measure_practice.py each take one at INTERVAL.start_date.
+
+class Snapshot(NamedTuple):
+    address: PatientFrame
+    registration: PatientFrame
+    age: IntPatientSeries
+
+
+def snapshot_on(date):
+    """Address row, practice registration row and age of each patient on `date`."""
+    return Snapshot(
+        address=addresses.for_patient_on(date),
+        registration=practice_registrations.for_patient_on(date),
+        age=patients.age_on(date),
+    )
+
+# -----------------------------------------------------------------------------
+# Classifications
+# -----------------------------------------------------------------------------
+# As the cat_*() functions in 0_utility_functions.R, so derived variables are
+# computed by the backend during extraction rather than in R afterwards.
+
+# Study period for plausible death dates
+study_start_date = "2009-01-01"
+study_end_date = "2026-03-06"
+
+
+def cat_implausible_death_date(death_date, date_of_birth):
+    return case(
+        when(death_date.is_null()).then("missing"),
+        when(death_date.is_before(date_of_birth)).then("death_before_birth"),
+        when(death_date.is_before(study_start_date)).then("before_study"),
+        when(death_date.is_after(study_end_date)).then("after_study"),
+        otherwise="ok",
+    )
+
+
+def cat_death_source(ons_death_date, tpp_death_info):
+    """ONS_only, TPP_only or Both (missing if neither)."""
+    return case(
+        when(ons_death_date.is_not_null() & tpp_death_info.is_not_null()).then("Both"),
+        when(ons_death_date.is_not_null()).then("ONS_only"),
+        when(tpp_death_info.is_not_null()).then("TPP_only"),
+    )
+
+
+def cat_last_reg_start_to_death(days):
+    """days = death date - registration start date"""
+    return case(
+        when(days.is_null()).then("missing_registration_start"),
+        when(days < 0).then("death_before_registration_start"),
+        when(days == 0).then("same_day_as_registration_start"),
+        otherwise="death_after_registration_start",
+    )
+
+
+def cat_days_difference(days):
+    """Days between two dates in bands: -31+, -30 to -8, ..., 31+ (missing if null)."""
+    return case(
+        when(days <= -31).then("-31+"),
+        when(days <= -8).then("-30 to -8"),
+        when(days <= -1).then("-7 to -1"),
+        when(days == 0).then("0"),
+        when(days <= 7).then("1 to 7"),
+        when(days <= 30).then("8 to 30"),
+        when(days >= 31).then("31+"),
+    )
+
+
+def cat_last_reg_end_minus_death(days):
+    """days = registration end date - death date"""
+    return case(
+        when(days.is_null()).then("missing_registration_end"),
+        otherwise=cat_days_difference(days),
+    )
+
+
+def cat_registration_status(death_date, reg_start, reg_end, grace_days=GRACE_DAYS):
+    return case(
+        when(death_date.is_null()).then("no_death_date"),
+        when(reg_start.is_null()).then("no_registration"),
+        when(death_date.is_before(reg_start)).then("death_before_last_registration_start"),
+        when(reg_end.is_null()).then("death_during_registration_open_end"),
+        when(death_date.is_on_or_before(reg_end)).then("death_during_registration"),
+        when(death_date.is_on_or_before(reg_end + days(grace_days))).then(
+            "death_after_deregistration_within_grace"
+        ),
+        otherwise="death_after_deregistration_outside_grace",
+    )
+
+
+def days_after_deregistration(death_date, reg_end):
+    """Days from deregistration to death; 0 if registration is open or death came first."""
+    return case(
+        when(death_date.is_on_or_before(reg_end)).then(0),
+        when(death_date.is_not_null() & reg_end.is_null()).then(0),
+        otherwise=(death_date - reg_end).days,
+    )
+
+
+def cat_grace_band(days_after):
+    """Grace bands between GRACE_PERIODS: "0", "1-30", "31-60", "61-90", "91+"."""
+    bands = [when(days_after <= 0).then("0")]
+    for lower, upper in zip(GRACE_PERIODS, GRACE_PERIODS[1:]):
+        bands.append(when(days_after <= upper).then(f"{lower + 1}-{upper}"))
+    bands.append(when(days_after > GRACE_PERIODS[-1]).then(f"{GRACE_PERIODS[-1] + 1}+"))
+    return case(*bands)
+
+
+# Source eligibility bits (must match analysis/unpack_source_measures.py):
+# each patient-interval is grouped by one small integer, and the GP, ONS and
+# global numerators and denominators are unpacked from the groups afterwards.
+ALIVE_GP = 1
+ALIVE_ONS = 2
+GP_DEATH = 4
+ONS_DEATH = 8
+
+
+def source_bits(alive_gp, alive_ons, gp_death, ons_death):
+    """Sum of the bits whose predicate is true (null counts as false)."""
+    return (
+        case(when(alive_gp).then(ALIVE_GP), otherwise=0)
+        + case(when(alive_ons).then(ALIVE_ONS), otherwise=0)
+        + case(when(gp_death).then(GP_DEATH), otherwise=0)
+        + case(when(ons_death).then(ONS_DEATH), otherwise=0)
+    )
+
+
+def cat_tpp_date_or_coded(tpp_death_date, tpp_coded_death_date):
+    return case(
+        when(tpp_death_date.is_not_null() & tpp_coded_death_date.is_not_null()).then(
+            "tpp_dated_and_coded"
+        ),
+        when(tpp_death_date.is_not_null()).then("tpp_dated_only"),
+        when(tpp_coded_death_date.is_not_null()).then("tpp_coded_only"),
+    )
+
+
+def cat_age_band(age):
+    return case(
+        when(age < 45).then("0-44"),
+        when(age < 55).then("45-54"),
+        when(age < 65).then("55-64"),
+        when(age < 75).then("65-74"),
+        when(age < 85).then("75-84"),
+        when(age >= 85).then("85+"),
+    )
+
+
+def cat_imd_quintile(imd):
+    # Breaks at 32844 * k / 5, left-closed (last one closed); imd is an integer
+    breaks = [0, *[math.ceil(32844 * k / 5) for k in range(1, 5)], 32844 + 1]
+    labels = ["1 (most deprived)", "2", "3", "4", "5 (least deprived)"]
+    return case(
+        *[
+            when((imd >= lower) & (imd < upper)).then(label)
+            for lower, upper, label in zip(breaks, breaks[1:], labels)
+        ]
+    )
+
+
+rural_urban_labels = {
+    1: "Urban major conurbation",
+    2: "Urban minor conurbation",
+    3: "Urban city and town",
+    4: "Urban city and town in a sparse setting",
+    5: "Rural town and fringe",
+    6: "Rural town and fringe in a sparse setting",
+    7: "Rural village and dispersed",
+    8: "Rural village and dispersed in a sparse setting",
+}
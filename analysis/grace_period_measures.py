@@ -0,0 +1,106 @@
+###################################################
+# This script turns the grace band measures
+# (*_mortality_grace_band in measure_def.py) into
+# mortality counts for each grace period after
+# deregistration.
+#
+# Deaths are grouped by days from deregistration
+# to death in bands "0", "1-30", "31-60", "61-90",
+# "91+" (between GRACE_PERIODS). The numerator for
+# a grace period of G days is the sum over bands up
+# to G; the denominator is the sum over all groups
+# (it does not depend on the grace period). Every
+# grace period in GRACE_PERIODS is output, even if
+# no death falls in its band.
+#
+# The band counts must not have been rounded or
+# suppressed (measure_def.py disables ehrQL's
+# disclosure control); sdc_measures.py rounds the
+# output.
+#
+# Output rows are {source}_mortality_grace_{G}d, in
+# the measures output format.
+###################################################
+
+import argparse
+import csv
+import math
+from collections import defaultdict
+from pathlib import Path
+
+from dataset_def.grace_periods import GRACE_PERIODS
+
+INPUT_PATH = Path("output/highly_sensitive/measures/measures.csv")
+OUTPUT_PATH = Path("output/highly_sensitive/measures/measures_grace_periods.csv")
+
+GRACE_BAND_SUFFIX = "_grace_band"
+
+
+def band_upper(band):
+    """Largest gap (days) in a grace band: "0" -> 0, "31-60" -> 60, "91+" -> inf."""
+    if band.endswith("+"):
+        return math.inf
+    return int(band.split("-")[-1])
+
+
+def grace_period_counts(rows):
+    """(measure, interval) -> numerator by band upper limit, denominator, interval end"""
+    counts = defaultdict(lambda: {"numerator": defaultdict(int), "denominator": 0, "end": None})
+    for row in rows:
+        if not row["measure"].endswith(GRACE_BAND_SUFFIX):
+            continue
+        key = (row["measure"][: -len(GRACE_BAND_SUFFIX)], row["interval_start"])
+        entry = counts[key]
+        entry["end"] = row["interval_end"]
+        entry["denominator"] += int(row["denominator"] or 0)
+        if row["grace_band"]:
+            entry["numerator"][band_upper(row["grace_band"])] += int(row["numerator"] or 0)
+    return counts
+
+
+def grace_period_rows(counts, grace_periods=GRACE_PERIODS):
+    bands = {upper for entry in counts.values() for upper in entry["numerator"]}
+    unknown = bands - set(grace_periods) - {math.inf}
+    if unknown:
+        raise ValueError(f"Grace bands ending at {sorted(unknown)} days are not in {grace_periods}")
+    rows = []
+    for (measure, interval_start), entry in sorted(counts.items()):
+        for grace_days in grace_periods:
+            numerator = sum(
+                n for upper, n in entry["numerator"].items() if upper <= grace_days
+            )
+            denominator = entry["denominator"]
+            rows.append(
+                {
+                    "measure": f"{measure}_grace_{grace_days}d",
+                    "interval_start": interval_start,
+                    "interval_end": entry["end"],
+                    "ratio": numerator / denominator if denominator else "",
+                    "numerator": numerator,
+                    "denominator": denominator,
+                }
+            )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default=INPUT_PATH, type=Path)
+    parser.add_argument("--output", default=OUTPUT_PATH, type=Path)
+    args = parser.parse_args()
+
+    with open(args.input, newline="") as f:
+        counts = grace_period_counts(csv.DictReader(f))
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "w", newline="") as f:
+        writer = csv.DictWriter(
+            f,
+            fieldnames=["measure", "interval_start", "interval_end", "ratio", "numerator", "denominator"],
+        )
+        writer.writeheader()
+        writer.writerows(grace_period_rows(counts))
+
+
+if __name__ == "__main__":
+    main()
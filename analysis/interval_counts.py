@@ -0,0 +1,793 @@
+###################################################
+# This script computes GP, ONS and global mortality
+# counts (numerator/denominator) for any interval
+# grid from the per-patient facts extracted by
+# dataset_def/dataset_interval_facts.py.
+#
+# The facts are read once into date arrays
+# (deaths, births, registration spans). For a grid,
+# the interval indexes of every date are found with
+# one binary search (numpy.searchsorted) over the
+# sorted interval starts; each patient's eligible
+# intervals are index ranges, accumulated in
+# difference arrays and summed cumulatively. Cost
+# grows with patients + intervals rather than
+# patients x intervals, so re-gridding (yearly,
+# quarterly, monthly, weekly, any start date or
+# explicit boundaries) does not touch the backend.
+#
+# Definitions follow dataset_def/measure_def.py
+# (overall measures). With --group-by practice,
+# they follow dataset_def/measure_practice.py:
+# counts are by the practice registered with on
+# each interval start, or for babies born in the
+# interval, their first practice. The facts are
+# then split by patient into files on disk, read
+# one part at a time, and partial counts are
+# spilled to disk in hash partitions, so memory is
+# about --memory-budget-mb (plus the output table)
+# whatever the population size.
+#
+# tools/check_interval_counts.py checks both modes
+# against the ehrQL definitions on generated facts.
+#
+# Local only, for re-gridding and cross-checking:
+# it is not a project.yaml action and its counts
+# are not released. They repeat cells of the
+# measure_def.py and measure_practice.py outputs,
+# computed by a different engine, and releasing
+# both would give two independently rounded values
+# for a cell. The facts come from a local run of
+# the facts definition, e.g.
+#   ehrql generate-dataset analysis/dataset_def/dataset_interval_facts.py \
+#     --dummy-tables dummy_tables --output output/local/interval_facts:arrow
+#
+# Usage:
+#   python analysis/interval_counts.py --start-date 2009-01-01 --periods 16 --unit years
+#   python analysis/interval_counts.py --start-date 2019-04-01 --periods 24 --unit quarters
+#   python analysis/interval_counts.py --boundaries 2009-01-01 2015-01-01 2020-03-01 2025-01-01
+#   python analysis/interval_counts.py --start-date 2019-01-01 --periods 6 --unit years \
+#     --group-by practice --output output/local/interval_counts_practice.csv
+###################################################
+
+import argparse
+import calendar
+import csv
+import datetime
+import gzip
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+import pyarrow.ipc as ipc
+
+# Grace period after deregistration (days), as in the definitions
+from dataset_def.grace_periods import GRACE_DAYS
+
+# Age limits at interval start (exclusive)
+MIN_AGE = 0
+MAX_AGE = 110
+
+SOURCES = ("GP", "ONS", "global")
+
+# Practice id of registrations without one
+MISSING_PRACTICE = -1
+
+# ---------------------------------------------------------
+# Dates and interval grids
+# ---------------------------------------------------------
+
+def parse_date(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(value)
+
+
+def add_months(date, months):
+    month_index = date.month - 1 + months
+    year = date.year + month_index // 12
+    month = month_index % 12 + 1
+    # Clamp to the last day of the month (e.g. 31 Jan + 1 month)
+    day = min(date.day, calendar.monthrange(year, month)[1])
+    return datetime.date(year, month, day)
+
+
+def add_years(date, years):
+    # 29 Feb anniversaries fall on 1 Mar, matching age_on()
+    try:
+        return date.replace(year=date.year + years)
+    except ValueError:
+        return datetime.date(date.year + years, 3, 1)
+
+
+def make_grid(start_date, periods, unit):
+    """Interval (start, end) pairs, as ehrQL years()/months()/weeks()."""
+    start_date = parse_date(start_date)
+    if unit == "years":
+        starts = [add_years(start_date, i) for i in range(periods + 1)]
+    elif unit == "quarters":
+        starts = [add_months(start_date, 3 * i) for i in range(periods + 1)]
+    elif unit == "months":
+        starts = [add_months(start_date, i) for i in range(periods + 1)]
+    elif unit == "weeks":
+        starts = [start_date + datetime.timedelta(weeks=i) for i in range(periods + 1)]
+    else:
+        raise ValueError(f"Unknown interval unit: {unit}")
+    one_day = datetime.timedelta(days=1)
+    return [(starts[i], starts[i + 1] - one_day) for i in range(periods)]
+
+
+def grid_from_boundaries(boundaries):
+    """Consecutive intervals between sorted boundary dates (last one exclusive)."""
+    dates = sorted(parse_date(boundary) for boundary in boundaries)
+    if len(dates) < 2 or len(set(dates)) != len(dates):
+        raise ValueError("Boundaries must be at least two distinct dates")
+    one_day = datetime.timedelta(days=1)
+    return [(dates[i], dates[i + 1] - one_day) for i in range(len(dates) - 1)]
+
+
+# ---------------------------------------------------------
+# Reading the extracted facts
+# ---------------------------------------------------------
+
+def find_table(input_dir, name):
+    for suffix in (".arrow", ".csv.gz", ".csv"):
+        path = Path(input_dir) / f"{name}{suffix}"
+        if path.exists():
+            return path
+    raise FileNotFoundError(f"No '{name}' table found in {input_dir}")
+
+
+# Date columns of each facts table
+FACT_TABLES = {
+    "dataset": ["date_of_birth", "tpp_death_date", "ons_death_date", "last_registration_end_date"],
+    "registrations": ["start_date", "end_date"],
+}
+
+# Non-date column types, so CSV blocks read separately agree
+FACT_COLUMN_TYPES = {
+    "patient_id": pa.int64(),
+    "sex": pa.string(),
+    "practice_pseudo_id": pa.int64(),
+}
+
+
+def csv_options(date_columns):
+    import pyarrow.csv as pa_csv
+
+    return pa_csv.ConvertOptions(
+        column_types={
+            **FACT_COLUMN_TYPES,
+            **{column: pa.date32() for column in date_columns},
+        },
+        strings_can_be_null=True,
+    )
+
+
+def read_table(path, date_columns):
+    path = Path(path)
+    if path.suffix == ".arrow":
+        return feather.read_table(path)
+    import pyarrow.csv as pa_csv
+
+    return pa_csv.read_csv(path, convert_options=csv_options(date_columns))
+
+
+def read_batches(path, date_columns):
+    """Record batches of a table, without reading the whole file into memory."""
+    path = Path(path)
+    if path.suffix == ".arrow":
+        with pa.memory_map(str(path)) as source:
+            reader = ipc.open_file(source)
+            for index in range(reader.num_record_batches):
+                yield reader.get_batch(index)
+        return
+    import pyarrow.csv as pa_csv
+
+    yield from pa_csv.open_csv(path, convert_options=csv_options(date_columns))
+
+
+def to_dates(column):
+    """Date column as datetime64[D] (NaT for missing)."""
+    return pc.cast(column, pa.date32()).to_numpy(zero_copy_only=False).astype("datetime64[D]")
+
+
+def read_facts(input_dir):
+    """Patient facts as arrays, with registration spans sorted by patient and start."""
+    return facts_from_tables(
+        *(read_table(find_table(input_dir, name), columns) for name, columns in FACT_TABLES.items())
+    )
+
+
+def facts_from_tables(dataset, registrations):
+    dataset = dataset.sort_by("patient_id")
+    patient_id = dataset["patient_id"].to_numpy()
+
+    reg_patient_id = registrations["patient_id"].to_numpy()
+    reg_patient = np.searchsorted(patient_id, reg_patient_id)
+    known = (reg_patient < len(patient_id)) & (
+        patient_id[np.minimum(reg_patient, len(patient_id) - 1)] == reg_patient_id
+    )
+    reg_start = to_dates(registrations["start_date"])[known]
+    reg_end = to_dates(registrations["end_date"])[known]
+    reg_patient = reg_patient[known]
+    reg_practice = (
+        pc.fill_null(registrations["practice_pseudo_id"], MISSING_PRACTICE)
+        .to_numpy(zero_copy_only=False)
+        .astype(np.int64)[known]
+    )
+    order = np.lexsort((reg_end, reg_start, reg_patient))
+
+    sex = pc.cast(dataset["sex"], pa.string())
+    return {
+        "non_disclosive_sex": pc.is_in(sex, value_set=pa.array(["male", "female"]))
+        .to_numpy(zero_copy_only=False),
+        "date_of_birth": to_dates(dataset["date_of_birth"]),
+        "tpp_death_date": to_dates(dataset["tpp_death_date"]),
+        "ons_death_date": to_dates(dataset["ons_death_date"]),
+        "last_registration_end_date": to_dates(dataset["last_registration_end_date"]),
+        "reg_patient": reg_patient[order],
+        "reg_start": reg_start[order],
+        "reg_end": reg_end[order],
+        "reg_practice": reg_practice[order],
+    }
+
+
+# ---------------------------------------------------------
+# Index ranges over the sorted interval starts
+# ---------------------------------------------------------
+# A range (lo, hi) covers the intervals starts[lo:hi]. Each function works
+# on arrays of ranges, one binary search per date.
+
+def add_years_array(dates, years):
+    # 29 Feb anniversaries fall on 1 Mar, matching age_on()
+    months = dates.astype("datetime64[M]")
+    return (months + 12 * years).astype("datetime64[D]") + (dates - months.astype("datetime64[D]"))
+
+
+def search(starts, dates, side, missing):
+    """Index of each date among the interval starts; `missing` for NaT."""
+    index = np.searchsorted(starts, dates, side=side)
+    return np.where(np.isnat(dates), missing, index)
+
+
+def registered_ranges(starts, facts):
+    # Registered on the interval start, as for_patient_on(): start_date <= start
+    # <= end_date (or open; a registration ending on the start still counts),
+    # with overlapping spans of a patient merged
+    n = len(starts)
+    patient = facts["reg_patient"]
+    lo = search(starts, facts["reg_start"], "left", 0)
+    hi = search(starts, facts["reg_end"], "right", n)
+    keep = lo < hi
+    patient, lo, hi = patient[keep], lo[keep], hi[keep]
+    order = np.lexsort((lo, patient))
+    patient, lo, hi = patient[order], lo[order], hi[order]
+    if len(patient) == 0:
+        return patient, lo, hi
+
+    # Running maximum of hi within each patient (patients are offset apart)
+    offset = patient.astype(np.int64) * (n + 1)
+    running_hi = np.maximum.accumulate(hi + offset) - offset
+    new_range = np.ones(len(patient), dtype=bool)
+    new_range[1:] = (patient[1:] != patient[:-1]) | (lo[1:] > running_hi[:-1])
+    first = np.flatnonzero(new_range)
+    last = np.append(first[1:], len(patient)) - 1
+    return patient[first], lo[first], running_hi[last]
+
+
+def age_ranges(starts, date_of_birth):
+    # Age on the interval start between MIN_AGE and MAX_AGE (exclusive)
+    age_lo = search(starts, add_years_array(date_of_birth, MIN_AGE + 1), "left", 0)
+    age_hi = search(starts, add_years_array(date_of_birth, MAX_AGE), "left", 0)
+    return age_lo, age_hi
+
+
+def possible_age_ranges(starts, date_of_birth):
+    # Age on the interval start between MIN_AGE and MAX_AGE (exclusive),
+    # or born in the same calendar year as the interval start.
+    # Returns two ranges per patient; they are merged where they overlap.
+    n = len(starts)
+    birth_year = date_of_birth.astype("datetime64[Y]")
+    year_lo = search(starts, birth_year.astype("datetime64[D]"), "left", 0)
+    year_hi = search(starts, (birth_year + 1).astype("datetime64[D]"), "left", 0)
+    age_lo, age_hi = age_ranges(starts, date_of_birth)
+
+    overlap = (year_lo <= age_hi) & (age_lo <= year_hi) & (year_lo < year_hi) & (age_lo < age_hi)
+    first_lo = np.where(overlap, np.minimum(year_lo, age_lo), year_lo)
+    first_hi = np.where(overlap, np.maximum(year_hi, age_hi), year_hi)
+    second_lo = np.where(overlap, n, age_lo)
+    second_hi = np.where(overlap, n, age_hi)
+    return (first_lo, first_hi), (second_lo, second_hi)
+
+
+def eligible_ranges(starts, facts):
+    """(patient, lo, hi) ranges registered with a possible age, disjoint per patient."""
+    patient, reg_lo, reg_hi = registered_ranges(starts, facts)
+    age_ranges = possible_age_ranges(starts, facts["date_of_birth"])
+    pieces = []
+    for age_lo, age_hi in age_ranges:
+        lo = np.maximum(reg_lo, age_lo[patient])
+        hi = np.minimum(reg_hi, age_hi[patient])
+        keep = lo < hi
+        pieces.append((patient[keep], lo[keep], hi[keep]))
+    patient, lo, hi = (np.concatenate(parts) for parts in zip(*pieces))
+    keep = facts["non_disclosive_sex"][patient]
+    return patient[keep], lo[keep], hi[keep]
+
+
+def alive_end(starts, death_date):
+    # Alive on the interval start: death on or after start (or no death)
+    return search(starts, death_date, "right", len(starts))
+
+
+def interval_of(starts, ends, dates):
+    # Interval containing each date (is_during); -1 if none or NaT
+    index = np.searchsorted(starts, dates, side="right") - 1
+    clipped = np.clip(index, 0, len(starts) - 1)
+    in_grid = (index >= 0) & (dates <= ends[clipped])
+    return np.where(~np.isnat(dates) & in_grid, index, -1)
+
+
+def death_interval(starts, ends, death_date, last_registration_end_date):
+    # Interval containing a death registered (with grace) at death; -1 if none
+    grace_end = last_registration_end_date + np.timedelta64(GRACE_DAYS, "D")
+    registered = np.isnat(last_registration_end_date) | (death_date <= grace_end)
+    return np.where(registered, interval_of(starts, ends, death_date), -1)
+
+
+# ---------------------------------------------------------
+# Counting
+# ---------------------------------------------------------
+
+def grid_arrays(intervals):
+    starts = np.array([start for start, _ in intervals], dtype="datetime64[D]")
+    ends = np.array([end for _, end in intervals], dtype="datetime64[D]")
+    return starts, ends
+
+
+def source_events(starts, ends, facts):
+    """Per patient and source: alive range end, and death intervals (-1 if none)."""
+    gp_alive = alive_end(starts, facts["tpp_death_date"])
+    ons_alive = alive_end(starts, facts["ons_death_date"])
+    alive = {
+        "GP": gp_alive,
+        "ONS": ons_alive,
+        "global": np.maximum(gp_alive, ons_alive),
+    }
+
+    last_end = facts["last_registration_end_date"]
+    gp_death = death_interval(starts, ends, facts["tpp_death_date"], last_end)
+    ons_death = death_interval(starts, ends, facts["ons_death_date"], last_end)
+    deaths = {
+        "GP": [gp_death],
+        "ONS": [ons_death],
+        # One death per interval if both sources fall in the same interval
+        "global": [gp_death, np.where(ons_death == gp_death, -1, ons_death)],
+    }
+    return alive, deaths
+
+
+def count_intervals(facts, intervals):
+    """Numerator/denominator counts per source and interval."""
+    starts, ends = grid_arrays(intervals)
+    n = len(intervals)
+
+    patient, lo, hi = eligible_ranges(starts, facts)
+    alive, deaths = source_events(starts, ends, facts)
+
+    counts = defaultdict(dict)
+    for source in SOURCES:
+        source_hi = np.minimum(hi, alive[source][patient])
+        keep = lo < source_hi
+        source_patient, source_lo, source_hi = patient[keep], lo[keep], source_hi[keep]
+
+        # Denominators are accumulated as difference arrays
+        difference = np.bincount(source_lo, minlength=n + 1) - np.bincount(
+            source_hi, minlength=n + 1
+        )
+        denominators = np.cumsum(difference)[:n]
+
+        # A death counts if its interval is in one of the patient's ranges
+        numerators = np.zeros(n, dtype=np.int64)
+        for death in deaths[source]:
+            index = death[source_patient]
+            counted = (source_lo <= index) & (index < source_hi)
+            numerators += np.bincount(index[counted], minlength=n)[:n]
+
+        for index in range(n):
+            counts[source][index] = (int(numerators[index]), int(denominators[index]))
+    return counts
+
+
+def write_measures(counts, intervals, output):
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    opener = gzip.open if output.suffix == ".gz" else open
+    with opener(output, "wt", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ["measure", "interval_start", "interval_end", "ratio", "numerator", "denominator"]
+        )
+        for source in SOURCES:
+            for index, (start, end) in enumerate(intervals):
+                numerator, denominator = counts[source][index]
+                ratio = numerator / denominator if denominator else ""
+                writer.writerow(
+                    [f"{source}_mortality_overall", start, end, ratio, numerator, denominator]
+                )
+
+
+
+# ---------------------------------------------------------
+# Counting by practice
+# ---------------------------------------------------------
+# Definitions follow measure_practice.py: registered on the interval start
+# with an age in range, or born in the interval and registered (on the start,
+# or with a registration starting in the interval). The practice is the one
+# registered with on the start, otherwise (babies) the patient's first
+# registration.
+#
+# Practice-level counts have one cell per practice x interval x source, and
+# expanding patients into patient-intervals to find each one's practice grows
+# with the population. Memory is bounded in three places:
+#   - the facts are streamed batch by batch into files split by patient id
+#     (sized to a quarter of the budget), and one part is read at a time
+#   - within a part, patients are expanded in chunks of about a quarter of
+#     the budget, and each chunk's partial counts are keyed by
+#     (practice, interval)
+#   - when the partial counts outgrow half the budget they are
+#     hash-partitioned by practice and spilled to disk, and each partition is
+#     then summed on its own
+# Counts are integers, so merging partial counts is exact. Only the summed
+# output (practices x intervals) is held in full.
+
+# Approximate bytes per expanded patient-interval (all temporary arrays)
+ROW_BYTES = 128
+
+# Approximate bytes in memory per byte of facts file (arrays built from it)
+FACT_BYTES = {".arrow": 3, ".csv": 2, ".gz": 16}
+
+
+def split_count(input_dir, budget_bytes):
+    """Number of parts so that each part's facts take about budget_bytes."""
+    size = sum(
+        path.stat().st_size * FACT_BYTES.get(path.suffix, 3)
+        for path in (find_table(input_dir, name) for name in FACT_TABLES)
+    )
+    return max(1, -(-size // max(int(budget_bytes), 1)))
+
+
+def split_facts(input_dir, split_dir, parts):
+    """Write each facts table into `parts` files by patient id; yields the parts' paths.
+
+    Only parts with patients in both tables are yielded (no registration: not
+    eligible).
+    """
+    split_dir = Path(split_dir)
+    split_dir.mkdir(parents=True, exist_ok=True)
+    for name, date_columns in FACT_TABLES.items():
+        writers = {}
+        try:
+            for batch in read_batches(find_table(input_dir, name), date_columns):
+                part = batch["patient_id"].to_numpy(zero_copy_only=False) % parts
+                for index in np.unique(part):
+                    if index not in writers:
+                        writers[index] = ipc.new_file(
+                            split_dir / f"{name}_{index}.arrow", batch.schema
+                        )
+                    writers[index].write_batch(batch.filter(pa.array(part == index)))
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+    for index in range(parts):
+        paths = [split_dir / f"{name}_{index}.arrow" for name in FACT_TABLES]
+        if all(path.exists() for path in paths):
+            yield paths
+
+
+def expand_ranges(lo, hi):
+    """Range index and interval index of every interval in the ranges [lo, hi)."""
+    lengths = hi - lo
+    row = np.repeat(np.arange(len(lo)), lengths)
+    offset = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return row, lo[row] + offset
+
+
+def practice_eligible_ranges(starts, ends, facts):
+    """(patient, lo, hi) ranges eligible in measure_practice.py, sorted by patient.
+
+    Babies add a one-interval range for the interval they were born in; it
+    never overlaps the age range (age on its start is 0 or less).
+    """
+    n_patients = len(facts["date_of_birth"])
+    patient, reg_lo, reg_hi = registered_ranges(starts, facts)
+    age_lo, age_hi = age_ranges(starts, facts["date_of_birth"])
+    lo = np.maximum(reg_lo, age_lo[patient])
+    hi = np.minimum(reg_hi, age_hi[patient])
+    keep = lo < hi
+
+    # Born in the interval, and registered on its start or with a registration
+    # starting in it
+    birth = interval_of(starts, ends, facts["date_of_birth"])
+    registered_at_birth = np.zeros(n_patients, dtype=bool)
+    on_start = (reg_lo <= birth[patient]) & (birth[patient] < reg_hi)
+    registered_at_birth[patient[on_start]] = True
+    reg_patient = facts["reg_patient"]
+    starts_in_birth = interval_of(starts, ends, facts["reg_start"])
+    starts_in_birth = (starts_in_birth >= 0) & (starts_in_birth == birth[reg_patient])
+    registered_at_birth[reg_patient[starts_in_birth]] = True
+    babies = np.flatnonzero((birth >= 0) & registered_at_birth)
+
+    patient = np.concatenate([patient[keep], babies])
+    lo = np.concatenate([lo[keep], birth[babies]])
+    hi = np.concatenate([hi[keep], birth[babies] + 1])
+    keep = facts["non_disclosive_sex"][patient]
+    order = np.argsort(patient[keep], kind="stable")
+    return patient[keep][order], lo[keep][order], hi[keep][order], birth
+
+
+def practice_on_starts(starts, facts, first_patient, last_patient):
+    """Practice registered with on each interval start, for patients in [first, last).
+
+    Returns sorted keys (patient * n + interval) and their practice. As
+    for_patient_on(), the registration with the latest start (then end) wins,
+    and a registration ending on the start still counts.
+    """
+    n = len(starts)
+    first, last = np.searchsorted(facts["reg_patient"], [first_patient, last_patient])
+    lo = search(starts, facts["reg_start"][first:last], "left", 0)
+    hi = search(starts, facts["reg_end"][first:last], "right", n)
+    row, interval = expand_ranges(lo, np.maximum(lo, hi))
+    keys = facts["reg_patient"][first:last][row].astype(np.int64) * n + interval
+    practice = facts["reg_practice"][first:last][row]
+    # Registrations are sorted by start and end, so keep the last of each key
+    keys, index = np.unique(keys[::-1], return_index=True)
+    return keys, practice[::-1][index]
+
+
+def first_practice(facts):
+    """Practice of each patient's earliest registration (practice_babies)."""
+    practice = np.full(len(facts["date_of_birth"]), MISSING_PRACTICE, dtype=np.int64)
+    # Registrations are sorted by patient, start and end
+    patients, first = np.unique(facts["reg_patient"], return_index=True)
+    practice[patients] = facts["reg_practice"][first]
+    return practice
+
+
+def patient_chunks(rows_per_patient, max_rows):
+    """Consecutive patient ranges [first, last) of about max_rows rows each."""
+    cumulative = np.cumsum(rows_per_patient)
+    first, done = 0, 0
+    while first < len(cumulative):
+        last = max(int(np.searchsorted(cumulative, done + max_rows, side="right")), first + 1)
+        yield first, last
+        first, done = last, cumulative[last - 1]
+
+
+def sum_by_key(keys, counts):
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    summed = np.column_stack(
+        [
+            np.bincount(inverse, weights=column, minlength=len(unique_keys))
+            for column in counts.T
+        ]
+    )
+    return unique_keys, summed.astype(np.int64)
+
+
+class PartitionedCounts:
+    """Partial counts (numerator, denominator per source) by (practice, interval) key.
+
+    Held in memory up to budget_bytes; beyond that, hash-partitioned by practice
+    and appended to one spill file per partition.
+    """
+
+    def __init__(self, n_intervals, budget_bytes, spill_dir, partitions):
+        self.n_intervals = n_intervals
+        self.budget_bytes = budget_bytes
+        self.spill_paths = [Path(spill_dir) / f"partition_{i}.npy" for i in range(partitions)]
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.spilled = False
+
+    def add(self, keys, counts):
+        self.buffer.append((keys, counts))
+        self.buffer_bytes += keys.nbytes + counts.nbytes
+        if self.buffer_bytes > self.budget_bytes:
+            self.compact()
+            if self.buffer_bytes > self.budget_bytes / 2:
+                self.spill()
+
+    def compact(self):
+        if self.buffer:
+            keys, counts = sum_by_key(*(np.concatenate(parts) for parts in zip(*self.buffer)))
+            self.buffer = [(keys, counts)]
+            self.buffer_bytes = keys.nbytes + counts.nbytes
+
+    def spill(self):
+        self.compact()
+        if not self.buffer:
+            return
+        keys, counts = self.buffer[0]
+        partition = (keys // self.n_intervals) % len(self.spill_paths)
+        for index, path in enumerate(self.spill_paths):
+            selected = partition == index
+            with open(path, "ab") as f:
+                np.save(f, keys[selected])
+                np.save(f, counts[selected])
+        self.buffer, self.buffer_bytes, self.spilled = [], 0, True
+
+    def partitions(self):
+        """(keys, counts) summed within each partition."""
+        if not self.spilled:
+            self.compact()
+            yield from self.buffer
+            return
+        self.spill()
+        for path in self.spill_paths:
+            parts = []
+            with open(path, "rb") as f:
+                size = path.stat().st_size
+                while f.tell() < size:
+                    parts.append((np.load(f), np.load(f)))
+            yield sum_by_key(*(np.concatenate(columns) for columns in zip(*parts)))
+
+
+def count_practice_part(starts, ends, facts, counter, budget_bytes):
+    """Add the partial counts of one part of the facts to the counter."""
+    n = len(starts)
+    patient, lo, hi, birth = practice_eligible_ranges(starts, ends, facts)
+    alive, deaths = source_events(starts, ends, facts)
+    babies_practice = first_practice(facts)
+
+    n_patients = len(facts["date_of_birth"])
+    rows_per_patient = np.bincount(patient, weights=hi - lo, minlength=n_patients)
+    for first_patient, last_patient in patient_chunks(
+        rows_per_patient, max(budget_bytes // ROW_BYTES, n)
+    ):
+        first, last = np.searchsorted(patient, [first_patient, last_patient])
+        row, interval = expand_ranges(lo[first:last], hi[first:last])
+        row_patient = patient[first:last][row]
+
+        # practice_gral, or practice_babies in the birth interval
+        practice_keys, practices = practice_on_starts(
+            starts, facts, first_patient, last_patient
+        )
+        row_keys = row_patient.astype(np.int64) * n + interval
+        found = np.searchsorted(practice_keys, row_keys)
+        found = np.minimum(found, len(practice_keys) - 1)
+        practice = np.full(len(row), MISSING_PRACTICE, dtype=np.int64)
+        if len(practice_keys):
+            on_start = practice_keys[found] == row_keys
+            practice[on_start] = practices[found[on_start]]
+        babies = (practice == MISSING_PRACTICE) & (interval == birth[row_patient])
+        practice[babies] = babies_practice[row_patient[babies]]
+
+        columns = []
+        for source in SOURCES:
+            in_denominator = interval < alive[source][row_patient]
+            died = np.zeros(len(row), dtype=bool)
+            for death in deaths[source]:
+                died |= death[row_patient] == interval
+            columns += [in_denominator & died, in_denominator]
+        keys = (practice - MISSING_PRACTICE) * n + interval
+        counter.add(*sum_by_key(keys, np.column_stack(columns).astype(np.int64)))
+
+
+def count_intervals_by_practice(input_dir, intervals, budget_bytes, spill_dir, partitions):
+    """Numerator/denominator counts per practice, interval and source.
+
+    Reads the facts in input_dir part by part. Returns keys
+    ((practice - MISSING_PRACTICE) * n + interval) and counts with columns
+    numerator, denominator for each of SOURCES.
+    """
+    starts, ends = grid_arrays(intervals)
+    counter = PartitionedCounts(len(intervals), budget_bytes / 2, spill_dir, partitions)
+    n_parts = split_count(input_dir, budget_bytes / 4)
+    for paths in split_facts(input_dir, Path(spill_dir) / "facts", n_parts):
+        facts = facts_from_tables(*(feather.read_table(path) for path in paths))
+        count_practice_part(starts, ends, facts, counter, budget_bytes / 4)
+        for path in paths:
+            path.unlink()
+
+    summed = list(counter.partitions())
+    if not summed:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 2 * len(SOURCES)), dtype=np.int64)
+    keys, counts = (np.concatenate(parts) for parts in zip(*summed))
+    return keys, counts
+
+
+def write_practice_measures(keys, counts, intervals, output):
+    n = len(intervals)
+    practice = keys // n + MISSING_PRACTICE
+    interval = keys % n
+    order = np.lexsort((practice, interval))
+
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    opener = gzip.open if output.suffix == ".gz" else open
+    with opener(output, "wt", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ["measure", "interval_start", "interval_end", "ratio", "numerator", "denominator", "practice"]
+        )
+        for source_index, source in enumerate(SOURCES):
+            numerators = counts[:, 2 * source_index]
+            denominators = counts[:, 2 * source_index + 1]
+            for row in order:
+                if denominators[row] == 0:
+                    continue
+                start, end = intervals[interval[row]]
+                writer.writerow(
+                    [
+                        f"{source}_mortality_practice",
+                        start,
+                        end,
+                        numerators[row] / denominators[row],
+                        numerators[row],
+                        denominators[row],
+                        "" if practice[row] == MISSING_PRACTICE else practice[row],
+                    ]
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input-dir", default="output/local/interval_facts")
+    parser.add_argument("--output", default="output/local/interval_counts.csv")
+    parser.add_argument("--start-date", default="2009-01-01")
+    parser.add_argument("--periods", type=int, default=16)
+    parser.add_argument(
+        "--unit", choices=["years", "quarters", "months", "weeks"], default="years"
+    )
+    parser.add_argument(
+        "--boundaries",
+        nargs="+",
+        default=None,
+        help="explicit interval boundary dates (overrides the regular grid)",
+    )
+    parser.add_argument(
+        "--group-by",
+        choices=["practice"],
+        default=None,
+        help="count by practice registered with on each interval start",
+    )
+    parser.add_argument(
+        "--memory-budget-mb",
+        type=int,
+        default=512,
+        help="memory for facts, patient-intervals and partial counts when grouping",
+    )
+    parser.add_argument("--partitions", type=int, default=16)
+    parser.add_argument("--spill-dir", default=None, help="default: system temporary directory")
+    args = parser.parse_args()
+
+    if args.boundaries:
+        intervals = grid_from_boundaries(args.boundaries)
+    else:
+        intervals = make_grid(args.start_date, args.periods, args.unit)
+    if args.group_by == "practice":
+        with tempfile.TemporaryDirectory(dir=args.spill_dir) as spill_dir:
+            keys, counts = count_intervals_by_practice(
+                args.input_dir,
+                intervals,
+                args.memory_budget_mb * 1024 * 1024,
+                spill_dir,
+                args.partitions,
+            )
+        write_practice_measures(keys, counts, intervals, args.output)
+    else:
+        counts = count_intervals(read_facts(args.input_dir), intervals)
+        write_measures(counts, intervals, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+###################################################
+# Columnar measures output: converts measures CSVs
+# (ehrQL generate-measures format, e.g. after
+# sdc_measures.py) to Arrow IPC files.
+#
+#   - measure, interval_start and the group columns
+#     are dictionary encoded (one dictionary per
+#     column for the whole file)
+#   - interval_end is a date, numerator and
+#     denominator are integers, ratio a float
+#   - each measure is one record batch, and the
+#     schema metadata holds an index from measure
+#     name to batch number
+#
+# read_measure() reads a single measure's batch
+# from a memory-mapped file, without scanning or
+# parsing the others.
+#
+# Usage:
+#   python analysis/measures_to_arrow.py \
+#     --input output/measures/measures.csv --output-dir output/measures
+#
+#   from measures_to_arrow import read_measure
+#   table = read_measure("output/measures/measures.arrow", "GP_mortality_sex")
+###################################################
+
+import argparse
+import json
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+
+from sdc_measures import open_measures, read_header
+
+INDEX_KEY = b"measures_index"
+
+VALUE_COLUMNS = ["interval_end", "ratio", "numerator", "denominator"]
+
+
+# ---------------------------------------------------------
+# Writing
+# ---------------------------------------------------------
+
+def index_type(size):
+    """Smallest integer type for dictionary indexes."""
+    for index in (pa.int8(), pa.int16()):
+        if size <= 2 ** (index.bit_width - 1):
+            return index
+    return pa.int32()
+
+
+def columnar_table(table):
+    """Dictionary-encoded measure, interval_start and group columns; typed values."""
+    columns = {}
+    for name in table.column_names:
+        # One array per column (also when there are no rows)
+        column = table[name].combine_chunks()
+        if name in ("interval_start", "interval_end"):
+            column = pc.cast(pc.strptime(column, format="%Y-%m-%d", unit="s"), pa.date32())
+        if name not in VALUE_COLUMNS:
+            column = column.dictionary_encode()
+            column = column.cast(
+                pa.dictionary(index_type(len(column.dictionary)), column.type.value_type)
+            )
+        columns[name] = column
+    return pa.table(columns)
+
+
+def measure_batches(table, names):
+    """One record batch per measure (names: measure of each row), in order of first appearance."""
+    for measure in pc.unique(names).to_pylist():
+        rows = table.filter(pc.equal(names, measure))
+        yield measure, rows.combine_chunks().to_batches()[0]
+
+
+def measures_to_arrow(input_path, output_path, compression=None):
+    columns = read_header(input_path)
+    # read_all() keeps the schema when a header-only file has no batches
+    table = open_measures(input_path, columns).read_all()
+    # One chunk per column, so every batch shares the same dictionaries
+    columnar = columnar_table(table)
+    batches = list(measure_batches(columnar, table["measure"]))
+    index = {measure: number for number, (measure, _) in enumerate(batches)}
+    schema = columnar.schema.with_metadata({INDEX_KEY: json.dumps(index)})
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    options = ipc.IpcWriteOptions(compression=compression)
+    with ipc.new_file(output_path, schema, options=options) as writer:
+        for _, batch in batches:
+            writer.write_batch(batch)
+
+
+# ---------------------------------------------------------
+# Reading
+# ---------------------------------------------------------
+
+def measures_index(path):
+    """Measure name -> record batch number."""
+    with pa.memory_map(str(path)) as source:
+        return json.loads(ipc.open_file(source).schema.metadata[INDEX_KEY])
+
+
+def read_measure(path, measure, drop_empty_groups=True):
+    """Rows of one measure, without its all-null group columns by default."""
+    with pa.memory_map(str(path)) as source:
+        reader = ipc.open_file(source)
+        index = json.loads(reader.schema.metadata[INDEX_KEY])
+        if measure not in index:
+            raise KeyError(f"No measure {measure} in {path}")
+        table = pa.Table.from_batches([reader.get_batch(index[measure])])
+    if drop_empty_groups:
+        fixed = {"measure", "interval_start", *VALUE_COLUMNS}
+        table = table.select(
+            [
+                name
+                for name in table.column_names
+                if name in fixed or table[name].null_count < table.num_rows
+            ]
+        )
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", nargs="+", required=True, type=Path)
+    parser.add_argument("--output-dir", default="output/measures", type=Path)
+    parser.add_argument("--compression", choices=["lz4", "zstd"], default=None)
+    args = parser.parse_args()
+
+    for input_path in args.input:
+        output_path = args.output_dir / Path(input_path.name.removesuffix(".gz")).with_suffix(
+            ".arrow"
+        )
+        measures_to_arrow(input_path, output_path, args.compression)
+
+
+if __name__ == "__main__":
+    main()
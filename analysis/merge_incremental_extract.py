@@ -0,0 +1,113 @@
+###################################################
+# This script merges an incremental death extract
+# into a stored full extract and records the new
+# watermark.
+#
+# Local only: it is not a project.yaml action. An
+# OpenSAFELY action cannot read its own earlier
+# outputs, and must not rewrite another action's,
+# so incremental extraction is for local runs
+# (dummy data or tools/local_backend.py). The
+# stored extract is never modified: the merged
+# extract is written to --output, with its
+# watermark alongside. The next merge uses that
+# output as --extract.
+#
+# The incremental extract is produced by
+# dataset_def/dataset_definition.py with
+# `-- --since <watermark>` and contains only patients
+# whose death, coded-death or registration data
+# changed since the watermark. Their rows replace
+# the stored rows (matched on patient_id); new
+# patients are added.
+#
+# Usage:
+#   python analysis/merge_incremental_extract.py \
+#     --extract output/highly_sensitive/dataset_death_TPP_ONS.arrow \
+#     --delta output/local/dataset_death_delta.arrow \
+#     --output output/local/dataset_death_TPP_ONS_merged.arrow \
+#     --watermark-date 2026-05-01
+###################################################
+
+import argparse
+import datetime
+import json
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+EXTRACT_PATH = Path("output/highly_sensitive/dataset_death_TPP_ONS.arrow")
+OUTPUT_PATH = Path("output/local/dataset_death_TPP_ONS_merged.arrow")
+
+
+def watermark_path(extract_path):
+    return Path(extract_path).with_suffix(".watermark.json")
+
+
+def read_watermark(extract_path):
+    path = watermark_path(extract_path)
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())["watermark"]
+
+
+def merge_extracts(stored, delta):
+    """Replace stored rows by patient_id with delta rows, adding new patients."""
+    if stored.schema.remove_metadata() != delta.schema.remove_metadata():
+        raise ValueError(
+            "Incremental extract columns do not match the stored extract; "
+            "re-run the full extraction"
+        )
+    replaced = pc.is_in(stored["patient_id"], value_set=delta["patient_id"])
+    merged = pa.concat_tables([stored.filter(pc.invert(replaced)), delta])
+    # Each IPC file batch must share one dictionary per categorical column
+    merged = merged.unify_dictionaries().combine_chunks()
+    merged = merged.sort_by("patient_id")
+    replaced_rows = pc.sum(replaced).as_py() or 0
+    counts = {
+        "replaced_rows": replaced_rows,
+        "added_rows": delta.num_rows - replaced_rows,
+        "total_rows": merged.num_rows,
+    }
+    return merged, counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--extract", default=EXTRACT_PATH, type=Path, help="stored extract (read only)")
+    parser.add_argument("--delta", required=True, type=Path)
+    parser.add_argument("--output", default=OUTPUT_PATH, type=Path)
+    parser.add_argument(
+        "--watermark-date",
+        required=True,
+        type=datetime.date.fromisoformat,
+        help="date the incremental extract was run from; the next run uses --since this date",
+    )
+    args = parser.parse_args()
+    if args.output.resolve() == args.extract.resolve():
+        parser.error("--output must differ from --extract (the stored extract is not modified)")
+
+    stored = feather.read_table(args.extract)
+    delta = feather.read_table(args.delta)
+    merged, counts = merge_extracts(stored, delta)
+
+    # Write alongside, then rename, so a failed write leaves no partial output
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = args.output.with_suffix(".tmp.arrow")
+    feather.write_feather(merged, tmp_path)
+    tmp_path.replace(args.output)
+
+    watermark = {
+        "extract": str(args.extract),
+        "previous_watermark": read_watermark(args.extract),
+        "watermark": args.watermark_date.isoformat(),
+        **counts,
+    }
+    watermark_path(args.output).write_text(json.dumps(watermark, indent=2))
+    print(json.dumps(watermark, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+###################################################
+# This script partitions the death extract by
+# death_date_ref_year (ONS death date, then TPP
+# death date), the year the reports group and
+# filter on, writing one Arrow file per year and a
+# manifest. Patients with only a TPP coded death
+# have no death_date_ref_year and go to the
+# ref_death_year=unknown partition.
+#
+# Year-restricted analyses read only the partitions
+# they need (read_analysis_extract_years() in
+# 0_utility_functions.R). A single year can be
+# recomputed with
+#   dataset_definition.py -- --ref-death-year YEAR
+# and swapped in with --replace-year.
+#
+# The unknown partition has no --ref-death-year
+# equivalent: it is only rebuilt by a full
+# rewrite. A patient whose reference year changed
+# (e.g. a coded-only death that now has an ONS
+# date) would otherwise be in two partitions, so
+# --replace-year is refused if the new partition
+# has patients that another partition holds; run a
+# full rewrite instead.
+#
+# Usage:
+#   python analysis/partition_extract.py
+#   python analysis/partition_extract.py --input year_2025.arrow --replace-year 2025
+###################################################
+
+import argparse
+import hashlib
+import json
+from pathlib import Path
+
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+EXTRACT_PATH = Path("output/highly_sensitive/dataset_death_TPP_ONS.arrow")
+PARTITION_DIR = Path("output/highly_sensitive/dataset_death_by_year")
+MANIFEST_NAME = "manifest.json"
+
+# Reference death year of the main analysis (dataset_definition.py)
+REF_DEATH_YEAR_COLUMN = "death_date_ref_year"
+
+
+def ref_death_year(table):
+    return table[REF_DEATH_YEAR_COLUMN]
+
+
+def partition_key(year):
+    return str(year) if year is not None else "unknown"
+
+
+def partition_name(year):
+    return f"ref_death_year={partition_key(year)}.arrow"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_partition(table, year, partition_dir):
+    path = partition_dir / partition_name(year)
+    # Unify dictionaries so the file has one dictionary per categorical column
+    table = table.unify_dictionaries().combine_chunks()
+    feather.write_feather(table, path)
+    return {"file": path.name, "rows": table.num_rows, "sha256": file_sha256(path)}
+
+
+def read_manifest(partition_dir):
+    path = partition_dir / MANIFEST_NAME
+    if not path.exists():
+        return {"partitions": {}}
+    return json.loads(path.read_text())
+
+
+def write_manifest(manifest, partition_dir):
+    manifest["partitions"] = dict(sorted(manifest["partitions"].items()))
+    manifest["total_rows"] = sum(p["rows"] for p in manifest["partitions"].values())
+    (partition_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+
+
+def moved_patients(table, manifest, partition_dir, year):
+    """Patients of a replacement partition held by another partition."""
+    patient_ids = table["patient_id"]
+    moved = 0
+    for key, partition in manifest["partitions"].items():
+        if key == partition_key(year):
+            continue
+        other = feather.read_table(partition_dir / partition["file"], columns=["patient_id"])
+        moved += pc.sum(pc.is_in(patient_ids, value_set=other["patient_id"])).as_py() or 0
+    return moved
+
+
+def partition_extract(table, partition_dir, only_year=None):
+    """Write one file per reference death year; return manifest entries."""
+    years = ref_death_year(table)
+    entries = {}
+    for year in pc.unique(years).to_pylist():
+        if only_year is not None and year != only_year:
+            raise ValueError(
+                f"Extract for {only_year} contains reference death year {year}"
+            )
+        mask = pc.is_null(years) if year is None else pc.equal(years, year)
+        rows = table.filter(pc.fill_null(mask, False))
+        entries[partition_key(year)] = write_partition(rows, year, partition_dir)
+    if only_year is not None and not entries:
+        entries[partition_key(only_year)] = write_partition(table, only_year, partition_dir)
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default=EXTRACT_PATH, type=Path)
+    parser.add_argument("--output-dir", default=PARTITION_DIR, type=Path)
+    parser.add_argument(
+        "--replace-year",
+        type=int,
+        default=None,
+        help="input is a single-year extract; replace only that partition",
+    )
+    args = parser.parse_args()
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    table = feather.read_table(args.input)
+
+    if args.replace_year is None:
+        # Full rewrite: drop partitions from previous runs
+        for old in args.output_dir.glob("ref_death_year=*.arrow"):
+            old.unlink()
+        manifest = {"partitions": {}}
+    else:
+        manifest = read_manifest(args.output_dir)
+        moved = moved_patients(table, manifest, args.output_dir, args.replace_year)
+        if moved:
+            parser.error(
+                f"{moved} patients of {args.replace_year} are in other partitions "
+                "(reference year changed); run a full rewrite"
+            )
+
+    manifest["partitions"].update(
+        partition_extract(table, args.output_dir, only_year=args.replace_year)
+    )
+    write_manifest(manifest, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+###################################################
+# Variation across practices in the proportion of
+# deaths by death source (ONS only / TPP only /
+# Both), as yearly percentiles of practice-level
+# percentages, from the measure_practice.py
+# outputs.
+#
+# Input is the source bitmask measure
+# source_bits_mortality_practice (see
+# unpack_source_measures.py). Its groups with a
+# death bit are the deaths in the interval, by
+# practice at interval start:
+#   TPP death only (4)  -> TPP_only
+#   ONS death only (8)  -> ONS_only
+#   both (12)           -> Both
+# Deaths are counted into one dense
+# year x practice x source array; the fill of
+# missing source combinations, the practice-year
+# threshold (more than 30 deaths) and all nine
+# deciles (R quantile type 3) are then computed in
+# a single vectorised step.
+#
+# The table has the columns of
+# 6_variation_source_by_practice.R, but not the
+# same counts: there, a death's year and source
+# come from the reference death date and its
+# practice from the date of death; here, each
+# source counts in the interval of its own death
+# date (with the grace period after
+# deregistration) and the practice is the one at
+# interval start (see measure_practice.py).
+#
+# Usage:
+#   python analysis/practice_percentiles.py
+###################################################
+
+import argparse
+import csv
+import math
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from sdc_measures import open_measures, read_header, round_counts
+from unpack_source_measures import ALIVE_GP, ALIVE_ONS, GP_DEATH, ONS_DEATH
+
+INPUT_PATH = Path("output/highly_sensitive/measures/measures_practice_source_bits.csv")
+OUTPUT_PATH = Path(
+    "output/analysis_tables/table_practice_percentiles_by_death_source_measures.csv"
+)
+
+MEASURE = "source_bits_mortality_practice"
+
+DEATH_SOURCES = ["ONS_only", "TPP_only", "Both"]
+
+# Death bits of a group -> index in DEATH_SOURCES
+SOURCE_OF_DEATH_BITS = {ONS_DEATH: 0, GP_DEATH: 1, GP_DEATH | ONS_DEATH: 2}
+
+# Practice-years with more deaths than this are included
+MIN_PRACTICE_YEAR_DEATHS = 30
+
+# 10th, 20th, ..., 90th percentile (as R's seq(0.1, 0.9, by = 0.1))
+PROBS = 0.1 + np.arange(9) * 0.1
+PERCENTILES = list(range(10, 100, 10))
+
+
+def format_value(value):
+    # As readr::write_csv: NA for missing, no trailing ".0" on whole numbers
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "NA"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+# ---------------------------------------------------------
+# Load
+# ---------------------------------------------------------
+
+def read_practice_deaths(path):
+    """Year, practice, death source index and count of each death group."""
+    columns = read_header(path)
+    parts = []
+    for batch in open_measures(path, columns):
+        table = pa.Table.from_batches([batch])
+        table = table.filter(pc.equal(table["measure"], MEASURE))
+        bits = pc.cast(table["source_bits"], pa.int64()).to_numpy(zero_copy_only=False)
+        death_bits = bits & (GP_DEATH | ONS_DEATH)
+        # Deaths counted in the global denominator (as unpacked)
+        keep = (death_bits > 0) & ((bits & (ALIVE_GP | ALIVE_ONS)) > 0)
+        table = table.filter(pa.array(keep))
+        parts.append(
+            (
+                pc.year(pc.strptime(table["interval_start"], format="%Y-%m-%d", unit="s"))
+                .to_numpy(zero_copy_only=False),
+                # A missing practice is its own group, as in dplyr::count()
+                pc.fill_null(pc.cast(table["practice"], pa.int64()), -1)
+                .to_numpy(zero_copy_only=False),
+                np.vectorize(SOURCE_OF_DEATH_BITS.get, otypes=[np.int64])(death_bits[keep])
+                if keep.any()
+                else np.empty(0, np.int64),
+                pc.fill_null(table["denominator"], 0).to_numpy(zero_copy_only=False),
+            )
+        )
+    if not parts:
+        return tuple(np.empty(0, np.int64) for _ in range(4))
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+
+# ---------------------------------------------------------
+# Percentiles
+# ---------------------------------------------------------
+
+def quantile_type3(sorted_values, n, probs):
+    """R quantile(type = 3) for each row of a sorted, right-padded array.
+
+    sorted_values: (groups, max_n) with each row's n values first
+    n: (groups,) number of values per row (> 0)
+    """
+    fuzz = 4 * np.finfo(float).eps
+    nppm = n[:, None] * probs[None, :] - 0.5
+    j = np.floor(nppm + fuzz).astype(int)
+    h = (nppm != j) | (j % 2 == 1)
+    # 1-based order statistic j (or j + 1), clamped to [1, n]
+    index = np.clip(np.where(h, j + 1, j), 1, n[:, None]) - 1
+    return np.take_along_axis(sorted_values, index, axis=1)
+
+
+def practice_percentiles(years, practices, source_index, deaths):
+    if len(years) == 0:
+        return []
+    year_values, year_index = np.unique(years, return_inverse=True)
+    _, practice_index = np.unique(practices, return_inverse=True)
+
+    n_years, n_practices, n_sources = (
+        len(year_values),
+        practice_index.max() + 1 if len(practice_index) else 0,
+        len(DEATH_SOURCES),
+    )
+    flat = (year_index * n_practices + practice_index) * n_sources + source_index
+    counts = np.bincount(flat, weights=deaths, minlength=n_years * n_practices * n_sources)
+    # Missing source combinations are filled with 0 by construction
+    counts = counts.reshape(n_years, n_practices, n_sources)
+
+    total = counts.sum(axis=2)
+    included = total > MIN_PRACTICE_YEAR_DEATHS
+    with np.errstate(invalid="ignore", divide="ignore"):
+        perc = 100 * counts / total[:, :, None]
+
+    # Excluded practice-years sort to the end of each (year, source) row
+    perc = np.where(included[:, :, None], perc, np.inf)
+    perc = np.sort(perc.transpose(0, 2, 1), axis=2)  # (year, source, practice)
+    n_included = included.sum(axis=1)
+
+    has_practices = n_included > 0
+    values = quantile_type3(
+        perc[has_practices].reshape(-1, n_practices),
+        np.repeat(n_included[has_practices], n_sources),
+        PROBS,
+    ).reshape(-1, n_sources, len(PROBS))
+    n_rounded = round_counts(n_included[has_practices].astype(float))
+
+    rows = []
+    for year, n, year_values_ in zip(year_values[has_practices], n_rounded, values):
+        for source_position, source in enumerate(DEATH_SOURCES):
+            for percentile, value in zip(PERCENTILES, year_values_[source_position]):
+                rows.append(
+                    {
+                        "year": int(year),
+                        "death_source": source,
+                        "n_practices": None if np.isnan(n) else int(n),
+                        "percentile": percentile,
+                        "value": round(float(value), 1),
+                        "line_group": "median" if percentile == 50 else "decile",
+                    }
+                )
+
+    rows.sort(key=lambda row: (row["year"], row["death_source"], row["percentile"]))
+    return rows
+
+
+def write_table(rows, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    columns = ["year", "death_source", "n_practices", "percentile", "value", "line_group"]
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([format_value(row[column]) for column in columns])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default=INPUT_PATH, type=Path)
+    parser.add_argument("--output", default=OUTPUT_PATH, type=Path)
+    args = parser.parse_args()
+
+    write_table(practice_percentiles(*read_practice_deaths(args.input)), args.output)
+
+
+if __name__ == "__main__":
+    main()
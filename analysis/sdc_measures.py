@@ -0,0 +1,213 @@
+###################################################
+# Statistical disclosure control for the measures
+# outputs (measure_def.py, measure_practice.py and
+# measure_death_source.py).
+#
+# Each file is streamed in record batches, so the
+# long-format measures file is never held in
+# memory. For every row:
+#   - numerator and denominator are rounded as in
+#     rounding() (0 kept, <= 7 suppressed, otherwise
+#     rounded to the nearest 5)
+#   - the ratio is recomputed from the rounded values
+#
+# Secondary suppression: the subgroup cells of a
+# measure (e.g. GP_mortality_sex) in one interval
+# add up to the matching *_overall measure. If
+# exactly one cell in that measure x interval block
+# is suppressed, it could be recovered from the
+# overall total, so the smallest other non-zero
+# cell is suppressed as well.
+#
+# Rows of a measure x interval block must be
+# contiguous, as written by ehrQL.
+#
+# Usage:
+#   python analysis/sdc_measures.py \
+#     --input output/highly_sensitive/measures/measures.csv \
+#     --output-dir output/measures
+###################################################
+
+import argparse
+import csv
+import gzip
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+COUNT_COLUMNS = ["numerator", "denominator"]
+NUMERIC_COLUMNS = {"ratio": pa.float64(), "numerator": pa.int64(), "denominator": pa.int64()}
+
+OVERALL_SUFFIX = "_overall"
+
+# Bytes read per record batch
+BLOCK_SIZE = 1 << 24
+
+
+# ---------------------------------------------------------
+# Rounding and suppression
+# ---------------------------------------------------------
+
+def round_counts(values):
+    # As rounding() in 0_utility_functions.R; NaN = suppressed
+    rounded = np.where(values > 7, np.round(values / 5) * 5, np.nan)
+    return np.where(values == 0, 0.0, rounded)
+
+
+def secondary_suppress(rounded, original, block, eligible):
+    """Suppress the smallest other non-zero cell of blocks with one suppressed cell.
+
+    rounded: rounded counts (NaN = suppressed), updated in place
+    original: unrounded counts
+    block: block index of each row
+    eligible: rows whose block adds up to a published overall total
+    """
+    primary = np.isnan(rounded) & ~np.isnan(original) & eligible
+    n_suppressed = np.bincount(block, weights=primary, minlength=block.max() + 1)
+    candidates = np.flatnonzero(
+        eligible & (n_suppressed[block] == 1) & ~np.isnan(rounded) & (rounded > 0)
+    )
+    if len(candidates) == 0:
+        return rounded
+    order = candidates[np.lexsort((original[candidates], block[candidates]))]
+    _, first = np.unique(block[order], return_index=True)
+    rounded[order[first]] = np.nan
+    return rounded
+
+
+def to_numpy(column):
+    return pc.cast(column, pa.float64()).to_numpy(zero_copy_only=False)
+
+
+def to_int_array(values):
+    missing = np.isnan(values)
+    return pa.array(np.where(missing, 0, values).astype(np.int64), mask=missing)
+
+
+def apply_sdc(table, secondary_measures):
+    """Round, suppress and recompute ratios for complete measure x interval blocks."""
+    keys = pc.binary_join_element_wise(
+        table["measure"], table["interval_start"], "|"
+    ).to_numpy(zero_copy_only=False)
+    _, block = np.unique(keys, return_inverse=True)
+    eligible = pc.is_in(
+        table["measure"], value_set=pa.array(sorted(secondary_measures), pa.string())
+    ).to_numpy(zero_copy_only=False)
+
+    counts = {}
+    for column in COUNT_COLUMNS:
+        original = to_numpy(table[column])
+        counts[column] = secondary_suppress(
+            round_counts(original), original, block, eligible
+        )
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratio = counts["numerator"] / counts["denominator"]
+    ratio[~np.isfinite(ratio)] = np.nan
+
+    for column in COUNT_COLUMNS:
+        table = table.set_column(
+            table.schema.get_field_index(column), column, to_int_array(counts[column])
+        )
+    return table.set_column(
+        table.schema.get_field_index("ratio"),
+        "ratio",
+        pa.array(ratio, mask=np.isnan(ratio)),
+    )
+
+
+# ---------------------------------------------------------
+# Streaming
+# ---------------------------------------------------------
+
+def read_header(path):
+    opener = gzip.open if Path(path).suffix == ".gz" else open
+    with opener(path, "rt", newline="") as f:
+        return next(csv.reader(f))
+
+
+def open_measures(path, columns):
+    # Group columns are read as text, so values round-trip unchanged
+    column_types = {column: NUMERIC_COLUMNS.get(column, pa.string()) for column in columns}
+    return pa_csv.open_csv(
+        path,
+        read_options=pa_csv.ReadOptions(block_size=BLOCK_SIZE),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=column_types,
+            include_columns=columns,
+            strings_can_be_null=True,
+        ),
+    )
+
+
+def secondary_suppression_measures(path):
+    """Grouped measures with a matching *_overall measure in the same file."""
+    names = set()
+    for batch in open_measures(path, ["measure"]):
+        names.update(pc.unique(batch.column("measure")).to_pylist())
+    prefixes = {
+        name[: -len(OVERALL_SUFFIX)] for name in names if name.endswith(OVERALL_SUFFIX)
+    }
+    return {
+        name
+        for name in names
+        if not name.endswith(OVERALL_SUFFIX)
+        and any(name.startswith(f"{prefix}_") for prefix in prefixes)
+    }
+
+
+def complete_blocks(batches):
+    """Yield tables of whole measure x interval blocks from a stream of batches."""
+    pending = None
+    finished = set()
+    for batch in batches:
+        table = pa.Table.from_batches([batch])
+        if pending is not None:
+            table = pa.concat_tables([pending, table])
+        if table.num_rows == 0:
+            continue
+        keys = pc.binary_join_element_wise(table["measure"], table["interval_start"], "|")
+        # The last block may continue in the next batch
+        last_key = keys[-1].as_py()
+        is_last = pc.equal(keys, last_key)
+        complete = table.filter(pc.invert(is_last))
+        pending = table.filter(is_last)
+
+        complete_keys = set(pc.unique(keys.filter(pc.invert(is_last))).to_pylist())
+        if (complete_keys | {last_key}) & finished:
+            raise ValueError("Measures rows are not grouped by measure and interval")
+        finished |= complete_keys
+        if complete.num_rows:
+            yield complete
+    if pending is not None and pending.num_rows:
+        yield pending
+
+
+def sdc_measures(input_path, output_path):
+    columns = read_header(input_path)
+    secondary_measures = secondary_suppression_measures(input_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for table in complete_blocks(open_measures(input_path, columns)):
+            table = apply_sdc(table, secondary_measures)
+            for row in zip(*[table[column].to_pylist() for column in columns]):
+                writer.writerow(["" if value is None else value for value in row])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", nargs="+", required=True, type=Path)
+    parser.add_argument("--output-dir", default="output/measures", type=Path)
+    args = parser.parse_args()
+
+    for input_path in args.input:
+        sdc_measures(input_path, args.output_dir / input_path.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+###################################################
+# This script unpacks the source bitmask measures
+# (source_bits_mortality_* in measure_def.py and
+# measure_practice.py) into GP, ONS and global
+# mortality measures.
+#
+# Each patient-interval in the global denominator
+# is counted in one group of source_bits, the sum
+# of:
+#   1  alive at interval start (TPP date of death)
+#   2  alive at interval start (ONS date of death)
+#   4  TPP death in the interval (registered)
+#   8  ONS death in the interval (registered)
+# (must match variables.py). For each source, the
+# denominator sums the groups with its alive bit
+# and the numerator the groups that also have its
+# death bit.
+#
+# source_bits_mortality_{subgroup} becomes
+# {GP,ONS,global}_mortality_{subgroup}, in the
+# measures output format without the source_bits
+# column. Other measures are copied unchanged.
+#
+# The rollup measure (ROLLUP_MEASURE in
+# dataset_def/rollup.py) is grouped by source_bits
+# and every subgroup at once. Each of its rows is
+# added to mortality_overall and, for each
+# subgroup, to mortality_{subgroup} at that
+# subgroup's value, so the overall and subgroup
+# measures all come from one grouped count.
+#
+# The input counts must not have been rounded or
+# suppressed (the definitions disable ehrQL's
+# disclosure control; sdc_measures.py applies it
+# to the output).
+#
+# Measures named check_{source}_mortality_{...}
+# (measure_def.py -- --check-sources) are defined
+# directly per source: they are compared with the
+# unpacked counts, and not output. Any difference
+# is an error.
+###################################################
+
+import argparse
+import csv
+from collections import defaultdict
+from pathlib import Path
+
+from dataset_def.rollup import ROLLUP_MEASURE, ROLLUP_SUBGROUPS
+
+INPUT_PATH = Path("output/highly_sensitive/measures/measures_source_bits.csv")
+OUTPUT_PATH = Path("output/highly_sensitive/measures/measures.csv")
+
+SOURCE_BITS_PREFIX = "source_bits_"
+SOURCE_BITS_COLUMN = "source_bits"
+CHECK_PREFIX = "check_"
+
+ALIVE_GP = 1
+ALIVE_ONS = 2
+GP_DEATH = 4
+ONS_DEATH = 8
+
+# Source: (denominator bits, numerator bits); a group counts if it has any of them
+SOURCES = {
+    "GP": (ALIVE_GP, GP_DEATH),
+    "ONS": (ALIVE_ONS, ONS_DEATH),
+    "global": (ALIVE_GP | ALIVE_ONS, GP_DEATH | ONS_DEATH),
+}
+
+
+def source_counts(bits, count):
+    """Numerator and denominator counted for each source by one bitmask group."""
+    for source, (denominator_bits, numerator_bits) in SOURCES.items():
+        in_denominator = bool(bits & denominator_bits)
+        in_numerator = in_denominator and bool(bits & numerator_bits)
+        yield source, count if in_numerator else 0, count if in_denominator else 0
+
+
+def check_differences(checks, counts):
+    """Check measures whose counts differ from the unpacked ones.
+
+    Returns (measure, interval_start, groups, direct, unpacked) tuples, with
+    counts as (numerator, denominator).
+    """
+    differences = []
+    for (measure, interval_start, groups), direct in checks.items():
+        source, _, unpacked_measure = measure.partition("_")
+        entry = counts.get((source, unpacked_measure, interval_start, groups))
+        unpacked = (entry["numerator"], entry["denominator"]) if entry else (0, 0)
+        if unpacked != direct:
+            differences.append((measure, interval_start, groups, direct, unpacked))
+    return differences
+
+
+def rollup_groups(row, group_columns):
+    """(measure, group values) of the overall and subgroup cells of a rollup row."""
+    yield "mortality_overall", tuple("" for _ in group_columns)
+    for subgroup in ROLLUP_SUBGROUPS:
+        yield f"mortality_{subgroup}", tuple(
+            row[column] if column == subgroup else "" for column in group_columns
+        )
+
+
+def unpack(rows, group_columns, excluded=()):
+    """Yield rows that are not bitmask measures, then the unpacked source measures.
+
+    Unpacked rows are ordered by source, measure (in input order) and interval,
+    so each measure x interval block is contiguous. Raises ValueError if a
+    check measure differs from the unpacked counts.
+    """
+    # (source, measure, interval_start, group values) -> counts
+    counts = defaultdict(lambda: {"numerator": 0, "denominator": 0, "end": None})
+    # (measure, interval_start, group values) -> (numerator, denominator)
+    checks = {}
+    # Unpacked measure -> position of its first appearance
+    measure_order = {}
+    for row in rows:
+        if row["measure"].startswith(CHECK_PREFIX):
+            groups = tuple(row[column] for column in group_columns)
+            key = (row["measure"][len(CHECK_PREFIX) :], row["interval_start"], groups)
+            checks[key] = (int(row["numerator"] or 0), int(row["denominator"] or 0))
+            continue
+        if not row["measure"].startswith(SOURCE_BITS_PREFIX):
+            yield {column: row[column] for column in row if column != SOURCE_BITS_COLUMN}
+            continue
+        if row["measure"] == ROLLUP_MEASURE:
+            cells = list(rollup_groups(row, group_columns))
+        else:
+            cells = [
+                (
+                    row["measure"][len(SOURCE_BITS_PREFIX) :],
+                    tuple(row[column] for column in group_columns),
+                )
+            ]
+        # numerator = denominator = patients in the group
+        for source, numerator, denominator in source_counts(
+            int(row[SOURCE_BITS_COLUMN]), int(row["denominator"] or 0)
+        ):
+            for measure, groups in cells:
+                measure_order.setdefault(measure, len(measure_order))
+                entry = counts[(source, measure, row["interval_start"], groups)]
+                entry["numerator"] += numerator
+                entry["denominator"] += denominator
+                entry["end"] = row["interval_end"]
+
+    differences = check_differences(checks, counts)
+    if differences:
+        raise ValueError(
+            "Unpacked counts differ from the check measures (direct, unpacked):\n"
+            + "\n".join(
+                f"  {measure} {interval_start} {groups}: {direct} {unpacked}"
+                for measure, interval_start, groups, direct, unpacked in differences
+            )
+        )
+    if checks:
+        print(f"{len(checks)} check measure rows match the unpacked counts")
+
+    for (source, measure, interval_start, groups), entry in sorted(
+        counts.items(),
+        key=lambda item: (
+            list(SOURCES).index(item[0][0]), measure_order[item[0][1]], item[0][2]
+        ),
+    ):
+        name = f"{source}_{measure}"
+        # Groups without anyone in this source's denominator are not output
+        if name in excluded or entry["denominator"] == 0:
+            continue
+        yield {
+            "measure": name,
+            "interval_start": interval_start,
+            "interval_end": entry["end"],
+            "ratio": entry["numerator"] / entry["denominator"],
+            "numerator": entry["numerator"],
+            "denominator": entry["denominator"],
+            **dict(zip(group_columns, groups)),
+        }
+
+
+def unpack_file(input_path, output_path, excluded=()):
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(input_path, newline="") as f_in, open(output_path, "w", newline="") as f_out:
+        reader = csv.DictReader(f_in)
+        fieldnames = [column for column in reader.fieldnames if column != SOURCE_BITS_COLUMN]
+        group_columns = fieldnames[6:]
+        writer = csv.DictWriter(f_out, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(unpack(reader, group_columns, set(excluded)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default=INPUT_PATH, type=Path)
+    parser.add_argument("--output", default=OUTPUT_PATH, type=Path)
+    parser.add_argument(
+        "--exclude", nargs="*", default=[], help="unpacked measures not to output"
+    )
+    args = parser.parse_args()
+
+    unpack_file(args.input, args.output, args.exclude)
+
+
+if __name__ == "__main__":
+    main()
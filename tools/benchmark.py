@@ -0,0 +1,194 @@
+###################################################
+# Benchmark suite for the ehrQL definitions in
+# analysis/dataset_def/ at scaled population sizes.
+#
+# For each population size, TPP-shaped tables are
+# generated with tools/generate_dummy_tables.py and
+# each definition is run against them locally. Wall
+# time, peak RSS and output rows are recorded per
+# action and written to benchmarks/results/ as JSON.
+#
+# With --backend sqlite, the tables are bulk loaded
+# into a SQLite file (tools/local_backend.py) and
+# run through ehrQL's SQLite query engine instead,
+# so query plans and indexes are exercised.
+#
+# Each action is run --repeat times and the median
+# of each metric is recorded, so one slow run does
+# not count. Results are compared with a saved
+# baseline (benchmarks/baseline.json): a metric
+# regressed if it is both more than --tolerance
+# above the baseline and above it by more than an
+# absolute noise threshold (NOISE), and the script
+# then exits with status 1.
+#
+# Peak RSS is that of the local ehrQL process; with
+# EHRQL_COMMAND="opensafely exec ..." it cannot be
+# measured (see tools/ehrql_runner.py), is recorded
+# as null and is not compared.
+#
+# Usage:
+#   python tools/benchmark.py --sizes 10000 100000
+#   python tools/benchmark.py --save-baseline
+#   python tools/benchmark.py --sizes 100000 --backend sqlite
+###################################################
+
+import argparse
+import datetime
+import json
+import statistics
+import sys
+from pathlib import Path
+
+import generate_dummy_tables
+import local_backend
+from ehrql_runner import count_rows, ehrql_command, run_command
+
+BENCHMARK_DIR = Path("benchmarks")
+BASELINE_PATH = BENCHMARK_DIR / "baseline.json"
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+# Share of generated patients with a death. The dataset definition keeps
+# only the deceased; the measures also need living patients.
+DECEASED_FRACTION = 0.1
+
+# action name: (ehrQL command, definition, output file)
+ACTIONS = {
+    "dataset_death_raw": (
+        "generate-dataset",
+        "analysis/dataset_def/dataset_definition.py",
+        "dataset_death_TPP_ONS.arrow",
+    ),
+    "measures": (
+        "generate-measures",
+        "analysis/dataset_def/measure_def.py",
+        "measures.csv",
+    ),
+    "measures_practice": (
+        "generate-measures",
+        "analysis/dataset_def/measure_practice.py",
+        "measures_practice.csv",
+    ),
+}
+
+# Allowed slowdown / memory growth relative to the baseline
+TOLERANCE = 0.2
+
+# Smallest absolute change counted as a regression (run-to-run noise)
+NOISE = {"wall_time_s": 1.0, "peak_rss_mb": 50.0}
+
+# Runs per action; the median of each metric is recorded
+REPEAT = 3
+
+
+def prepare_tables(size, seed=0):
+    tables_dir = BENCHMARK_DIR / "tables" / str(size)
+    if not (tables_dir / "patients.arrow").exists():
+        tables = generate_dummy_tables.generate_tables(size, DECEASED_FRACTION, seed)
+        generate_dummy_tables.write_tables(tables, tables_dir)
+    return tables_dir
+
+
+def data_source(size, backend):
+    """ehrQL arguments for the data to run against."""
+    if backend == "sqlite":
+        path = local_backend.prepare_database(size, DECEASED_FRACTION)
+        return ["--dsn", local_backend.dsn(path), "--query-engine", "sqlite"]
+    return ["--dummy-tables", prepare_tables(size)]
+
+
+def median_stats(runs):
+    """Median of each metric over successful runs, or the first failed run."""
+    failed = [run for run in runs if run["returncode"] != 0]
+    if failed:
+        return failed[0]
+    stats = {"returncode": 0, "runs": len(runs)}
+    for metric in NOISE:
+        values = [run[metric] for run in runs if run[metric] is not None]
+        stats[metric] = round(statistics.median(values), 3) if values else None
+    return stats
+
+
+def run_action(name, size, source, run_dir, repeat=REPEAT):
+    command, definition, output = ACTIONS[name]
+    output_path = run_dir / str(size) / output
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    stats = median_stats(
+        [
+            run_command(
+                ehrql_command(command, definition, *source, "--output", output_path),
+                log_path=output_path.with_suffix(".log"),
+            )
+            for _ in range(repeat)
+        ]
+    )
+    stats["output_rows"] = count_rows(output_path)
+    return stats
+
+
+def find_regressions(results, baseline, tolerance=TOLERANCE, noise=NOISE):
+    regressions = []
+    for key, stats in results.items():
+        base = baseline.get(key)
+        if base is None or stats["returncode"] != 0:
+            continue
+        for metric, threshold in noise.items():
+            value, base_value = stats.get(metric), base.get(metric)
+            if value is None or not base_value:
+                continue
+            if value > base_value * (1 + tolerance) and value - base_value > threshold:
+                regressions.append(
+                    f"{key}: {metric} {value} > baseline {base_value}"
+                )
+        if stats["output_rows"] != base["output_rows"]:
+            regressions.append(
+                f"{key}: output_rows {stats['output_rows']} != baseline {base['output_rows']}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--actions", nargs="+", choices=list(ACTIONS), default=list(ACTIONS))
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--backend", choices=["dummy-tables", "sqlite"], default="dummy-tables")
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    run_dir = BENCHMARK_DIR / "runs" / timestamp
+
+    results = {}
+    for size in args.sizes:
+        source = data_source(size, args.backend)
+        for name in args.actions:
+            key = f"{name}/{size}"
+            if args.backend != "dummy-tables":
+                key = f"{key}/{args.backend}"
+            results[key] = run_action(name, size, source, run_dir, args.repeat)
+            print(key, results[key])
+
+    results_path = BENCHMARK_DIR / "results" / f"{timestamp}.json"
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    results_path.write_text(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        BASELINE_PATH.write_text(json.dumps(results, indent=2))
+        return
+
+    failed = [key for key, stats in results.items() if stats["returncode"] != 0]
+    baseline = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+    regressions = find_regressions(results, baseline, args.tolerance)
+    for message in failed:
+        print(f"FAILED: {message}")
+    for message in regressions:
+        print(f"REGRESSION: {message}")
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+###################################################
+# Checks analysis/interval_counts.py against the
+# ehrQL definitions it reproduces, on generated
+# facts.
+#
+# The reference counts are computed per patient
+# and interval in plain Python, following the
+# rules of analysis/dataset_def/measure_def.py
+# (overall counts) and measure_practice.py
+# (--group-by practice) as ehrQL evaluates them
+# (e.g. for_patient_on(d) keeps registrations with
+# start_date <= d and end_date >= d or open; null
+# comparisons are false). They are independent of the vectorised
+# code, so agreement is with ehrQL semantics, not
+# with an earlier implementation.
+#
+# The generated facts are written in the
+# dataset_interval_facts.py output layout and read
+# back with read_facts(). A share of registrations
+# end or start exactly on interval boundaries, and
+# a share of deaths fall on them, so the boundary
+# cases are always exercised. Practice counts run
+# with a small memory budget, so the facts are
+# split into several parts and partial counts are
+# spilled to disk.
+#
+# ehrQL leaves the order of tied rows unspecified:
+# generated patients have no two registrations
+# with the same start and end (for_patient_on()),
+# and for sort_by(start_date) the reference breaks
+# ties by end date, as interval_counts.py does.
+#
+# Usage:
+#   python tools/check_interval_counts.py
+#   python tools/check_interval_counts.py --population-size 20000 --unit months --periods 30
+###################################################
+
+import argparse
+import datetime
+import random
+import sys
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# analysis/ scripts are run as scripts, not installed
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "analysis"))
+
+import interval_counts  # noqa: E402
+
+SEXES = ["male", "female", "intersex", "unknown"]
+
+# Share of dates moved onto an interval boundary
+BOUNDARY_FRACTION = 0.2
+
+
+# ---------------------------------------------------------
+# Generated facts
+# ---------------------------------------------------------
+
+def random_date(rng, first, last):
+    return first + datetime.timedelta(days=rng.randrange((last - first).days + 1))
+
+
+def near_boundary(rng, date, boundaries):
+    """date, or (sometimes) the interval boundary nearest to it, or the day before."""
+    if rng.random() >= BOUNDARY_FRACTION:
+        return date
+    nearest = min(boundaries, key=lambda boundary: abs((boundary - date).days))
+    return nearest - datetime.timedelta(days=rng.choice([0, 0, 1]))
+
+
+def generate_facts(population_size, intervals, seed=0):
+    """Patient rows and registration rows, as extracted by dataset_interval_facts.py."""
+    rng = random.Random(seed)
+    first, last = intervals[0][0], intervals[-1][1]
+    boundaries = [start for start, _ in intervals] + [last + datetime.timedelta(days=1)]
+    span_first = first - datetime.timedelta(days=3 * 365)
+    span_last = last + datetime.timedelta(days=365)
+
+    patients, registrations = [], []
+    for patient_id in range(1, population_size + 1):
+        date_of_birth = (
+            None
+            if rng.random() < 0.01
+            else near_boundary(rng, random_date(rng, datetime.date(1895, 1, 1), last), boundaries)
+        )
+        born = date_of_birth or span_first
+
+        tpp_death_date = ons_death_date = None
+        if rng.random() < 0.3:
+            death = near_boundary(rng, random_date(rng, max(born, span_first), span_last), boundaries)
+            source = rng.random()
+            if source < 0.8:
+                tpp_death_date = death
+            if source > 0.1:
+                ons_death_date = death + datetime.timedelta(days=rng.choice([0, 0, 0, 1, -3, 40]))
+
+        spans = []
+        for _ in range(rng.choice([0, 1, 1, 2, 3])):
+            start = near_boundary(rng, random_date(rng, min(born, span_last), span_last), boundaries)
+            end = (
+                None
+                if rng.random() < 0.4
+                else near_boundary(rng, random_date(rng, start, span_last), boundaries)
+            )
+            practice = None if rng.random() < 0.05 else rng.randrange(1, 40)
+            # Registrations with the same start and end are in no defined order
+            if (start, end) not in [(span[0], span[1]) for span in spans]:
+                spans.append((start, end, practice))
+        for start, end, practice in spans:
+            registrations.append(
+                {
+                    "patient_id": patient_id,
+                    "start_date": start,
+                    "end_date": end,
+                    "practice_pseudo_id": practice,
+                }
+            )
+
+        patients.append(
+            {
+                "patient_id": patient_id,
+                "date_of_birth": date_of_birth,
+                "sex": rng.choice(SEXES),
+                "tpp_death_date": tpp_death_date,
+                "ons_death_date": ons_death_date,
+                "last_registration_end_date": last_registration_end(spans),
+            }
+        )
+    return patients, registrations
+
+
+def last_registration_end(spans):
+    # sort_by(start_date, end_date).last_for_patient(): nulls sort first
+    if not spans:
+        return None
+    key = lambda span: (span[0], span[1] is not None, span[1] or datetime.date.min)
+    return max(spans, key=key)[1]
+
+
+def write_facts(patients, registrations, input_dir):
+    input_dir = Path(input_dir)
+    input_dir.mkdir(parents=True, exist_ok=True)
+    feather.write_feather(pa.Table.from_pylist(patients), input_dir / "dataset.arrow")
+    feather.write_feather(
+        pa.Table.from_pylist(
+            registrations,
+            schema=pa.schema(
+                [
+                    ("patient_id", pa.int64()),
+                    ("start_date", pa.date32()),
+                    ("end_date", pa.date32()),
+                    ("practice_pseudo_id", pa.int64()),
+                ]
+            ),
+        ),
+        input_dir / "registrations.arrow",
+    )
+
+
+# ---------------------------------------------------------
+# Reference counts (ehrQL semantics, one patient at a time)
+# ---------------------------------------------------------
+
+def age_on(date_of_birth, date):
+    if date_of_birth is None:
+        return None
+    birthday_passed = (date.month, date.day) >= (date_of_birth.month, date_of_birth.day)
+    return date.year - date_of_birth.year - (0 if birthday_passed else 1)
+
+
+def registered_on(registrations, date):
+    """Registrations spanning the date, as for_patient_on()."""
+    return [
+        registration
+        for registration in registrations
+        if registration["start_date"] <= date
+        and (registration["end_date"] is None or registration["end_date"] >= date)
+    ]
+
+
+def is_on_or_after(date, other):
+    return date is not None and date >= other
+
+
+def death_in_interval(death_date, start, end, last_end):
+    # is_during(INTERVAL) & (on or before last end + grace | last end is null)
+    if death_date is None or not start <= death_date <= end:
+        return False
+    return last_end is None or death_date <= last_end + datetime.timedelta(
+        days=interval_counts.GRACE_DAYS
+    )
+
+
+def patient_interval(patient, registrations, start, end):
+    """(alive, died) by source for one patient-interval of measure_def.py; None if not eligible."""
+    age = age_on(patient["date_of_birth"], start)
+    has_possible_age = (age is not None and 0 < age < 110) or (
+        patient["date_of_birth"] is not None and patient["date_of_birth"].year == start.year
+    )
+    is_eligible = (
+        bool(registered_on(registrations, start))
+        and has_possible_age
+        and patient["sex"] in ("male", "female")
+    )
+    if not is_eligible:
+        return None
+    return alive_and_died(patient, start, end)
+
+
+def alive_and_died(patient, start, end):
+    """Alive on the interval start and registered death in it, by source."""
+    tpp, ons = patient["tpp_death_date"], patient["ons_death_date"]
+    last_end = patient["last_registration_end_date"]
+    alive = {
+        "GP": tpp is None or is_on_or_after(tpp, start),
+        "ONS": ons is None or is_on_or_after(ons, start),
+    }
+    alive["global"] = alive["GP"] or alive["ONS"]
+    died = {
+        "GP": death_in_interval(tpp, start, end, last_end),
+        "ONS": death_in_interval(ons, start, end, last_end),
+    }
+    died["global"] = died["GP"] or died["ONS"]
+    return alive, died
+
+
+def registration_order(registration):
+    # Start date, then end date with open registrations last
+    end = registration["end_date"]
+    return registration["start_date"], end is None, end or datetime.date.min
+
+
+def practice_patient_interval(patient, registrations, start, end):
+    """(alive, died, practice) for one patient-interval of measure_practice.py; None if not eligible."""
+    on_start = registered_on(registrations, start)
+    date_of_birth = patient["date_of_birth"]
+    born_in_interval = date_of_birth is not None and start <= date_of_birth <= end
+    has_registration = bool(on_start) or (
+        born_in_interval
+        and any(start <= registration["start_date"] <= end for registration in registrations)
+    )
+    age = age_on(date_of_birth, start)
+    has_possible_age = (age is not None and 0 < age < 110) or born_in_interval
+    if not (has_registration and has_possible_age and patient["sex"] in ("male", "female")):
+        return None
+
+    # practice_gral: for_patient_on() prefers the latest start, then the longest
+    practice_gral = (
+        max(on_start, key=registration_order)["practice_pseudo_id"] if on_start else None
+    )
+    # practice_babies: first registration of a patient born in the interval
+    practice_babies = (
+        min(registrations, key=registration_order)["practice_pseudo_id"]
+        if born_in_interval and registrations
+        else None
+    )
+    practice = practice_gral if practice_gral is not None else practice_babies
+
+    return (*alive_and_died(patient, start, end), practice)
+
+
+def by_patient(registrations):
+    registrations_by_patient = defaultdict(list)
+    for registration in registrations:
+        registrations_by_patient[registration["patient_id"]].append(registration)
+    return registrations_by_patient
+
+
+def reference_counts(patients, registrations, intervals):
+    registrations_by_patient = by_patient(registrations)
+
+    counts = {
+        source: {index: [0, 0] for index in range(len(intervals))}
+        for source in interval_counts.SOURCES
+    }
+    for patient in patients:
+        patient_registrations = registrations_by_patient[patient["patient_id"]]
+        for index, (start, end) in enumerate(intervals):
+            result = patient_interval(patient, patient_registrations, start, end)
+            if result is None:
+                continue
+            alive, died = result
+            for source in interval_counts.SOURCES:
+                if alive[source]:
+                    counts[source][index][0] += died[source]
+                    counts[source][index][1] += 1
+    return {
+        source: {index: tuple(value) for index, value in by_interval.items()}
+        for source, by_interval in counts.items()
+    }
+
+
+def reference_practice_counts(patients, registrations, intervals):
+    """(numerator, denominator) by (source, interval index, practice); denominator > 0."""
+    registrations_by_patient = by_patient(registrations)
+    counts = defaultdict(lambda: [0, 0])
+    for patient in patients:
+        patient_registrations = registrations_by_patient[patient["patient_id"]]
+        for index, (start, end) in enumerate(intervals):
+            result = practice_patient_interval(patient, patient_registrations, start, end)
+            if result is None:
+                continue
+            alive, died, practice = result
+            for source in interval_counts.SOURCES:
+                if alive[source]:
+                    counts[(source, index, practice)][0] += died[source]
+                    counts[(source, index, practice)][1] += 1
+    return {key: tuple(value) for key, value in counts.items()}
+
+
+def practice_counts(keys, counts, n_intervals):
+    """count_intervals_by_practice() output in the reference_practice_counts() form."""
+    result = {}
+    for key, row in zip(keys.tolist(), counts.tolist()):
+        practice = key // n_intervals + interval_counts.MISSING_PRACTICE
+        if practice == interval_counts.MISSING_PRACTICE:
+            practice = None
+        for source_index, source in enumerate(interval_counts.SOURCES):
+            numerator, denominator = row[2 * source_index : 2 * source_index + 2]
+            if denominator:
+                result[(source, key % n_intervals, practice)] = (numerator, denominator)
+    return result
+
+
+# ---------------------------------------------------------
+# Comparison
+# ---------------------------------------------------------
+
+def compare(expected, actual, intervals):
+    """Cells where the counts differ: (source, interval start, expected, actual)."""
+    return [
+        (source, intervals[index][0], expected[source][index], actual[source][index])
+        for source in interval_counts.SOURCES
+        for index in range(len(intervals))
+        if expected[source][index] != actual[source][index]
+    ]
+
+
+def compare_practice(expected, actual, intervals):
+    """Cells where the counts differ: (source, interval start, practice, expected, actual)."""
+    return [
+        (source, intervals[index][0], practice, expected.get(key), actual.get(key))
+        for key in sorted(set(expected) | set(actual), key=str)
+        for source, index, practice in [key]
+        if expected.get(key) != actual.get(key)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--population-size", type=int, default=5000)
+    parser.add_argument("--start-date", default="2009-01-01")
+    parser.add_argument("--periods", type=int, default=16)
+    parser.add_argument(
+        "--unit", choices=["years", "quarters", "months", "weeks"], default="years"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--memory-budget-kb",
+        type=int,
+        default=256,
+        help="budget for the practice counts (small, so facts are split and counts spilled)",
+    )
+    parser.add_argument("--partitions", type=int, default=4)
+    args = parser.parse_args()
+
+    intervals = interval_counts.make_grid(args.start_date, args.periods, args.unit)
+    patients, registrations = generate_facts(args.population_size, intervals, args.seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_dir = Path(tmp_dir) / "facts"
+        write_facts(patients, registrations, input_dir)
+        counts = interval_counts.count_intervals(interval_counts.read_facts(input_dir), intervals)
+        keys, by_practice = interval_counts.count_intervals_by_practice(
+            input_dir,
+            intervals,
+            args.memory_budget_kb * 1024,
+            Path(tmp_dir) / "spill",
+            args.partitions,
+        )
+
+    differences = compare(reference_counts(patients, registrations, intervals), counts, intervals)
+    cells = len(interval_counts.SOURCES) * len(intervals)
+    for source, start, expected, actual in differences:
+        print(f"{source} {start}: expected {expected}, got {actual} (numerator, denominator)")
+    print(f"{cells - len(differences)} of {cells} source x interval cells match")
+
+    expected = reference_practice_counts(patients, registrations, intervals)
+    practice_differences = compare_practice(
+        expected, practice_counts(keys, by_practice, len(intervals)), intervals
+    )
+    for source, start, practice, expected_counts, actual in practice_differences:
+        print(f"{source} {start} practice {practice}: expected {expected_counts}, got {actual}")
+    print(
+        f"{len(expected) - len(practice_differences)} of {len(expected)} "
+        "source x interval x practice cells match"
+    )
+    sys.exit(1 if differences or practice_differences else 0)
+
+
+if __name__ == "__main__":
+    main()
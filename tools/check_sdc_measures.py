@@ -0,0 +1,125 @@
+###################################################
+# Checks the disclosure control of
+# analysis/sdc_measures.py on hand-built counts,
+# without ehrQL or generated data.
+#
+#   - round_counts(): 0 kept, <= 7 suppressed,
+#     otherwise rounded to the nearest 5, halves
+#     to even as R's round() in rounding()
+#   - secondary_suppress(): one primary
+#     suppression in a block triggers exactly one
+#     secondary suppression (the smallest other
+#     non-zero cell); none otherwise
+#   - sdc_measures() on a small measures CSV
+#
+# Usage:
+#   python tools/check_sdc_measures.py
+###################################################
+
+import csv
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# analysis/ scripts are run as scripts, not installed
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "analysis"))
+
+import sdc_measures  # noqa: E402
+
+# value: rounded value (None = suppressed)
+ROUNDING = {
+    0: 0,
+    1: None,
+    7: None,
+    8: 10,
+    12: 10,
+    13: 15,
+    # Halves go to the even multiple, as R's round()
+    12.5: 10,
+    17.5: 20,
+    100: 100,
+}
+
+
+def check_rounding():
+    values = np.array(list(ROUNDING), dtype=float)
+    rounded = sdc_measures.round_counts(values)
+    failures = []
+    for value, expected, actual in zip(ROUNDING, ROUNDING.values(), rounded):
+        actual = None if np.isnan(actual) else actual
+        if actual != expected:
+            failures.append(f"round_counts({value}): expected {expected}, got {actual}")
+    return failures
+
+
+def check_secondary_suppression():
+    # block 0: one primary suppression (5) -> the smallest other non-zero (20)
+    # block 1: two primary suppressions -> nothing more
+    # block 2: one primary suppression, not eligible -> nothing more
+    # block 3: one primary suppression; the 0 cell is not a candidate -> 9
+    original = np.array([5, 20, 30, 100, 3, 4, 50, 6, 40, 2, 0, 9, 60], dtype=float)
+    block = np.array([0, 0, 0, 0, 1, 1, 1, 2, 2, 3, 3, 3, 3])
+    eligible = block != 2
+    expected_suppressed = [0, 1, 4, 5, 7, 9, 11]
+
+    rounded = sdc_measures.secondary_suppress(
+        sdc_measures.round_counts(original), original, block, eligible
+    )
+    suppressed = np.flatnonzero(np.isnan(rounded)).tolist()
+    if suppressed != expected_suppressed:
+        return [f"secondary_suppress: expected rows {expected_suppressed}, got {suppressed}"]
+    return []
+
+
+def check_sdc_file():
+    columns = [
+        "measure", "interval_start", "interval_end", "ratio", "numerator", "denominator", "sex"
+    ]
+    rows = [
+        ["GP_mortality_overall", "2020-01-01", "2020-12-31", 0.1, 23, 230, ""],
+        ["GP_mortality_sex", "2020-01-01", "2020-12-31", 0.05, 5, 100, "female"],
+        ["GP_mortality_sex", "2020-01-01", "2020-12-31", 0.138, 18, 130, "male"],
+    ]
+    # numerator: female suppressed (5), so male (18) is suppressed as well
+    expected = [
+        ["GP_mortality_overall", "2020-01-01", "2020-12-31", str(25 / 230), "25", "230", ""],
+        ["GP_mortality_sex", "2020-01-01", "2020-12-31", "", "", "100", "female"],
+        ["GP_mortality_sex", "2020-01-01", "2020-12-31", "", "", "130", "male"],
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = Path(tmp_dir) / "measures.csv"
+        output_path = Path(tmp_dir) / "sdc" / "measures.csv"
+        with open(input_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(rows)
+        sdc_measures.sdc_measures(input_path, output_path)
+        with open(output_path, newline="") as f:
+            actual = list(csv.reader(f))[1:]
+
+    if len(actual) != len(expected):
+        return [f"sdc_measures: expected {len(expected)} rows, got {len(actual)}"]
+    return [
+        f"sdc_measures row {number}: expected {expected_row}, got {actual_row}"
+        for number, (expected_row, actual_row) in enumerate(zip(expected, actual))
+        if expected_row != actual_row
+    ]
+
+
+CHECKS = [check_rounding, check_secondary_suppression, check_sdc_file]
+
+
+def main():
+    failures = []
+    for check in CHECKS:
+        failures += check()
+    for message in failures:
+        print(message)
+    print(f"{len(CHECKS)} checks, {len(failures)} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
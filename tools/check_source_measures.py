@@ -0,0 +1,62 @@
+###################################################
+# Checks that the source bitmask measures unpack to
+# the same counts as measures defined directly per
+# source, on dummy data.
+#
+# Runs analysis/dataset_def/measure_def.py with
+# `-- --check-sources`, which adds
+# check_{GP,ONS,global}_mortality_overall (each
+# source's own numerator and denominator), then
+# unpacks the output with
+# analysis/unpack_source_measures.py, which fails
+# if any check measure differs from the unpacked
+# {source}_mortality_overall counts.
+#
+# Disclosure control is disabled in the definition,
+# so the counts are compared exactly.
+#
+# Usage:
+#   python tools/check_source_measures.py
+#   python tools/check_source_measures.py --dummy-tables dummy_tables
+###################################################
+
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+
+from ehrql_runner import ehrql_command, run_command
+
+# analysis/ scripts are run as scripts, not installed
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "analysis"))
+
+import unpack_source_measures  # noqa: E402
+
+DEFINITION = Path("analysis/dataset_def/measure_def.py")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--definition", default=DEFINITION, type=Path)
+    parser.add_argument("--dummy-tables", default=None)
+    parser.add_argument("--log", default="logs/check_source_measures.log", type=Path)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        measures_path = Path(tmp_dir) / "measures_source_bits.csv"
+        command = ehrql_command("generate-measures", args.definition, "--output", measures_path)
+        if args.dummy_tables is not None:
+            command += ["--dummy-tables", args.dummy_tables]
+        command += ["--", "--check-sources"]
+        args.log.parent.mkdir(parents=True, exist_ok=True)
+        if run_command(command, log_path=args.log)["returncode"] != 0:
+            sys.exit(f"generate-measures failed, see {args.log}")
+
+        try:
+            unpack_source_measures.unpack_file(measures_path, Path(tmp_dir) / "measures.csv")
+        except ValueError as error:
+            sys.exit(str(error))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+###################################################
+# Checks analysis/unpack_source_measures.py on a
+# hand-built source bitmask CSV, without ehrQL or
+# generated data.
+#
+#   - a per-subgroup bitmask measure unpacks to the
+#     GP, ONS and global counts worked out by hand
+#     (groups with no one in a source's denominator
+#     are not output)
+#   - the rollup cube unpacks to overall and
+#     subgroup measures whose cells add up
+#   - check measures that match are dropped; a
+#     mismatch is an error
+#
+# tools/check_source_measures.py checks the same
+# unpacking against ehrQL on dummy data.
+#
+# Usage:
+#   python tools/check_unpack_source_measures.py
+###################################################
+
+import csv
+import sys
+import tempfile
+from pathlib import Path
+
+# analysis/ scripts are run as scripts, not installed
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "analysis"))
+
+import unpack_source_measures  # noqa: E402
+from dataset_def.rollup import ROLLUP_MEASURE, ROLLUP_SUBGROUPS  # noqa: E402
+
+FIXED_COLUMNS = ["measure", "interval_start", "interval_end", "ratio", "numerator", "denominator"]
+GROUP_COLUMNS = ["source_bits", *ROLLUP_SUBGROUPS]
+
+INTERVAL = ("2020-01-01", "2020-12-31")
+
+
+def bitmask_row(measure, bits, count, **groups):
+    # numerator = denominator = patients in the group
+    return {
+        "measure": measure,
+        "interval_start": INTERVAL[0],
+        "interval_end": INTERVAL[1],
+        "ratio": 1,
+        "numerator": count,
+        "denominator": count,
+        "source_bits": bits,
+        **{column: groups.get(column, "") for column in ROLLUP_SUBGROUPS},
+    }
+
+
+def unpack_rows(rows):
+    """Unpacked rows as (measure, group values) -> (numerator, denominator)."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = Path(tmp_dir) / "measures_source_bits.csv"
+        output_path = Path(tmp_dir) / "measures.csv"
+        with open(input_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIXED_COLUMNS + GROUP_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        unpack_source_measures.unpack_file(input_path, output_path)
+        with open(output_path, newline="") as f:
+            return {
+                (
+                    row["measure"],
+                    tuple((column, row[column]) for column in ROLLUP_SUBGROUPS if row[column]),
+                ): (int(row["numerator"]), int(row["denominator"]))
+                for row in csv.DictReader(f)
+            }
+
+
+def compare(name, expected, actual):
+    return [
+        f"{name} {key}: expected {expected.get(key)}, got {actual.get(key)}"
+        for key in sorted(set(expected) | set(actual))
+        if expected.get(key) != actual.get(key)
+    ]
+
+
+def check_subgroup_measure():
+    # bits: 1 alive (TPP), 2 alive (ONS), 4 TPP death, 8 ONS death
+    rows = [
+        bitmask_row("source_bits_mortality_sex", 1, 10, sex="male"),
+        bitmask_row("source_bits_mortality_sex", 3, 20, sex="male"),
+        bitmask_row("source_bits_mortality_sex", 7, 5, sex="male"),
+        bitmask_row("source_bits_mortality_sex", 15, 2, sex="male"),
+        bitmask_row("source_bits_mortality_sex", 10, 4, sex="female"),
+    ]
+    male, female = (("sex", "male"),), (("sex", "female"),)
+    expected = {
+        ("GP_mortality_sex", male): (7, 37),
+        ("ONS_mortality_sex", male): (2, 27),
+        ("ONS_mortality_sex", female): (4, 4),
+        ("global_mortality_sex", male): (7, 37),
+        ("global_mortality_sex", female): (4, 4),
+    }
+    return compare("subgroup", expected, unpack_rows(rows))
+
+
+def check_rollup():
+    rows = [
+        bitmask_row(ROLLUP_MEASURE, 7, 3, age_band="0-44", sex="male"),
+        bitmask_row(ROLLUP_MEASURE, 3, 5, age_band="45-64", sex="male"),
+        bitmask_row(ROLLUP_MEASURE, 10, 4, age_band="45-64", sex="female", region="London"),
+    ]
+    actual = unpack_rows(rows)
+    expected = {
+        ("GP_mortality_overall", ()): (3, 8),
+        ("ONS_mortality_overall", ()): (4, 12),
+        ("global_mortality_overall", ()): (7, 12),
+        ("GP_mortality_age_band", (("age_band", "0-44"),)): (3, 3),
+        ("GP_mortality_age_band", (("age_band", "45-64"),)): (0, 5),
+        ("ONS_mortality_sex", (("sex", "female"),)): (4, 4),
+        ("global_mortality_region", ()): (3, 8),
+        ("global_mortality_region", (("region", "London"),)): (4, 4),
+    }
+    failures = compare("rollup", expected, {key: actual.get(key) for key in expected})
+
+    # Every subgroup measure adds up to the overall measure
+    for source in unpack_source_measures.SOURCES:
+        overall = actual[(f"{source}_mortality_overall", ())]
+        for subgroup in ROLLUP_SUBGROUPS:
+            cells = [
+                counts
+                for (measure, _), counts in actual.items()
+                if measure == f"{source}_mortality_{subgroup}"
+            ]
+            total = tuple(map(sum, zip(*cells)))
+            if total != overall:
+                failures.append(
+                    f"rollup {source}_mortality_{subgroup}: cells add up to {total}, "
+                    f"overall is {overall}"
+                )
+    return failures
+
+
+def check_measures():
+    rows = [
+        bitmask_row("source_bits_mortality_overall", 7, 3),
+        bitmask_row("source_bits_mortality_overall", 2, 5),
+    ]
+    failures = []
+
+    matching = rows + [bitmask_row("check_GP_mortality_overall", "", 3) | {"denominator": 3}]
+    actual = unpack_rows(matching)
+    if any(measure.startswith("check_") for measure, _ in actual):
+        failures.append("check: matching check measure was output")
+
+    mismatched = rows + [bitmask_row("check_ONS_mortality_overall", "", 1)]
+    try:
+        unpack_rows(mismatched)
+        failures.append("check: mismatched check measure did not raise")
+    except ValueError:
+        pass
+    return failures
+
+
+CHECKS = [check_subgroup_measure, check_rollup, check_measures]
+
+
+def main():
+    failures = []
+    for check in CHECKS:
+        failures += check()
+    for message in failures:
+        print(message)
+    print(f"{len(CHECKS)} checks, {len(failures)} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+###################################################
+# Persistent cache of ehrQL-generated dummy tables.
+#
+# ehrQL regenerates dummy data on every local run
+# (up to the dummy data timeout). Here, dummy tables
+# are generated once with `ehrql create-dummy-tables`
+# and stored in .dummy_cache/, keyed by a hash of:
+#   - the definition and the local modules it
+#     imports, and the codelists they reference
+#     (this covers population_size and the dummy
+#     data constraints)
+#   - the definition parameters (after `--`)
+#   - the ehrQL command
+# Later runs of an unchanged definition pass the
+# cached tables with --dummy-tables.
+#
+# The cache is capped in size; least recently used
+# entries are evicted first.
+#
+# Dataset definitions only: create-dummy-tables
+# takes a dataset definition, so measure
+# definitions keep ehrQL's own dummy data.
+#
+# Usage:
+#   python tools/dummy_cache.py run \
+#     analysis/dataset_def/dataset_definition.py --output output/dataset.arrow
+#   python tools/dummy_cache.py path analysis/dataset_def/dataset_definition.py -- --since 2026-04-01
+#   python tools/dummy_cache.py clear
+###################################################
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from ehrql_runner import EHRQL_COMMAND, ehrql_command, run_command
+from run_local import CODELIST, file_sha256, local_files
+
+CACHE_DIR = Path(".dummy_cache")
+METADATA = "cache_entry.json"
+
+# Total size of cached tables before least recently used entries are evicted
+MAX_SIZE_MB = int(os.environ.get("DUMMY_CACHE_MAX_SIZE_MB", 2048))
+
+
+# ---------------------------------------------------------
+# Keys
+# ---------------------------------------------------------
+
+def definition_files(definition):
+    """The definition, its local imports and the codelists they reference."""
+    files = local_files(definition)
+    codelists = {
+        Path(codelist) for file in files for codelist in CODELIST.findall(file.read_text())
+    }
+    return sorted(set(files) | codelists)
+
+
+def cache_key(definition, params=()):
+    digest = hashlib.sha256(" ".join(EHRQL_COMMAND).encode())
+    for path in definition_files(definition):
+        digest.update(f"\0{path}\0{file_sha256(path) if path.exists() else ''}".encode())
+    digest.update(f"\0params\0{json.dumps(list(params))}".encode())
+    return digest.hexdigest()[:16]
+
+
+# ---------------------------------------------------------
+# Entries
+# ---------------------------------------------------------
+
+def directory_size(path):
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+
+def read_entry(entry_dir):
+    path = entry_dir / METADATA
+    return json.loads(path.read_text()) if path.exists() else None
+
+
+def write_entry(entry_dir, entry):
+    (entry_dir / METADATA).write_text(json.dumps(entry, indent=2))
+
+
+def entries(cache_dir=CACHE_DIR):
+    """Complete cache entries (directory, metadata)."""
+    if not cache_dir.exists():
+        return []
+    found = []
+    for entry_dir in cache_dir.iterdir():
+        entry = read_entry(entry_dir) if entry_dir.is_dir() else None
+        if entry is not None:
+            found.append((entry_dir, entry))
+    return found
+
+
+def evict(cache_dir=CACHE_DIR, max_size_mb=MAX_SIZE_MB, keep=None):
+    """Remove least recently used entries until the cache fits in max_size_mb."""
+    cached = sorted(entries(cache_dir), key=lambda item: item[1]["last_used"])
+    total = sum(entry["size_bytes"] for _, entry in cached)
+    for entry_dir, entry in cached:
+        if total <= max_size_mb * 1024 * 1024:
+            break
+        if entry_dir == keep:
+            continue
+        shutil.rmtree(entry_dir)
+        total -= entry["size_bytes"]
+        print(f"Evicted dummy tables for {entry['definition']} ({entry_dir.name})")
+
+
+def dummy_tables(definition, params=(), cache_dir=CACHE_DIR, max_size_mb=MAX_SIZE_MB):
+    """Directory of cached dummy tables for a definition, generating them if needed."""
+    key = cache_key(definition, params)
+    entry_dir = cache_dir / key
+    entry = read_entry(entry_dir)
+
+    if entry is None:
+        # Generate into a temporary directory so an interrupted run leaves no entry
+        tmp_dir = cache_dir / f"{key}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        command = ehrql_command("create-dummy-tables", definition, tmp_dir / "tables")
+        if params:
+            command += ["--", *params]
+        stats = run_command(command, log_path=tmp_dir / "create-dummy-tables.log")
+        if stats["returncode"] != 0:
+            raise RuntimeError(
+                f"create-dummy-tables failed, see {tmp_dir / 'create-dummy-tables.log'}"
+            )
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        tmp_dir.rename(entry_dir)
+        entry = {
+            "definition": str(definition),
+            "params": list(params),
+            "created": time.time(),
+            "generation_time_s": stats["wall_time_s"],
+            "size_bytes": directory_size(entry_dir),
+        }
+
+    entry["last_used"] = time.time()
+    write_entry(entry_dir, entry)
+    evict(cache_dir, max_size_mb, keep=entry_dir)
+    return entry_dir / "tables"
+
+
+# ---------------------------------------------------------
+# Command line
+# ---------------------------------------------------------
+
+def split_params(argv):
+    """Split arguments at `--` into (own arguments, definition parameters)."""
+    if "--" in argv:
+        index = argv.index("--")
+        return argv[:index], argv[index + 1 :]
+    return argv, []
+
+
+def main():
+    argv, params = split_params(sys.argv[1:])
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-size-mb", type=int, default=MAX_SIZE_MB)
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    run_parser = subparsers.add_parser(
+        "run", help="run generate-dataset with cached dummy tables"
+    )
+    run_parser.add_argument("definition", type=Path, help="dataset definition")
+    run_parser.add_argument("--output", required=True)
+
+    path_parser = subparsers.add_parser("path", help="print the cached dummy tables directory")
+    path_parser.add_argument("definition", type=Path)
+
+    subparsers.add_parser("clear", help="remove all cached dummy tables")
+    args = parser.parse_args(argv)
+
+    if args.action == "clear":
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+        return
+
+    tables_dir = dummy_tables(args.definition, params, max_size_mb=args.max_size_mb)
+    if args.action == "path":
+        print(tables_dir)
+        return
+
+    command = ehrql_command(
+        "generate-dataset",
+        args.definition,
+        "--dummy-tables",
+        tables_dir,
+        "--output",
+        args.output,
+    )
+    if params:
+        command += ["--", *params]
+    sys.exit(subprocess.run(command).returncode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+###################################################
+# Helpers to run ehrQL (or any action command)
+# locally and record wall time and peak memory.
+#
+# Used by the local tooling in tools/.
+###################################################
+
+import gzip
+import os
+import shlex
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# Command used to call ehrQL; override with EHRQL_COMMAND,
+# e.g. "opensafely exec ehrql:v1"
+EHRQL_COMMAND = shlex.split(os.environ.get("EHRQL_COMMAND", f"{sys.executable} -m ehrql"))
+
+# Launchers whose process is only a client: the work runs in a container that
+# is not a child of this process, so its memory cannot be measured here
+CONTAINER_LAUNCHERS = {"opensafely", "docker", "podman"}
+
+
+def ehrql_command(*args):
+    return [*EHRQL_COMMAND, *[str(arg) for arg in args]]
+
+
+def measures_rss(command):
+    return Path(str(command[0])).name not in CONTAINER_LAUNCHERS
+
+
+def run_command(command, log_path=None):
+    """Run a command; return its exit code, wall time (s) and peak RSS (MB).
+
+    Peak RSS is the largest resident set of the direct child, not of processes
+    it starts, and has a floor of this process's size when it forked. It is None when the command is a container launcher (see
+    CONTAINER_LAUNCHERS, e.g. EHRQL_COMMAND="opensafely exec ehrql:v1"), where
+    the child is the docker client rather than ehrQL. Wall time is always
+    measured, but includes container start-up.
+    """
+    log = open(log_path, "w") if log_path else subprocess.DEVNULL
+    try:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 gives the resource usage of this child only
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+    finally:
+        if log_path:
+            log.close()
+    # Reaped by wait4, so record the exit code on the Popen object ourselves
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        "returncode": process.returncode,
+        "wall_time_s": round(wall_time, 3),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(rusage.ru_maxrss / 1024, 1) if measures_rss(command) else None,
+    }
+
+
+def count_rows(path):
+    """Number of data rows in an ehrQL output (.arrow, .csv or .csv.gz)."""
+    path = Path(path)
+    if not path.exists():
+        return None
+    if path.suffix == ".arrow":
+        import pyarrow.feather as feather
+
+        return feather.read_table(path, columns=[]).num_rows
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt") as f:
+        return max(sum(1 for _ in f) - 1, 0)
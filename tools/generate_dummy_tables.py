@@ -0,0 +1,362 @@
+###################################################
+# This script builds TPP-shaped dummy tables
+# (patients, ons_deaths, clinical_events,
+# practice_registrations, addresses) for local runs
+# with `--dummy-tables`.
+#
+# Unlike ehrQL's dummy data generator, patients are
+# constructed directly to satisfy the population of
+# dataset_definition.py (a death in at least one
+# source, plausible age at death, male/female sex)
+# and the date windows of its dummy data constraint,
+# so no rows are rejected. Generation is vectorised
+# and scales to 10M patients in seconds.
+#
+# Usage:
+#   python tools/generate_dummy_tables.py --population-size 100000
+#   opensafely exec ehrql:v1 generate-dataset analysis/dataset_def/dataset_definition.py \
+#     --dummy-tables dummy_tables --output output/dataset.arrow
+###################################################
+
+import argparse
+import csv
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.feather as feather
+
+# Date windows (as in the dummy data constraint of dataset_definition.py)
+DEATH_WINDOW = ("2008-01-01", "2026-05-01")
+ONS_WINDOW_START = "2015-01-01"
+REGISTRATION_WINDOW = ("2008-01-01", "2026-05-01")
+
+# Death source pattern, for deaths within the ONS window:
+# both ONS and TPP dated, ONS only, TPP dated only, TPP coded only
+SOURCE_PATTERN_PROBS = [0.80, 0.12, 0.06, 0.02]
+# Probability a TPP dated death also has a death code
+CODED_GIVEN_DATED = 0.4
+# TPP - ONS date difference (days): 0, +/-1 to 7, +/-8 to 30, +/-31+
+DATE_DIFF_PROBS = [0.85, 0.10, 0.03, 0.02]
+
+N_PRACTICES = 6500
+HAS_ETHNICITY = 0.8
+
+REGIONS = [
+    "North East",
+    "North West",
+    "Yorkshire and The Humber",
+    "East Midlands",
+    "West Midlands",
+    "East",
+    "London",
+    "South East",
+    "South West",
+]
+
+STP_CODES = [f"E54{i:06d}" for i in range(42)]
+MSOA_CODES = [f"E02{i:06d}" for i in range(7201)]
+
+DEATH_PLACES = [
+    "Care home",
+    "Elsewhere",
+    "Home",
+    "Hospice",
+    "Hospital",
+    "Other communal establishment",
+]
+DEATH_PLACE_PROBS = [0.22, 0.03, 0.28, 0.05, 0.41, 0.01]
+
+CODELISTS = {
+    "death": "codelists/nhsd-primary-care-domain-refsets-death_cod.csv",
+    "ethnicity": "codelists/opensafely-ethnicity-snomed-0removed.csv",
+}
+
+N_CAUSES_OF_DEATH = 15
+
+
+def to_days(date):
+    return np.datetime64(date, "D").astype(np.int64)
+
+
+def read_codes(path):
+    with open(path, newline="") as f:
+        return [row["code"] for row in csv.DictReader(f)]
+
+
+def date_column(days, null=None):
+    values = days.astype("datetime64[D]")
+    return pa.array(values, type=pa.date32(), mask=null)
+
+
+def category_column(categories, indices):
+    # Building string columns from indices avoids slow numpy unicode arrays
+    return pc.take(pa.array(categories, type=pa.string()), pa.array(indices))
+
+
+# First day of the month for every day in range, as a lookup table
+# (much faster than converting through datetime64[M])
+_CALENDAR_START = to_days("1800-01-01")
+_MONTH_STARTS = (
+    np.arange(_CALENDAR_START, to_days("2100-01-01"))
+    .astype("datetime64[D]")
+    .astype("datetime64[M]")
+    .astype("datetime64[D]")
+    .astype(np.int64)
+)
+
+
+def first_of_month(days):
+    return _MONTH_STARTS[days - _CALENDAR_START]
+
+
+# ---------------------------------------------------------
+# Patients and deaths
+# ---------------------------------------------------------
+
+def generate_patients(rng, n, deceased_fraction):
+    patient_id = np.arange(1, n + 1)
+    is_deceased = rng.random(n) < deceased_fraction
+
+    # Reference death date, uniform over the death window
+    death_start, death_end = (to_days(d) for d in DEATH_WINDOW)
+    death = rng.integers(death_start, death_end + 1, n)
+
+    # Age at death: mostly older adults, some infants; always 0-109
+    # (the day within the year can add one year to the age)
+    age = np.clip(rng.normal(80, 12, n), 1, 108).astype(np.int64)
+    age[rng.random(n) < 0.005] = 0
+    dob = first_of_month(death - age * 365 - rng.integers(0, 365, n))
+    dob = np.minimum(dob, first_of_month(death))
+
+    # Patients still alive: born 1915-2025, no death recorded
+    today = to_days(DEATH_WINDOW[1])
+    alive_dob = first_of_month(rng.integers(to_days("1915-01-01"), today, n))
+    dob = np.where(is_deceased, dob, alive_dob)
+
+    # Death source pattern; ONS deaths are only available from the ONS window
+    pattern = rng.choice(4, size=n, p=SOURCE_PATTERN_PROBS)
+    before_ons = death < to_days(ONS_WINDOW_START)
+    pattern = np.where(before_ons & (pattern < 2), 2, pattern)
+
+    has_ons = is_deceased & (pattern <= 1)
+    has_tpp_date = is_deceased & ((pattern == 0) | (pattern == 2))
+    has_coded = is_deceased & (
+        (pattern == 3) | (has_tpp_date & (rng.random(n) < CODED_GIVEN_DATED))
+    )
+
+    # TPP dated and coded deaths are offset from the ONS date
+    diff_group = rng.choice(4, size=n, p=DATE_DIFF_PROBS)
+    magnitude = np.select(
+        [diff_group == 1, diff_group == 2, diff_group == 3],
+        [rng.integers(1, 8, n), rng.integers(8, 31, n), rng.integers(31, 366, n)],
+        0,
+    )
+    sign = np.where(rng.random(n) < 0.7, 1, -1)
+    tpp_death = np.clip(death + sign * magnitude, death_start, death_end)
+    tpp_death = np.maximum(tpp_death, dob)
+    coded_death = np.clip(tpp_death + rng.integers(0, 15, n), death_start, death_end)
+
+    sex = category_column(["male", "female"], rng.integers(0, 2, n))
+
+    patients = pa.table(
+        {
+            "patient_id": patient_id,
+            "date_of_birth": date_column(dob),
+            "sex": sex,
+            "date_of_death": date_column(tpp_death, null=~has_tpp_date),
+        }
+    )
+
+    ons_columns = {
+        "patient_id": patient_id[has_ons],
+        "date": date_column(death[has_ons]),
+        "place": category_column(
+            DEATH_PLACES,
+            rng.choice(len(DEATH_PLACES), size=has_ons.sum(), p=DEATH_PLACE_PROBS),
+        ),
+        "underlying_cause_of_death": pa.nulls(has_ons.sum(), pa.string()),
+    }
+    for i in range(1, N_CAUSES_OF_DEATH + 1):
+        ons_columns[f"cause_of_death_{i:02d}"] = pa.nulls(has_ons.sum(), pa.string())
+    ons_deaths = pa.table(ons_columns)
+
+    facts = {
+        "patient_id": patient_id,
+        "dob": dob,
+        "is_deceased": is_deceased,
+        "death": np.where(has_ons | has_tpp_date, np.where(has_ons, death, tpp_death), coded_death),
+        "has_coded": has_coded,
+        "coded_death": coded_death,
+    }
+    return patients, ons_deaths, facts
+
+
+# ---------------------------------------------------------
+# Registrations and addresses
+# ---------------------------------------------------------
+
+def generate_registrations(rng, facts):
+    n = len(facts["patient_id"])
+    dob, death, is_deceased = facts["dob"], facts["death"], facts["is_deceased"]
+    window_start, window_end = (to_days(d) for d in REGISTRATION_WINDOW)
+
+    # Last registration starts within the registration window, after birth
+    # and (for the deceased) on or before death
+    latest = np.where(is_deceased, np.minimum(death, window_end), window_end)
+    earliest = np.minimum(np.maximum(dob, window_start), latest)
+    last_start = earliest + (rng.random(n) * (latest - earliest + 1)).astype(np.int64)
+
+    # Last registration end, relative to death
+    outcome = rng.choice(4, size=n, p=[0.70, 0.15, 0.10, 0.05])
+    end_after_death = death + np.round(rng.lognormal(2, 1, n)).astype(np.int64)
+    end_before_death = death - rng.integers(31, 366, n)
+    end_within_grace = death - rng.integers(1, 31, n)
+    last_end = np.select(
+        [outcome == 0, outcome == 2, outcome == 3],
+        [end_after_death, end_before_death, end_within_grace],
+        0,
+    )
+    last_end = np.maximum(last_end, last_start)
+    last_end_null = np.where(is_deceased, outcome == 1, rng.random(n) < 0.85)
+    last_end = np.where(
+        is_deceased | last_end_null, last_end, last_start + rng.integers(30, 3650, n)
+    )
+
+    practice = rng.integers(1, N_PRACTICES + 1, n)
+
+    # Some patients have an earlier registration ending the day before
+    has_previous = rng.random(n) < 0.3
+    previous_start = np.maximum(dob, last_start - rng.integers(365, 7300, n))
+    has_previous &= previous_start < last_start
+    previous_practice = rng.integers(1, N_PRACTICES + 1, n)
+
+    patient_id = np.concatenate([facts["patient_id"], facts["patient_id"][has_previous]])
+    start = np.concatenate([last_start, previous_start[has_previous]])
+    end = np.concatenate([last_end, last_start[has_previous] - 1])
+    end_null = np.concatenate([last_end_null, np.zeros(has_previous.sum(), dtype=bool)])
+    practice = np.concatenate([practice, previous_practice[has_previous]])
+
+    return pa.table(
+        {
+            "patient_id": patient_id,
+            "start_date": date_column(start),
+            "end_date": date_column(end, null=end_null),
+            "practice_pseudo_id": practice,
+            "practice_stp": category_column(STP_CODES, practice % len(STP_CODES)),
+            "practice_nuts1_region_name": category_column(REGIONS, practice % len(REGIONS)),
+        }
+    )
+
+
+def generate_addresses(rng, facts):
+    n = len(facts["patient_id"])
+    return pa.table(
+        {
+            "patient_id": facts["patient_id"],
+            "address_id": facts["patient_id"],
+            "start_date": date_column(facts["dob"]),
+            "end_date": pa.nulls(n, pa.date32()),
+            "address_type": np.ones(n, dtype=np.int64),
+            "rural_urban_classification": rng.integers(1, 9, n),
+            "imd_rounded": rng.integers(0, 329, n) * 100,
+            "msoa_code": category_column(MSOA_CODES, rng.integers(0, len(MSOA_CODES), n)),
+            "has_postcode": np.ones(n, dtype=bool),
+            "care_home_is_potential_match": np.zeros(n, dtype=bool),
+            "care_home_requires_nursing": np.zeros(n, dtype=bool),
+            "care_home_does_not_require_nursing": np.zeros(n, dtype=bool),
+        }
+    )
+
+
+# ---------------------------------------------------------
+# Clinical events (death and ethnicity codes)
+# ---------------------------------------------------------
+
+def generate_clinical_events(rng, facts, codes):
+    n = len(facts["patient_id"])
+    has_coded = facts["has_coded"]
+    has_ethnicity = rng.random(n) < HAS_ETHNICITY
+
+    # Ethnicity recorded between birth and death (or the end of the window)
+    last_day = np.where(facts["is_deceased"], facts["death"], to_days(DEATH_WINDOW[1]))
+    ethnicity_date = facts["dob"] + (rng.random(n) * (last_day - facts["dob"] + 1)).astype(np.int64)
+
+    patient_id = np.concatenate(
+        [facts["patient_id"][has_coded], facts["patient_id"][has_ethnicity]]
+    )
+    date = np.concatenate([facts["coded_death"][has_coded], ethnicity_date[has_ethnicity]])
+    # Indices into the death codes followed by the ethnicity codes
+    code = np.concatenate(
+        [
+            rng.integers(0, len(codes["death"]), has_coded.sum()),
+            len(codes["death"]) + rng.integers(0, len(codes["ethnicity"]), has_ethnicity.sum()),
+        ]
+    )
+    order = np.argsort(patient_id, kind="stable")
+    return pa.table(
+        {
+            "patient_id": patient_id[order],
+            "date": date_column(date[order]),
+            "snomedct_code": category_column(codes["death"] + codes["ethnicity"], code[order]),
+            "numeric_value": pa.nulls(len(order), pa.float64()),
+            "consultation_id": pa.nulls(len(order), pa.int64()),
+        }
+    )
+
+
+# ---------------------------------------------------------
+# Generate and write
+# ---------------------------------------------------------
+
+def generate_tables(population_size, deceased_fraction=1.0, seed=0):
+    rng = np.random.default_rng(seed)
+    codes = {name: read_codes(path) for name, path in CODELISTS.items()}
+    patients, ons_deaths, facts = generate_patients(rng, population_size, deceased_fraction)
+    return {
+        "patients": patients,
+        "ons_deaths": ons_deaths,
+        "clinical_events": generate_clinical_events(rng, facts, codes),
+        "practice_registrations": generate_registrations(rng, facts),
+        "addresses": generate_addresses(rng, facts),
+    }
+
+
+def write_tables(tables, output_dir, file_format="arrow"):
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for name, table in tables.items():
+        path = output_dir / f"{name}.{file_format}"
+        if file_format == "arrow":
+            feather.write_feather(table, path, compression="uncompressed")
+        elif file_format == "csv":
+            pa_csv.write_csv(table, path)
+        elif file_format == "csv.gz":
+            with pa.CompressedOutputStream(str(path), "gzip") as f:
+                pa_csv.write_csv(table, f)
+        else:
+            raise ValueError(f"Unknown file format: {file_format}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--population-size", type=int, default=10000)
+    parser.add_argument(
+        "--deceased-fraction",
+        type=float,
+        default=1.0,
+        help="share of patients with a death (lower it for the measure definitions)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output-dir", default="dummy_tables")
+    parser.add_argument("--format", choices=["arrow", "csv", "csv.gz"], default="arrow")
+    args = parser.parse_args()
+
+    tables = generate_tables(args.population_size, args.deceased_fraction, args.seed)
+    write_tables(tables, args.output_dir, args.format)
+
+
+if __name__ == "__main__":
+    main()
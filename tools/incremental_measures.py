@@ -0,0 +1,265 @@
+###################################################
+# Incremental ehrQL measures: recompute only open
+# or invalidated intervals and merge them with
+# cached closed intervals.
+#
+# Rows are cached per measure x interval in
+# .measures_cache/<definition>/, each with:
+#   - the fingerprint of the definition, the local
+#     modules it imports and the codelists they
+#     reference, the ehrQL command and the data
+#     source: the content of --dummy-tables, or the
+#     --dsn (and the file of a sqlite:/// DSN)
+#   - the date it was computed
+# A cached interval is reused when its fingerprint
+# matches and it was computed more than
+# --lookback-days after the interval ended (late
+# death registrations and back-dated registration
+# changes have settled). Otherwise the definition
+# is re-run with `-- --intervals-from <date>`, from
+# the earliest interval to recompute, and the new
+# rows replace the cached ones. Any change to the
+# definition recomputes every interval.
+#
+# The merged output has every measure x interval
+# block, in the measures output format.
+#
+# Usage:
+#   python tools/incremental_measures.py analysis/dataset_def/measure_def.py \
+#     --output output/highly_sensitive/measures/measures_source_bits.csv
+#   python tools/incremental_measures.py analysis/dataset_def/measure_practice.py \
+#     --output output/highly_sensitive/measures/measures_practice_source_bits.csv \
+#     --dummy-tables dummy_tables
+#   python tools/incremental_measures.py analysis/dataset_def/measure_def.py \
+#     --output output/measures_source_bits.csv \
+#     --dsn sqlite:///benchmarks/sqlite/100000.db --query-engine sqlite
+###################################################
+
+import argparse
+import csv
+import datetime
+import hashlib
+import json
+import shutil
+import tempfile
+from pathlib import Path
+
+from dummy_cache import definition_files
+from ehrql_runner import EHRQL_COMMAND, ehrql_command, run_command
+from run_local import file_sha256
+
+CACHE_DIR = Path(".measures_cache")
+ROWS = "rows.csv"
+INDEX = "index.json"
+
+# Days after an interval ends before its counts are treated as final
+LOOKBACK_DAYS = 90
+
+SQLITE_PREFIX = "sqlite:///"
+
+
+def data_source_fingerprint(dummy_tables=None, dsn=None):
+    """Content of the dummy tables directory, or the DSN (and its SQLite file)."""
+    digest = hashlib.sha256()
+    if dummy_tables is not None:
+        dummy_tables = Path(dummy_tables)
+        for path in sorted(dummy_tables.rglob("*")):
+            if path.is_file():
+                digest.update(f"\0{path.relative_to(dummy_tables)}\0{file_sha256(path)}".encode())
+    if dsn is not None:
+        digest.update(f"\0dsn\0{dsn}".encode())
+        database = Path(dsn[len(SQLITE_PREFIX) :])
+        if dsn.startswith(SQLITE_PREFIX) and database.is_file():
+            digest.update(f"\0{file_sha256(database)}".encode())
+    return digest.hexdigest()
+
+
+def definition_fingerprint(definition, data_source=""):
+    digest = hashlib.sha256(" ".join(EHRQL_COMMAND).encode())
+    digest.update(f"\0data\0{data_source}".encode())
+    for path in definition_files(definition):
+        digest.update(f"\0{path}\0{file_sha256(path) if path.exists() else ''}".encode())
+    return digest.hexdigest()
+
+
+# ---------------------------------------------------------
+# Cache
+# ---------------------------------------------------------
+
+def read_rows(path):
+    """Header and rows of a measures CSV, grouped by (measure, interval_start)."""
+    blocks = {}
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            blocks.setdefault((row["measure"], row["interval_start"]), []).append(row)
+    return reader.fieldnames, blocks
+
+
+def write_rows(path, fieldnames, blocks):
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for rows in blocks.values():
+            writer.writerows(rows)
+    tmp_path.replace(path)
+
+
+def load_cache(cache_dir):
+    """Header, rows by (measure, interval_start) and index entries, or empty."""
+    if not (cache_dir / INDEX).exists():
+        return None, {}, {}
+    fieldnames, blocks = read_rows(cache_dir / ROWS)
+    index = {
+        (entry["measure"], entry["interval_start"]): entry
+        for entry in json.loads((cache_dir / INDEX).read_text())
+    }
+    return fieldnames, blocks, index
+
+
+def save_cache(cache_dir, fieldnames, blocks, index):
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    write_rows(cache_dir / ROWS, fieldnames, blocks)
+    (cache_dir / INDEX).write_text(json.dumps(list(index.values()), indent=2))
+
+
+def is_final(entry, fingerprint, lookback_days):
+    settled = datetime.date.fromisoformat(entry["interval_end"]) + datetime.timedelta(
+        days=lookback_days
+    )
+    return (
+        entry["fingerprint"] == fingerprint
+        and datetime.date.fromisoformat(entry["computed"]) > settled
+    )
+
+
+def is_current(index, fingerprint):
+    return bool(index) and all(entry["fingerprint"] == fingerprint for entry in index.values())
+
+
+def stale_from(index, fingerprint, lookback_days):
+    """Start of the earliest cached interval that is not final (None if all are)."""
+    stale = [
+        entry["interval_start"]
+        for entry in index.values()
+        if not is_final(entry, fingerprint, lookback_days)
+    ]
+    return min(stale, default=None)
+
+
+# ---------------------------------------------------------
+# Merge
+# ---------------------------------------------------------
+
+def merge(cached_blocks, new_blocks, from_date=None):
+    """Cached blocks before from_date (all if None) and new blocks, by measure and interval."""
+    blocks = {
+        key: rows
+        for key, rows in cached_blocks.items()
+        if from_date is None or key[1] < from_date
+    }
+    blocks.update(new_blocks)
+    measure_order = {}
+    for measure, _ in [*cached_blocks, *new_blocks]:
+        measure_order.setdefault(measure, len(measure_order))
+    return dict(sorted(blocks.items(), key=lambda item: (measure_order[item[0][0]], item[0][1])))
+
+
+def update_index(index, new_blocks, fingerprint, computed):
+    for (measure, interval_start), rows in new_blocks.items():
+        index[(measure, interval_start)] = {
+            "measure": measure,
+            "interval_start": interval_start,
+            "interval_end": rows[0]["interval_end"],
+            "fingerprint": fingerprint,
+            "computed": computed,
+        }
+    return index
+
+
+def run_measures(
+    definition, output_path, from_date, log_path, dummy_tables=None, dsn=None, query_engine=None
+):
+    command = ehrql_command("generate-measures", definition, "--output", output_path)
+    if dummy_tables is not None:
+        command += ["--dummy-tables", dummy_tables]
+    if dsn is not None:
+        command += ["--dsn", dsn]
+    if query_engine is not None:
+        command += ["--query-engine", query_engine]
+    if from_date is not None:
+        command += ["--", "--intervals-from", from_date]
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    stats = run_command(command, log_path=log_path)
+    if stats["returncode"] != 0:
+        raise RuntimeError(f"generate-measures failed, see {log_path}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("definition", type=Path)
+    parser.add_argument("--output", required=True, type=Path)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--dummy-tables", default=None)
+    source.add_argument("--dsn", default=None, help="e.g. a tools/local_backend.py database")
+    parser.add_argument("--query-engine", default=None)
+    parser.add_argument("--lookback-days", type=int, default=LOOKBACK_DAYS)
+    parser.add_argument(
+        "--computed-date",
+        default=datetime.date.today().isoformat(),
+        help="date the data was extracted (decides which intervals are final)",
+    )
+    parser.add_argument("--full", action="store_true", help="recompute every interval")
+    args = parser.parse_args()
+
+    cache_dir = CACHE_DIR / args.definition.stem
+    fingerprint = definition_fingerprint(
+        args.definition, data_source_fingerprint(args.dummy_tables, args.dsn)
+    )
+    fieldnames, cached_blocks, index = load_cache(cache_dir)
+
+    if args.full or not is_current(index, fingerprint):
+        # Every interval is recomputed; nothing cached is kept
+        cached_blocks, index = {}, {}
+        recompute, from_date = True, None
+    else:
+        from_date = stale_from(index, fingerprint, args.lookback_days)
+        recompute = from_date is not None
+
+    new_blocks = {}
+    if recompute:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            new_path = Path(tmp_dir) / "measures.csv"
+            stats = run_measures(
+                args.definition,
+                new_path,
+                from_date,
+                cache_dir / "generate-measures.log",
+                args.dummy_tables,
+                args.dsn,
+                args.query_engine,
+            )
+            fieldnames, new_blocks = read_rows(new_path)
+        print(
+            f"Computed {len(new_blocks)} measure x interval blocks "
+            f"from {from_date or 'the first interval'} in {stats['wall_time_s']}s"
+        )
+
+    blocks = merge(cached_blocks, new_blocks, from_date)
+    index = update_index(
+        {key: entry for key, entry in index.items() if key in blocks},
+        new_blocks,
+        fingerprint,
+        args.computed_date,
+    )
+    save_cache(cache_dir, fieldnames, blocks, index)
+    print(f"Reused {len(blocks) - len(new_blocks)} cached measure x interval blocks")
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(cache_dir / ROWS, args.output)
+
+
+if __name__ == "__main__":
+    main()
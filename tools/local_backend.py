@@ -0,0 +1,236 @@
+###################################################
+# Local SQLite stand-in for the TPP backend.
+#
+# Builds a SQLite file with the ehrQL TPP tables
+# used by analysis/dataset_def/ (patients,
+# ons_deaths, clinical_events,
+# practice_registrations, addresses), bulk loaded
+# from TPP-shaped tables generated with
+# tools/generate_dummy_tables.py (or an existing
+# dummy tables directory).
+#
+# Loading is one transaction with journaling and
+# syncing off; indexes on patient_id, dates and
+# snomedct_code are built after the load, then
+# ANALYZE gathers planner statistics. Definitions
+# then run through ehrQL's SQLite query engine, so
+# query plans and index choices can be measured
+# offline at realistic scale:
+#
+#   ehrql generate-dataset analysis/dataset_def/dataset_definition.py \
+#     --dsn sqlite:///benchmarks/sqlite/100000.db --query-engine sqlite \
+#     --output output/dataset.arrow
+#
+# Usage:
+#   python tools/local_backend.py --population-size 100000
+#   python tools/local_backend.py --tables-dir dummy_tables --database local.db
+#   python tools/local_backend.py --population-size 100000 --no-indexes
+###################################################
+
+import argparse
+import sqlite3
+import time
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+import generate_dummy_tables
+
+DATABASE_DIR = Path("benchmarks/sqlite")
+
+# Rows inserted per executemany() call
+BATCH_SIZE = 100_000
+
+# Columns and SQLite types of the ehrQL TPP tables (dates are ISO text)
+SCHEMA = {
+    "patients": {
+        "patient_id": "INTEGER",
+        "date_of_birth": "DATE",
+        "sex": "TEXT",
+        "date_of_death": "DATE",
+    },
+    "ons_deaths": {
+        "patient_id": "INTEGER",
+        "date": "DATE",
+        "place": "TEXT",
+        "underlying_cause_of_death": "TEXT",
+        **{
+            f"cause_of_death_{i:02d}": "TEXT"
+            for i in range(1, generate_dummy_tables.N_CAUSES_OF_DEATH + 1)
+        },
+    },
+    "clinical_events": {
+        "patient_id": "INTEGER",
+        "date": "DATE",
+        "snomedct_code": "TEXT",
+        "numeric_value": "FLOAT",
+        "consultation_id": "INTEGER",
+    },
+    "practice_registrations": {
+        "patient_id": "INTEGER",
+        "start_date": "DATE",
+        "end_date": "DATE",
+        "practice_pseudo_id": "INTEGER",
+        "practice_stp": "TEXT",
+        "practice_nuts1_region_name": "TEXT",
+    },
+    "addresses": {
+        "patient_id": "INTEGER",
+        "address_id": "INTEGER",
+        "start_date": "DATE",
+        "end_date": "DATE",
+        "address_type": "INTEGER",
+        "rural_urban_classification": "INTEGER",
+        "imd_rounded": "INTEGER",
+        "msoa_code": "TEXT",
+        "has_postcode": "BOOLEAN",
+        "care_home_is_potential_match": "BOOLEAN",
+        "care_home_requires_nursing": "BOOLEAN",
+        "care_home_does_not_require_nursing": "BOOLEAN",
+    },
+}
+
+# Index name: (table, columns)
+INDEXES = {
+    "ix_patients_patient_id": ("patients", ["patient_id"]),
+    "ix_ons_deaths_patient_date": ("ons_deaths", ["patient_id", "date"]),
+    "ix_clinical_events_patient_date": ("clinical_events", ["patient_id", "date"]),
+    "ix_clinical_events_code_date": ("clinical_events", ["snomedct_code", "date"]),
+    "ix_practice_registrations_patient_dates": (
+        "practice_registrations",
+        ["patient_id", "start_date", "end_date"],
+    ),
+    "ix_addresses_patient_dates": ("addresses", ["patient_id", "start_date", "end_date"]),
+}
+
+
+def database_path(size, indexes=True):
+    return DATABASE_DIR / (f"{size}.db" if indexes else f"{size}_no_indexes.db")
+
+
+def dsn(path):
+    return f"sqlite:///{path}"
+
+
+# ---------------------------------------------------------
+# Loading
+# ---------------------------------------------------------
+
+def read_tables(tables_dir):
+    tables = {}
+    for name in SCHEMA:
+        path = Path(tables_dir) / f"{name}.arrow"
+        if path.exists():
+            tables[name] = feather.read_table(path)
+        else:
+            import pyarrow.csv as pa_csv
+
+            tables[name] = pa_csv.read_csv(Path(tables_dir) / f"{name}.csv")
+    return tables
+
+
+def sql_column(column):
+    """Arrow column as Python values SQLite accepts (dates as ISO text)."""
+    if pa.types.is_date(column.type):
+        column = pc.strftime(column, format="%Y-%m-%d")
+    return column.to_pylist()
+
+
+def create_tables(connection):
+    for name, columns in SCHEMA.items():
+        connection.execute(f"DROP TABLE IF EXISTS {name}")
+        definition = ", ".join(f"{column} {sql_type}" for column, sql_type in columns.items())
+        connection.execute(f"CREATE TABLE {name} ({definition})")
+
+
+def load_table(connection, name, table):
+    columns = list(SCHEMA[name])
+    placeholders = ", ".join("?" for _ in columns)
+    insert = f"INSERT INTO {name} ({', '.join(columns)}) VALUES ({placeholders})"
+    for batch in table.select(columns).to_batches(max_chunksize=BATCH_SIZE):
+        connection.executemany(
+            insert, zip(*[sql_column(batch.column(column)) for column in columns])
+        )
+
+
+def create_indexes(connection):
+    for index, (table, columns) in INDEXES.items():
+        connection.execute(f"CREATE INDEX {index} ON {table} ({', '.join(columns)})")
+
+
+def build_database(tables, path, indexes=True):
+    """Write the tables to a new SQLite file; return load timings (s)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.unlink(missing_ok=True)
+    timings = {}
+    connection = sqlite3.connect(path, isolation_level=None)
+    try:
+        # Bulk load: no rollback journal or fsync; the file is rebuilt on failure
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute("PRAGMA locking_mode = EXCLUSIVE")
+        connection.execute("PRAGMA temp_store = MEMORY")
+        connection.execute("PRAGMA cache_size = -1000000")
+
+        start = time.perf_counter()
+        connection.execute("BEGIN")
+        create_tables(connection)
+        for name in SCHEMA:
+            load_table(connection, name, tables[name])
+        connection.execute("COMMIT")
+        timings["load_s"] = round(time.perf_counter() - start, 3)
+
+        if indexes:
+            start = time.perf_counter()
+            create_indexes(connection)
+            connection.execute("ANALYZE")
+            timings["index_s"] = round(time.perf_counter() - start, 3)
+    finally:
+        connection.close()
+    return timings
+
+
+def prepare_database(size, deceased_fraction, seed=0, indexes=True):
+    """SQLite file for a population size, built on first use."""
+    path = database_path(size, indexes)
+    if not path.exists():
+        tables = generate_dummy_tables.generate_tables(size, deceased_fraction, seed)
+        build_database(tables, path, indexes)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--population-size", type=int)
+    source.add_argument("--tables-dir", help="existing dummy tables (.arrow or .csv)")
+    parser.add_argument(
+        "--deceased-fraction",
+        type=float,
+        default=1.0,
+        help="share of patients with a death (lower it for the measure definitions)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database", type=Path, default=None)
+    parser.add_argument("--no-indexes", action="store_true")
+    args = parser.parse_args()
+
+    if args.tables_dir:
+        tables = read_tables(args.tables_dir)
+        path = args.database or DATABASE_DIR / f"{Path(args.tables_dir).name}.db"
+    else:
+        tables = generate_dummy_tables.generate_tables(
+            args.population_size, args.deceased_fraction, args.seed
+        )
+        path = args.database or database_path(args.population_size, not args.no_indexes)
+
+    timings = build_database(tables, path, indexes=not args.no_indexes)
+    print(timings)
+    print(f"--dsn {dsn(path)} --query-engine sqlite")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+###################################################
+# Per-column profile of
+# analysis/dataset_def/dataset_definition.py.
+#
+# The definition is run once with only the
+# population and once per dataset column, against
+# TPP-shaped dummy tables (as in
+# tools/benchmark.py). Each run uses a copy of the
+# definition, written next to it (so its imports
+# resolve) and removed afterwards, with every
+# `dataset.<column> = ...` assignment dropped
+# except the profiled one; the population run keeps
+# a single column that only reads the patients
+# table.
+# A column's cost is its run minus the population
+# run: wall time (best of --repeat runs) and peak
+# RSS (not measured with a container
+# EHRQL_COMMAND, see tools/ehrql_runner.py).
+#
+# Writes a JSON report ranked by cost and a
+# collapsed-stack file, which flamegraph.pl or
+# speedscope can draw (one frame per column,
+# weighted by milliseconds).
+#
+# Usage:
+#   python tools/profile_dataset.py --size 100000
+#   python tools/profile_dataset.py --columns ethnicity imd
+###################################################
+
+import argparse
+import ast
+import datetime
+import json
+from contextlib import contextmanager
+from pathlib import Path
+
+from benchmark import prepare_tables
+from ehrql_runner import count_rows, ehrql_command, run_command
+
+DEFINITION = Path("analysis/dataset_def/dataset_definition.py")
+PROFILE_DIR = Path("benchmarks/profiles")
+
+POPULATION = "population"
+
+# Only column of the population run (patients is imported by the definition)
+POPULATION_COLUMN = "dataset.in_population = patients.exists_for_patient()"
+
+
+def column_assignments(source):
+    """Column name -> (first, last) line of each `dataset.<column> = ...`."""
+    assignments = {}
+    for node in ast.parse(source).body:
+        if (
+            isinstance(node, ast.Assign)
+            and len(node.targets) == 1
+            and isinstance(node.targets[0], ast.Attribute)
+            and isinstance(node.targets[0].value, ast.Name)
+            and node.targets[0].value.id == "dataset"
+        ):
+            assignments[node.targets[0].attr] = (node.lineno, node.end_lineno)
+    return assignments
+
+
+def definition_columns(path=DEFINITION):
+    """Dataset columns assigned in the definition, without running it."""
+    return list(column_assignments(Path(path).read_text()))
+
+
+def column_definition(source, column):
+    """Definition source with only one column (or only the population)."""
+    assignments = column_assignments(source)
+    if column != POPULATION and column not in assignments:
+        raise ValueError(f"No column {column}; columns: {', '.join(assignments)}")
+    dropped = {
+        line
+        for name, (first, last) in assignments.items()
+        if name != column
+        for line in range(first, last + 1)
+    }
+    lines = [
+        line
+        for number, line in enumerate(source.splitlines(), start=1)
+        if number not in dropped
+    ]
+    if column == POPULATION:
+        lines.append(POPULATION_COLUMN)
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def column_definition_file(column, definition=DEFINITION):
+    path = definition.with_name(f"_profile_{column}.py")
+    path.write_text(column_definition(definition.read_text(), column))
+    try:
+        yield path
+    finally:
+        path.unlink()
+
+
+def profile_column(column, tables_dir, run_dir, repeat):
+    output_path = run_dir / f"{column}.arrow"
+    with column_definition_file(column) as definition:
+        runs = [
+            run_command(
+                ehrql_command(
+                    "generate-dataset",
+                    definition,
+                    "--dummy-tables",
+                    tables_dir,
+                    "--output",
+                    output_path,
+                ),
+                log_path=output_path.with_suffix(".log"),
+            )
+            for _ in range(repeat)
+        ]
+    failed = [run for run in runs if run["returncode"] != 0]
+    if failed:
+        return failed[0]
+    return {
+        "returncode": 0,
+        "wall_time_s": min(run["wall_time_s"] for run in runs),
+        # None when not measurable (see ehrql_runner.run_command)
+        "peak_rss_mb": min(
+            (run["peak_rss_mb"] for run in runs if run["peak_rss_mb"] is not None),
+            default=None,
+        ),
+        "output_rows": count_rows(output_path),
+    }
+
+
+def ranked_report(results):
+    """Columns ranked by wall time over the population-only run."""
+    base = results[POPULATION]
+    report = []
+    for column, stats in results.items():
+        entry = {"column": column, **stats}
+        if column != POPULATION and stats["returncode"] == 0 == base["returncode"]:
+            entry["column_wall_time_s"] = round(
+                max(stats["wall_time_s"] - base["wall_time_s"], 0), 3
+            )
+            if stats["peak_rss_mb"] is not None and base["peak_rss_mb"] is not None:
+                entry["column_rss_mb"] = round(
+                    max(stats["peak_rss_mb"] - base["peak_rss_mb"], 0), 1
+                )
+        report.append(entry)
+    return sorted(report, key=lambda entry: -entry.get("column_wall_time_s", -1))
+
+
+def collapsed_stacks(report, root="dataset_death_raw"):
+    """One `root;frame milliseconds` line per population / column."""
+    lines = []
+    for entry in report:
+        if entry["returncode"] != 0:
+            continue
+        if entry["column"] == POPULATION:
+            lines.append(f"{root};{POPULATION} {round(entry['wall_time_s'] * 1000)}")
+        elif "column_wall_time_s" in entry:
+            lines.append(
+                f"{root};{entry['column']} {round(entry['column_wall_time_s'] * 1000)}"
+            )
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--columns", nargs="+", default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    columns = args.columns or definition_columns()
+    timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    run_dir = PROFILE_DIR / timestamp
+    run_dir.mkdir(parents=True, exist_ok=True)
+    tables_dir = prepare_tables(args.size)
+
+    results = {}
+    for column in [POPULATION, *columns]:
+        results[column] = profile_column(column, tables_dir, run_dir, args.repeat)
+        print(column, results[column])
+
+    report = ranked_report(results)
+    (run_dir / "profile.json").write_text(
+        json.dumps({"size": args.size, "repeat": args.repeat, "columns": report}, indent=2)
+    )
+    (run_dir / "profile.collapsed").write_text(collapsed_stacks(report))
+    print(f"Profile written to {run_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+###################################################
+# Run project.yaml actions locally, skipping those
+# whose inputs have not changed.
+#
+# Each action is fingerprinted from:
+#   - its run command
+#   - its script, plus local Python modules it
+#     imports or R files it source()s
+#   - the codelists those files reference
+#   - the fingerprints of the actions it needs, and
+#     the hashes of their outputs as they are when
+#     the needs have finished
+# An action is skipped when its fingerprint matches
+# the one recorded in .action_cache/ and its outputs
+# are unchanged since that run. Fingerprints are
+# taken when an action's needs are done, so it
+# reruns when a need reran or its outputs were
+# rewritten outside the pipeline. Actions whose
+# needs are done run concurrently in a process
+# pool.
+#
+# Actions are run with `opensafely exec`
+# (override with OPENSAFELY_COMMAND).
+#
+# Usage:
+#   python tools/run_local.py                       # all actions
+#   python tools/run_local.py report_registration_at_death
+#   python tools/run_local.py --dry-run
+###################################################
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shlex
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import yaml
+
+from ehrql_runner import run_command
+
+PROJECT_PATH = Path("project.yaml")
+CACHE_DIR = Path(".action_cache")
+
+OPENSAFELY_COMMAND = shlex.split(os.environ.get("OPENSAFELY_COMMAND", "opensafely exec"))
+
+PYTHON_IMPORT = re.compile(
+    r"^\s*(?:from\s+(\w+(?:\.\w+)*)\s+import|import\s+(\w+(?:\.\w+)*))", re.MULTILINE
+)
+R_SOURCE = re.compile(r"source\(\s*here\(([^)]*)\)")
+CODELIST = re.compile(r"codelists/[\w./-]+\.csv")
+
+
+# ---------------------------------------------------------
+# Actions
+# ---------------------------------------------------------
+
+def load_actions(path=PROJECT_PATH):
+    project = yaml.safe_load(Path(path).read_text())
+    actions = {}
+    for name, action in project["actions"].items():
+        image, *args = shlex.split(action["run"])
+        outputs = [
+            pattern
+            for files in action.get("outputs", {}).values()
+            for pattern in files.values()
+        ]
+        actions[name] = {
+            "run": action["run"],
+            "image": image,
+            "args": args,
+            "needs": action.get("needs", []),
+            "outputs": outputs,
+        }
+    return actions
+
+
+def action_command(action):
+    return [*OPENSAFELY_COMMAND, action["image"], *action["args"]]
+
+
+def dependencies(actions, targets):
+    """Targets and everything they need, in dependency order."""
+    ordered = []
+
+    def visit(name, seen=()):
+        if name in seen:
+            raise ValueError(f"Circular needs: {' -> '.join([*seen, name])}")
+        if name in ordered:
+            return
+        for need in actions[name]["needs"]:
+            visit(need, (*seen, name))
+        ordered.append(name)
+
+    for target in targets:
+        visit(target)
+    return ordered
+
+
+# ---------------------------------------------------------
+# Fingerprints
+# ---------------------------------------------------------
+
+def local_files(path):
+    """A script and the local files it imports or sources, recursively."""
+    found = []
+    pending = [Path(path)]
+    while pending:
+        path = pending.pop()
+        if path in found or not path.is_file():
+            continue
+        found.append(path)
+        text = path.read_text()
+        if path.suffix == ".py":
+            for module in PYTHON_IMPORT.findall(text):
+                # Dotted imports are modules in subdirectories (e.g. dataset_def.grace_periods)
+                module_path = (module[0] or module[1]).replace(".", "/")
+                pending.append(path.parent / f"{module_path}.py")
+        elif path.suffix == ".R":
+            for parts in R_SOURCE.findall(text):
+                pending.append(Path(*re.findall(r"\"([^\"]+)\"", parts)))
+    return found
+
+
+def action_files(action):
+    """Scripts and codelists an action depends on."""
+    files = []
+    for arg in action["args"]:
+        if arg.endswith((".py", ".R")):
+            files.extend(local_files(arg))
+    codelists = {
+        Path(codelist) for file in files for codelist in CODELIST.findall(file.read_text())
+    }
+    return sorted(set(files) | codelists)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def output_hashes(action):
+    paths = sorted(path for pattern in action["outputs"] for path in Path().glob(pattern))
+    return {str(path): file_sha256(path) for path in paths}
+
+
+def fingerprint(actions, name, fingerprints):
+    """Fingerprint of an action, from its needs' fingerprints and current outputs.
+
+    Take it once the needs have finished, so their outputs are final.
+    """
+    action = actions[name]
+    digest = hashlib.sha256(action["run"].encode())
+    for path in action_files(action):
+        digest.update(f"\0{path}\0{file_sha256(path) if path.exists() else ''}".encode())
+    for need in sorted(action["needs"]):
+        digest.update(f"\0{need}\0{fingerprints[need]}".encode())
+        digest.update(json.dumps(output_hashes(actions[need]), sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+# ---------------------------------------------------------
+# Cache
+# ---------------------------------------------------------
+
+def cache_path(name):
+    return CACHE_DIR / f"{name}.json"
+
+
+def is_cached(name, action, fingerprint):
+    path = cache_path(name)
+    if not path.exists():
+        return False
+    entry = json.loads(path.read_text())
+    outputs = output_hashes(action)
+    return bool(outputs) and entry["fingerprint"] == fingerprint and entry["outputs"] == outputs
+
+
+def record(name, action, fingerprint, stats):
+    CACHE_DIR.mkdir(exist_ok=True)
+    entry = {"fingerprint": fingerprint, "outputs": output_hashes(action), **stats}
+    cache_path(name).write_text(json.dumps(entry, indent=2))
+
+
+# ---------------------------------------------------------
+# Run
+# ---------------------------------------------------------
+
+def run_action(name, command):
+    log_path = CACHE_DIR / "logs" / f"{name}.log"
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    return run_command(command, log_path=log_path)
+
+
+def run_actions(actions, names, jobs, dry_run=False, force=False):
+    """Run the stale actions among names (in dependency order); False if any failed."""
+    fingerprints = {}
+    pending = list(names)
+    done, failed, will_run = set(), set(), set()
+    running = {}
+
+    def start_ready(pool):
+        # Decide each action once its needs are done, then submit it or skip it
+        started = True
+        while started:
+            started = False
+            for name in list(pending):
+                needs = actions[name]["needs"]
+                if any(need in failed for need in needs):
+                    pending.remove(name)
+                    failed.add(name)
+                    print(f"skipped {name}: a needed action failed")
+                elif all(need in done for need in needs):
+                    pending.remove(name)
+                    started = True
+                    if dry_run and any(need in will_run for need in needs):
+                        # A need would rerun, so its outputs are not known yet
+                        stale = True
+                    else:
+                        fingerprints[name] = fingerprint(actions, name, fingerprints)
+                        stale = force or not is_cached(name, actions[name], fingerprints[name])
+                    print(f"{'run ' if stale else 'skip'} {name}")
+                    if not stale:
+                        done.add(name)
+                    elif dry_run:
+                        will_run.add(name)
+                        done.add(name)
+                    else:
+                        future = pool.submit(run_action, name, action_command(actions[name]))
+                        running[future] = name
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        start_ready(pool)
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                stats = future.result()
+                if stats["returncode"] == 0:
+                    record(name, actions[name], fingerprints[name], stats)
+                    done.add(name)
+                    print(f"done {name} ({stats['wall_time_s']}s)")
+                else:
+                    failed.add(name)
+                    print(f"FAILED {name}, see {CACHE_DIR / 'logs' / name}.log")
+            start_ready(pool)
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("actions", nargs="*", help="default: all actions")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--force", action="store_true", help="ignore the cache")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    actions = load_actions()
+    names = dependencies(actions, args.actions or list(actions))
+    if not run_actions(actions, names, args.jobs, args.dry_run, args.force):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()